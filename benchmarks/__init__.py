@@ -0,0 +1,6 @@
+"""Offline benchmarks of the hub plugin.
+
+Each case runs ``post_run_hook`` end to end in a synthetic repository pushing to a
+local bare ``origin``, with a local stand-in for the GitHub REST API. Run them with
+``make benchmark`` or ``python -m benchmarks run``.
+"""
@@ -0,0 +1,138 @@
+"""Command line interface of the benchmarks."""
+import json
+import tempfile
+from pathlib import Path
+
+import click
+from tabulate import tabulate
+
+from benchmarks.startup import HOOK_BUDGET, IMPORT_BUDGET, hook_overhead, import_time
+from benchmarks.suite import SIZES, compare, run_suite
+from edgetest_hub.plugin import COMMIT_MODES
+
+
+def _split(value: str) -> list:
+    """Split a comma separated option."""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+@click.group()
+def cli():
+    """Benchmark the hub plugin against local repositories."""
+
+
+@cli.command()
+@click.option(
+    "--sizes",
+    default="small,medium",
+    show_default=True,
+    help=f"Repository sizes, among {', '.join(SIZES)}.",
+)
+@click.option(
+    "--backends", default="cli", show_default=True, help="git_backend values."
+)
+@click.option(
+    "--commit-modes",
+    default=",".join(COMMIT_MODES),
+    show_default=True,
+    help="commit_mode values.",
+)
+@click.option(
+    "--concurrency", default="1", show_default=True, help="concurrency values."
+)
+@click.option("--repeat", type=click.IntRange(min=1), default=5, show_default=True)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default="benchmark-results.json",
+    show_default=True,
+    help="Where the results are written.",
+)
+def run(sizes, backends, commit_modes, concurrency, repeat, output):
+    """Run the benchmarks and write the results as JSON."""
+    with tempfile.TemporaryDirectory(prefix="edgetest-hub-bench-") as root:
+        results = run_suite(
+            Path(root),
+            _split(sizes),
+            _split(backends),
+            _split(commit_modes),
+            [int(workers) for workers in _split(concurrency)],
+            repeat,
+        )
+    output.write_text(json.dumps(results, indent=2))
+    click.echo(
+        tabulate(
+            [
+                (
+                    r["size"],
+                    r["git_backend"],
+                    r["commit_mode"],
+                    r["concurrency"],
+                    r["scenario"],
+                    f"{r['median'] * 1000:.1f}",
+                    r["commands"],
+                    r["api_requests"],
+                )
+                for r in results["results"]
+            ],
+            headers=[
+                "Size",
+                "Backend",
+                "Commit mode",
+                "Concurrency",
+                "Scenario",
+                "Median (ms)",
+                "Commands",
+                "API requests",
+            ],
+        )
+    )
+    click.echo(f"\nWrote {output}")
+
+
+@cli.command(name="compare")
+@click.argument(
+    "baseline", type=click.Path(exists=True, dir_okay=False, path_type=Path)
+)
+@click.argument("current", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+def compare_command(baseline, current):
+    """Compare the median times of two benchmark result files."""
+    rows = compare(json.loads(baseline.read_text()), json.loads(current.read_text()))
+    click.echo(
+        tabulate(
+            rows,
+            headers=["Case", "Baseline (ms)", "Current (ms)", "Ratio"],
+            floatfmt=".2f",
+        )
+    )
+
+
+@cli.command()
+@click.option("--repeat", type=click.IntRange(min=1), default=5, show_default=True)
+def startup(repeat):
+    """Time what the plugin adds to edgetest when it has nothing to do.
+
+    Exits with an error if the import or a hook is over its budget.
+    """
+    rows = [
+        ("import, after edgetest", import_time(repeat=repeat), IMPORT_BUDGET),
+        ("import, on its own", import_time(preload=(), repeat=repeat), None),
+    ]
+    rows += [(name, seconds, HOOK_BUDGET) for name, seconds in hook_overhead().items()]
+    click.echo(
+        tabulate(
+            [
+                (name, seconds * 1000, "" if budget is None else budget * 1000)
+                for name, seconds, budget in rows
+            ],
+            headers=["Case", "Time (ms)", "Budget (ms)"],
+            floatfmt=".3f",
+        )
+    )
+    if any(budget is not None and seconds > budget for _, seconds, budget in rows):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    cli()
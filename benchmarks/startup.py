@@ -0,0 +1,120 @@
+"""What the hub plugin adds to edgetest when it has nothing to do."""
+import json
+import os
+import subprocess
+import sys
+import timeit
+from typing import Dict, List, Sequence
+from unittest.mock import patch
+
+# seconds that importing the plugin may add on top of ``edgetest.interface``
+IMPORT_BUDGET = 0.025
+# seconds that a hook may take when the plugin is skipped
+HOOK_BUDGET = 0.0001
+# modules only imported once the plugin has something to submit
+DEFERRED_MODULES = (
+    "concurrent.futures",
+    "edgetest.report",
+    "hashlib",
+    "http.client",
+    "sqlite3",
+    "ssl",
+    "uuid",
+)
+# third-party modules only needed by some options or commands
+OPTIONAL_MODULES = ("github", "pygit2", "tabulate")
+
+
+def _python(code: str) -> str:
+    """Run Python code in a fresh interpreter and return its standard error.
+
+    Bytecode is written and read as usual, so only the first run compiles the
+    modules.
+    """
+    env = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        check=True,
+        capture_output=True,
+        text=True,
+        env=env,
+    ).stderr
+
+
+def import_time(
+    module: str = "edgetest_hub.plugin",
+    preload: Sequence[str] = ("edgetest.interface",),
+    repeat: int = 5,
+) -> float:
+    """Time the import of a module in a fresh interpreter.
+
+    Parameters
+    ----------
+    module : str, optional (default "edgetest_hub.plugin")
+        The module to import.
+    preload : Sequence[str], optional (default ("edgetest.interface",))
+        The modules imported first, and not counted. edgetest has imported its
+        command line interface by the time it loads its plugins.
+    repeat : int, optional (default 5)
+        The number of timed imports, after one that is not timed.
+
+    Returns
+    -------
+    float
+        The fastest import, in seconds.
+    """
+    code = "".join(f"import {name}; " for name in list(preload) + [module])
+    times = []
+    for _ in range(repeat + 1):
+        for line in _python(code).splitlines():
+            parts = line.split("|")
+            if len(parts) == 3 and parts[2].strip() == module:
+                times.append(int(parts[1]) / 1e6)
+    return min(times[1:])
+
+
+def imported_modules(module: str = "edgetest_hub.plugin") -> List[str]:
+    """List the modules loaded by importing a module in a fresh interpreter."""
+    code = (
+        "import json, sys; before = set(sys.modules); "
+        f"import {module}; "
+        "sys.stderr.write(json.dumps(sorted(set(sys.modules) - before)))"
+    )
+    return json.loads(_python(code).splitlines()[-1])
+
+
+def hook_overhead(number: int = 1000) -> Dict[str, float]:
+    """Time the hooks of the plugin when it is skipped.
+
+    The log messages of the plugin are turned off while the hooks are timed.
+
+    Parameters
+    ----------
+    number : int, optional (default 1000)
+        The number of calls of each hook.
+
+    Returns
+    -------
+    Dict[str, float]
+        The mean time of a call, in seconds, keyed by hook and reason.
+    """
+    from edgetest_hub import plugin
+
+    tester = type("Tester", (), {"status": True})()
+    cases = {
+        "no token": ({}, {"hub": {"git_repo_org": "org", "git_repo_name": "repo"}}),
+        "no hub section": ({plugin.GIT_TOKEN_ENVNAME: "token"}, {"envs": []}),
+    }
+    env = {k: v for k, v in os.environ.items() if k != plugin.GIT_TOKEN_ENVNAME}
+    results = {}
+    for reason, (update, conf) in cases.items():
+        with patch.dict(os.environ, {**env, **update}, clear=True), patch.object(
+            plugin.LOG, "disabled", True
+        ):
+            results[f"pre_run_hook ({reason})"] = timeit.timeit(
+                lambda: plugin.pre_run_hook(conf), number=number
+            )
+            results[f"post_run_hook ({reason})"] = timeit.timeit(
+                lambda: plugin.post_run_hook([tester], conf), number=number
+            )
+    return {name: seconds / number for name, seconds in results.items()}
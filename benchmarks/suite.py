@@ -0,0 +1,374 @@
+"""Synthetic repositories and the benchmark cases run against them."""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+from edgetest.logger import get_logger
+
+from edgetest_hub import __version__
+from edgetest_hub.fleet import load_config
+from edgetest_hub.plugin import post_run_hook
+from tests.github_server import FakeGitHub
+
+LOG = get_logger(__name__)
+
+TOKEN = "benchmark-token"
+ORG = "bench-org"
+SCENARIOS = ("no change", "change", "failure")
+CONFIG = """
+[edgetest.hub]
+git_repo_org = {org}
+git_repo_name = {name}
+pr_reviewers = reviewer
+open_issue_on_fail = True
+github_client = rest
+api_url = {api_url}
+git_backend = {backend}
+commit_mode = {commit_mode}
+concurrency = {concurrency}
+trace_path = {trace_path}
+[edgetest.envs.bench]
+upgrade =
+    benchpkg
+command =
+    pytest tests
+"""
+
+
+class Size(NamedTuple):
+    """The size of a synthetic repository.
+
+    Parameters
+    ----------
+    name : str
+        The name of the size.
+    files : int
+        The number of tracked files, and so the size of the index.
+    depth : int
+        The number of commits in the history.
+    """
+
+    name: str
+    files: int
+    depth: int
+
+
+SIZES = {
+    size.name: size
+    for size in (
+        Size("small", 10, 10),
+        Size("medium", 1_000, 200),
+        Size("large", 10_000, 1_000),
+    )
+}
+
+
+class Tester:
+    """A stand-in for an edgetest ``TestPackage`` that already ran."""
+
+    envname = "bench"
+    upgrade = ["benchpkg"]
+
+    def __init__(self, status: bool):
+        """Initialize the tester."""
+        self.status = status
+        self.setup_status = True
+
+    def upgraded_packages(self) -> List[Dict[str, str]]:
+        """List the upgraded packages."""
+        return [{"name": "benchpkg", "version": "2.0.0"}]
+
+    def lowered_packages(self) -> List[Dict[str, str]]:
+        """List the lowered packages."""
+        return []
+
+
+def _git(cwd: Path, *args: str, stdin: Optional[bytes] = None) -> str:
+    """Run a git command in a directory."""
+    return subprocess.run(
+        ("git",) + args, cwd=cwd, input=stdin, check=True, capture_output=True
+    ).stdout.decode("utf-8")
+
+
+def _fast_import_stream(size: Size, config: str) -> bytes:
+    """Build a ``git fast-import`` stream with the files and history of a size."""
+
+    def blob(path: str, text: str) -> bytes:
+        data = text.encode("utf-8")
+        return b"M 100644 inline %s\ndata %d\n%s\n" % (path.encode(), len(data), data)
+
+    def commit(mark: int, message: str, changes: List[bytes]) -> bytes:
+        data = message.encode("utf-8")
+        header = (
+            b"commit refs/heads/develop\nmark :%d\n"
+            b"committer Bench <bench@example.com> %d +0000\ndata %d\n%s\n"
+            % (mark, 1_600_000_000 + mark, len(data), data)
+        )
+        parent = b"from :%d\n" % (mark - 1) if mark > 1 else b""
+        return header + parent + b"".join(changes)
+
+    paths = [f"src/pkg{i // 100}/module{i}.py" for i in range(size.files)]
+    stream = [
+        commit(
+            1,
+            "initial",
+            [blob(path, f"VALUE = {i}\n") for i, path in enumerate(paths)]
+            + [
+                blob("setup.cfg", config),
+                blob("requirements.txt", "benchpkg==1.0.0\n"),
+            ],
+        )
+    ]
+    for mark in range(2, size.depth + 1):
+        path = paths[mark % len(paths)]
+        stream.append(commit(mark, f"change {mark}", [blob(path, f"VALUE = {mark}\n")]))
+    return b"".join(stream)
+
+
+def make_repo(root: Path, name: str, size: Size, config: str) -> Path:
+    """Create a repository with a local bare ``origin``.
+
+    Parameters
+    ----------
+    root : Path
+        The directory holding the repository and ``origins/<name>.git``.
+    name : str
+        The name of the repository.
+    size : Size
+        The number of files and commits.
+    config : str
+        The content of ``setup.cfg``.
+
+    Returns
+    -------
+    Path
+        The repository, on ``develop``, in sync with ``origin``.
+    """
+    origin = root / "origins" / f"{name}.git"
+    repo = root / name
+    _git(root, "init", "--quiet", "--bare", "--initial-branch=develop", str(origin))
+    _git(root, "init", "--quiet", "--initial-branch=develop", str(repo))
+    _git(repo, "fast-import", "--quiet", stdin=_fast_import_stream(size, config))
+    _git(repo, "checkout", "--quiet", "--force", "develop")
+    _git(repo, "remote", "add", "origin", str(origin))
+    _git(repo, "push", "--quiet", "origin", "develop")
+    return repo
+
+
+@contextmanager
+def _environment(origins: Path) -> Iterator[None]:
+    """Send the pushes of the plugin to the local origins, with a dummy token."""
+    update = {
+        "GITHUB_TOKEN": TOKEN,
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": f"url.{origins.as_uri()}/.insteadOf",
+        "GIT_CONFIG_VALUE_0": f"https://{TOKEN}@github.com/{ORG}/",
+    }
+    saved = {key: os.environ.get(key) for key in update}
+    os.environ.update(update)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def _reset(repo: Path, github: FakeGitHub, scenario: str):
+    """Put a repository and the fake GitHub back in their initial state."""
+    _git(repo, "checkout", "--quiet", "--force", "develop")
+    _git(repo, "reset", "--quiet", "--hard", "origin/develop")
+    for args in (("branch", "-D", "dep-updates"), ("push", "origin", ":dep-updates")):
+        try:
+            _git(repo, *args)
+        except subprocess.CalledProcessError:
+            pass  # not created by the previous run
+    github.pulls.clear()
+    github.issues.clear()
+    if scenario == "change":
+        (repo / "requirements.txt").write_text("benchpkg==2.0.0\n")
+
+
+def _trace_summary(path: Path) -> Dict[str, Any]:
+    """Get the step durations and the number of commands from a trace file."""
+    events = json.loads(path.read_text())["traceEvents"]
+    steps: Dict[str, float] = {}
+    for event in events:
+        if event["cat"] == "step":
+            steps[event["name"]] = steps.get(event["name"], 0) + event["dur"] / 1e6
+    return {
+        "steps": steps,
+        "commands": sum(event["cat"] == "command" for event in events),
+        "api_requests": sum(event["cat"] == "api" for event in events),
+    }
+
+
+def run_case(
+    root: Path,
+    github: FakeGitHub,
+    size: Size,
+    backend: str,
+    commit_mode: str,
+    concurrency: int,
+    repeat: int,
+) -> List[Dict[str, Any]]:
+    """Benchmark every scenario of one repository size and configuration.
+
+    Returns
+    -------
+    List[Dict]
+        One result per scenario, with the wall time of each repetition.
+    """
+    name = f"{size.name}-{backend}-{commit_mode}-{concurrency}"
+    trace = root / f"{name}.trace.json"
+    config = CONFIG.format(
+        org=ORG,
+        name=name,
+        api_url=github.url,
+        backend=backend,
+        commit_mode=commit_mode,
+        concurrency=concurrency,
+        trace_path=trace,
+    )
+    repo = make_repo(root, name, size, config)
+    conf = load_config(repo / "setup.cfg")
+
+    results = []
+    cwd = os.getcwd()
+    os.chdir(repo)
+    try:
+        for scenario in SCENARIOS:
+            tester = Tester(status=scenario != "failure")
+            seconds, traces = [], []
+            for _ in range(repeat):
+                _reset(repo, github, scenario)
+                start = time.perf_counter()
+                post_run_hook([tester], conf)
+                seconds.append(time.perf_counter() - start)
+                traces.append(_trace_summary(trace))
+            step_names = sorted({step for t in traces for step in t["steps"]})
+            results.append(
+                {
+                    "size": size.name,
+                    "files": size.files,
+                    "depth": size.depth,
+                    "scenario": scenario,
+                    "git_backend": backend,
+                    "commit_mode": commit_mode,
+                    "concurrency": concurrency,
+                    "seconds": seconds,
+                    "min": min(seconds),
+                    "median": statistics.median(seconds),
+                    "commands": traces[-1]["commands"],
+                    "api_requests": traces[-1]["api_requests"],
+                    "steps": {
+                        step: statistics.median(t["steps"].get(step, 0) for t in traces)
+                        for step in step_names
+                    },
+                }
+            )
+            LOG.info(
+                f"{name} {scenario}: median {results[-1]['median'] * 1000:.1f}ms "
+                f"over {repeat} runs"
+            )
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def run_suite(
+    root: Path,
+    sizes: Sequence[str] = ("small", "medium"),
+    backends: Sequence[str] = ("cli",),
+    commit_modes: Sequence[str] = ("checkout", "plumbing", "worktree"),
+    concurrency: Sequence[int] = (1,),
+    repeat: int = 5,
+) -> Dict[str, Any]:
+    """Run the benchmark cases.
+
+    Parameters
+    ----------
+    root : Path
+        An empty directory for the synthetic repositories.
+    sizes : Sequence[str], optional (default ("small", "medium"))
+        The repository sizes, from ``SIZES``.
+    backends : Sequence[str], optional (default ("cli",))
+        The ``git_backend`` values.
+    commit_modes : Sequence[str], optional
+        The ``commit_mode`` values. Defaults to all of them.
+    concurrency : Sequence[int], optional (default (1,))
+        The ``concurrency`` values.
+    repeat : int, optional (default 5)
+        The number of timed runs of each scenario.
+
+    Returns
+    -------
+    Dict
+        The ``environment`` the suite ran in and the ``results`` of each case.
+    """
+    results = []
+    with FakeGitHub() as github, _environment(root / "origins"):
+        for size in sizes:
+            for backend in backends:
+                for commit_mode in commit_modes:
+                    for workers in concurrency:
+                        results += run_case(
+                            root,
+                            github,
+                            SIZES[size],
+                            backend,
+                            commit_mode,
+                            workers,
+                            repeat,
+                        )
+    return {
+        "environment": {
+            "edgetest_hub": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "git": _git(root, "--version").strip(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[List[Any]]:
+    """Compare the median times of two suite runs.
+
+    Parameters
+    ----------
+    baseline : Dict
+        The results of ``run_suite`` to compare with.
+    current : Dict
+        The new results.
+
+    Returns
+    -------
+    List[List]
+        For each case in both runs: the case, the baseline and current medians in
+        milliseconds, and their ratio.
+    """
+
+    def key(result: Dict[str, Any]) -> str:
+        return (
+            f"{result['size']} {result['git_backend']} {result['commit_mode']} "
+            f"x{result['concurrency']} {result['scenario']}"
+        )
+
+    before = {key(result): result for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        if key(result) in before:
+            old, new = before[key(result)]["median"], result["median"]
+            ratio = new / old if old else float("nan")
+            rows.append([key(result), old * 1000, new * 1000, ratio])
+    return rows
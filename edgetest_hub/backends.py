@@ -0,0 +1,853 @@
+"""Git backends used to prepare, commit and push the updater branch."""
+import os
+import posixpath
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Type
+
+from edgetest.logger import get_logger
+
+from edgetest_hub.utils import command_environ, git_environment
+
+LOG = get_logger(__name__)
+
+GIT_COMMAND = "git"
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+RunCommand = Callable[..., Tuple[str, int]]
+
+
+def blob_id(data: bytes) -> str:
+    """Compute the git object ID of a blob.
+
+    Parameters
+    ----------
+    data : bytes
+        The content of the blob.
+
+    Returns
+    -------
+    str
+        The SHA-1 object ID, as computed by ``git hash-object``.
+    """
+    import hashlib
+
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def worktree_blob_ids(paths: Iterable[str]) -> Dict[str, str]:
+    """Compute the blob IDs of files in the working tree.
+
+    Files that don't exist are left out. No git filters (e.g. ``autocrlf``) are
+    applied, so the IDs only match files git stores byte for byte.
+
+    Parameters
+    ----------
+    paths : Iterable[str]
+        The paths to the files.
+
+    Returns
+    -------
+    Dict[str, str]
+        The blob ID of each existing file.
+    """
+    return {
+        path: blob_id(Path(path).read_bytes()) for path in paths if Path(path).is_file()
+    }
+
+
+def parse_porcelain_v2(out: str) -> List[str]:
+    """Parse the tracked paths out of ``git status --porcelain=v2 -z``.
+
+    Parameters
+    ----------
+    out : str
+        The output of the command.
+
+    Returns
+    -------
+    List[str]
+        The changed, renamed and unmerged paths.
+    """
+    paths = []
+    entries = iter(out.split("\0"))
+    for entry in entries:
+        if entry.startswith("1 "):
+            paths.append(entry.split(" ", 8)[8])
+        elif entry.startswith("2 "):
+            paths.append(entry.split(" ", 9)[9])
+            next(entries, None)  # the original path of the rename or copy
+        elif entry.startswith("u "):
+            paths.append(entry.split(" ", 10)[10])
+    return paths
+
+
+class GitBackend:
+    """Run ``git`` operations through the command line.
+
+    Every operation is a separate ``git`` process launched through ``run_command``.
+    Failures raise a ``RuntimeError``, mirroring ``edgetest.utils._run_command``.
+
+    Parameters
+    ----------
+    run_command : Callable
+        Function used to execute the commands. It must follow the signature and
+        error handling of ``edgetest_hub.utils._run_command``.
+    path : str, optional (default None)
+        The working tree to run the commands in. Defaults to the current working
+        directory.
+    """
+
+    name = "cli"
+
+    def __init__(self, run_command: RunCommand, path: Optional[str] = None):
+        """Initialize the backend."""
+        self._run_command = run_command
+        self.path = path
+        self._common_dir: Optional[Path] = None
+        self._prefix: Optional[str] = None
+
+    def _git(self, *args, stdin: Optional[str] = None) -> Tuple[str, int]:
+        """Run a ``git`` command."""
+        if self.path is not None:
+            args = ("-C", self.path) + args
+        if stdin is None:
+            return self._run_command(GIT_COMMAND, *args)
+        return self._run_command(GIT_COMMAND, *args, stdin=stdin)
+
+    def common_dir(self) -> Path:
+        """Get the ``.git`` directory shared by all the worktrees of the repository."""
+        if self._common_dir is None:
+            out, _ = self._git("rev-parse", "--git-common-dir")
+            self._common_dir = Path(self.path or ".", out.strip()).resolve()
+        return self._common_dir
+
+    def worktree(self, path: str) -> "GitBackend":
+        """Get a command line backend for a linked worktree.
+
+        The command line is always used because ``libgit2`` doesn't support
+        sparse checkouts.
+        """
+        return GitBackend(self._run_command, str(path))
+
+    def prepare_worktree(
+        self, path: str, branch: str, start_point: str, paths: Iterable[str]
+    ):
+        """Reset a branch in a cached, sparse linked worktree.
+
+        The worktree is created on first use with only ``paths`` checked out, and
+        reused afterwards. The main working tree is never touched.
+
+        Parameters
+        ----------
+        path : str
+            The location of the worktree.
+        branch : str
+            The branch to create or reset in the worktree.
+        start_point : str
+            The revision to reset the branch to. Falls back to the ``HEAD`` of
+            the main working tree if it can't be checked out.
+        paths : Iterable[str]
+            The files to check out, relative to the working directory.
+
+        Notes
+        -----
+        A branch can only be checked out in one worktree. If ``branch`` is checked
+        out elsewhere, e.g. in the main working tree, the worktree is left on a
+        detached ``HEAD`` at ``start_point`` instead, and the commit is pushed
+        with ``push(..., source="HEAD")``.
+        """
+        worktree = self.worktree(path)
+        if not Path(path, ".git").exists():
+            self._add_sparse_worktree(path, paths)
+        if self._checked_out_elsewhere(branch, path):
+            LOG.info(
+                f"Branch {branch} is checked out in another worktree. Committing on "
+                "a detached HEAD."
+            )
+            checkout = ["checkout", "--force", "--detach"]
+        else:
+            checkout = ["checkout", "--force", "-B", branch]
+        try:
+            worktree._git(*checkout, start_point)
+        except RuntimeError:
+            worktree._git(*checkout, self.rev_parse("HEAD"))
+
+    def add_worktree(self, path: str, rev: str, paths: Iterable[str]) -> "GitBackend":
+        """Create a sparse linked worktree on a detached ``HEAD``.
+
+        Parameters
+        ----------
+        path : str
+            The location of the worktree. It must not exist.
+        rev : str
+            The revision to check out.
+        paths : Iterable[str]
+            The files to check out, relative to the working directory.
+
+        Returns
+        -------
+        GitBackend
+            The backend of the worktree.
+        """
+        worktree = self._add_sparse_worktree(path, paths)
+        worktree._git("checkout", "--force", "--detach", rev)
+        return worktree
+
+    def remove_worktree(self, path: str):
+        """Remove a linked worktree, with any changes in it."""
+        self._git("worktree", "remove", "--force", str(path))
+
+    def show_prefix(self) -> str:
+        """Get the path of the working directory from the top of the worktree.
+
+        Returns
+        -------
+        str
+            The path, with a trailing ``/``, or an empty string at the top.
+        """
+        if self._prefix is None:
+            out, _ = self._git("rev-parse", "--show-prefix")
+            self._prefix = (out or "").strip()
+        return self._prefix
+
+    def _root_path(self, path: str) -> str:
+        """Get the path of a file from the top of the worktree.
+
+        Paths given to the backend are relative to the working directory, like the
+        ``git`` command line, while trees and the index are keyed from the top.
+        """
+        prefix = self.show_prefix()
+        return posixpath.normpath(prefix + path) if prefix else path
+
+    def _add_sparse_worktree(self, path: str, paths: Iterable[str]) -> "GitBackend":
+        """Create a linked worktree with only ``paths`` to be checked out."""
+        self._git("worktree", "prune")
+        self._git("worktree", "add", "--no-checkout", "--detach", str(path))
+        worktree = self.worktree(path)
+        worktree._git(
+            "sparse-checkout",
+            "set",
+            "--no-cone",
+            *(f"/{self._root_path(p)}" for p in paths),
+        )
+        return worktree
+
+    def _checked_out_elsewhere(self, branch: str, path: str) -> bool:
+        """Check if a branch is checked out in a worktree other than ``path``."""
+        out, _ = self._git("worktree", "list", "--porcelain")
+        current = None
+        for line in (out or "").splitlines():
+            if line.startswith("worktree "):
+                current = Path(line[len("worktree ") :]).resolve()
+            elif (
+                line == f"branch refs/heads/{branch}"
+                and current != Path(path).resolve()
+            ):
+                return True
+        return False
+
+    def delete_remote_branch(self, url: str, branch: str):
+        """Delete a branch on the remote."""
+        self._git("push", url, "--delete", branch)
+
+    def delete_branch(self, branch: str):
+        """Delete a local branch."""
+        self._git("branch", "-D", branch)
+
+    def clean(self):
+        """Remove untracked files and directories from the working directory."""
+        self._git("clean", "-fd")
+
+    def checkout_branch(self, branch: str, start_point: Optional[str] = None):
+        """Create and checkout a new branch.
+
+        Parameters
+        ----------
+        branch : str
+            The name of the new branch.
+        start_point : str, optional (default None)
+            The revision to branch from. Defaults to ``HEAD``.
+        """
+        if start_point is None:
+            self._git("checkout", "-b", branch)
+        else:
+            self._git("checkout", "-b", branch, start_point)
+
+    def changed_files(self, paths: Iterable[str]) -> List[str]:
+        """Get the tracked files that differ from ``HEAD``.
+
+        Untracked files are not reported, like ``git diff-index HEAD``.
+
+        Parameters
+        ----------
+        paths : Iterable[str]
+            The paths to check.
+
+        Returns
+        -------
+        List[str]
+            The paths with staged or unstaged changes, relative to the working
+            directory like ``paths``.
+        """
+        out, _ = self._git(
+            "status", "--porcelain=v2", "-z", "--untracked-files=no", "--", *paths
+        )
+        changed = parse_porcelain_v2(out or "")
+        if not changed:
+            return changed
+        # ``git status --porcelain`` paths are relative to the top of the worktree
+        prefix = self.show_prefix()
+        if not prefix:
+            return changed
+        return [posixpath.relpath(path, prefix) for path in changed]
+
+    def add(self, *paths: str):
+        """Add files to the index."""
+        self._git("add", *paths)
+
+    def commit(self, message: str):
+        """Commit the index."""
+        with git_environment([], {"PRE_COMMIT_ALLOW_NO_CONFIG": "1"}):
+            self._git("commit", "-m", message)
+
+    def fetch(self, url: str, branch: str):
+        """Fetch a single branch from a remote into ``FETCH_HEAD``."""
+        self._git("fetch", "--no-tags", url, f"refs/heads/{branch}")
+
+    def blob_ids(self, rev: str, paths: Iterable[str]) -> Dict[str, str]:
+        """Get the blob IDs of files in a commit.
+
+        Parameters
+        ----------
+        rev : str
+            The revision to read.
+        paths : Iterable[str]
+            The paths to the files, relative to the working directory. Paths
+            missing from the commit are left out.
+
+        Returns
+        -------
+        Dict[str, str]
+            The blob ID of each file found in the commit.
+        """
+        roots = {self._root_path(path): path for path in paths}
+        out, _ = self._git("ls-tree", "--full-tree", rev, "--", *roots)
+        blobs = {}
+        for line in (out or "").splitlines():
+            meta, _, path = line.partition("\t")
+            _, kind, sha = meta.split()
+            if kind == "blob" and path in roots:
+                blobs[roots[path]] = sha
+        return blobs
+
+    def rev_parse(self, rev: str) -> str:
+        """Resolve a revision to a commit SHA."""
+        out, _ = self._git("rev-parse", "--verify", f"{rev}^{{commit}}")
+        return out.strip()
+
+    def read_file(self, rev: str, path: str) -> Optional[str]:
+        """Read a file in a commit.
+
+        Parameters
+        ----------
+        rev : str
+            The revision to read.
+        path : str
+            The path to the file, relative to the working directory.
+
+        Returns
+        -------
+        str or None
+            The content of the file, or None if it is not in the commit.
+        """
+        blob = self.blob_ids(rev, [path]).get(path)
+        if blob is None:
+            return None
+        out, _ = self._git("cat-file", "blob", blob)
+        return out
+
+    def commit_files(
+        self, branch: str, parent: str, paths: Iterable[str], message: str
+    ) -> str:
+        """Commit files from the working tree to a branch without checking it out.
+
+        The files are written as blobs, the tree of ``parent`` is rewritten with
+        them, and ``branch`` is pointed at the new commit. The index, the working
+        tree and the current branch are left alone, and no hooks are run.
+
+        Parameters
+        ----------
+        branch : str
+            The branch to create or reset to the new commit.
+        parent : str
+            The commit to build on.
+        paths : Iterable[str]
+            The files to commit, relative to the working directory. Files missing
+            from the working tree are removed from the commit.
+        message : str
+            The commit message.
+
+        Returns
+        -------
+        str
+            The SHA of the new commit.
+        """
+        paths = list(paths)
+        existing = [path for path in paths if Path(self.path or "", path).is_file()]
+        blobs: Dict[str, Optional[str]] = dict.fromkeys(map(self._root_path, paths))
+        if existing:
+            out, _ = self._git("hash-object", "-w", "--", *existing)
+            blobs.update(zip(map(self._root_path, existing), out.split()))
+        return self._commit_blobs(branch, parent, blobs, message)
+
+    def commit_contents(
+        self, branch: str, parent: str, files: Mapping[str, Optional[str]], message: str
+    ) -> str:
+        """Commit file contents to a branch without checking it out.
+
+        Same as ``commit_files``, but the content of each file is given instead of
+        being read from the working tree, so several branches can be built from
+        the same working tree.
+
+        Parameters
+        ----------
+        branch : str
+            The branch to create or reset to the new commit.
+        parent : str
+            The commit to build on.
+        files : Mapping[str, Optional[str]]
+            The content of each file, relative to the working directory. Files
+            with None are removed from the commit.
+        message : str
+            The commit message.
+
+        Returns
+        -------
+        str
+            The SHA of the new commit.
+        """
+        blobs: Dict[str, Optional[str]] = {}
+        for path, text in files.items():
+            if text is None:
+                blobs[self._root_path(path)] = None
+            else:
+                out, _ = self._git(
+                    "hash-object", "-w", "--stdin", f"--path={path}", stdin=text
+                )
+                blobs[self._root_path(path)] = out.strip()
+        return self._commit_blobs(branch, parent, blobs, message)
+
+    def _commit_blobs(
+        self, branch: str, parent: str, blobs: Dict[str, Optional[str]], message: str
+    ) -> str:
+        """Commit blobs on top of ``parent`` and point ``branch`` at the commit."""
+        tree = self._write_tree(parent, blobs)
+        out, _ = self._git("commit-tree", tree, "-p", parent, "-m", message)
+        commit = out.strip()
+        self._git("update-ref", f"refs/heads/{branch}", commit)
+        return commit
+
+    def _write_tree(self, base: Optional[str], blobs: Dict[str, Optional[str]]) -> str:
+        """Write a copy of the ``base`` tree with some blobs replaced.
+
+        Only the trees on the paths to the blobs are read and written.
+        """
+        entries: Dict[str, List[str]] = {}
+        if base is not None:
+            out, _ = self._git("ls-tree", "--full-tree", "-z", base)
+            for entry in out.split("\0"):
+                if entry:
+                    meta, _, name = entry.partition("\t")
+                    entries[name] = meta.split()
+        subtrees: Dict[str, Dict[str, Optional[str]]] = {}
+        for path, sha in blobs.items():
+            name, sep, rest = path.partition("/")
+            if sep:
+                subtrees.setdefault(name, {})[rest] = sha
+            elif sha is None:
+                entries.pop(name, None)
+            else:
+                mode = entries[name][0] if name in entries else "100644"
+                entries[name] = [mode, "blob", sha]
+        for name, subblobs in subtrees.items():
+            sub = entries.get(name)
+            tree = self._write_tree(
+                sub[2] if sub and sub[1] == "tree" else None, subblobs
+            )
+            if tree == EMPTY_TREE:
+                entries.pop(name, None)
+            else:
+                entries[name] = ["040000", "tree", tree]
+        out, _ = self._git(
+            "mktree",
+            "-z",
+            stdin="".join(
+                f"{mode} {kind} {sha}\t{name}\0"
+                for name, (mode, kind, sha) in entries.items()
+            ),
+        )
+        return out.strip()
+
+    def remote_head(self, url: str, branch: str) -> Optional[str]:
+        """Get the commit a branch points to on the remote.
+
+        Parameters
+        ----------
+        url : str
+            The remote name or URL.
+        branch : str
+            The name of the branch.
+
+        Returns
+        -------
+        str or None
+            The commit SHA, or ``None`` if the branch doesn't exist on the remote.
+        """
+        return self.remote_ref(url, f"refs/heads/{branch}")
+
+    def remote_ref(self, url: str, ref: str) -> Optional[str]:
+        """Get the object a ref points to on the remote.
+
+        Parameters
+        ----------
+        url : str
+            The remote name or URL.
+        ref : str
+            The full name of the ref, e.g. ``refs/heads/main``.
+
+        Returns
+        -------
+        str or None
+            The SHA, or ``None`` if the ref doesn't exist on the remote.
+        """
+        out, _ = self._git("ls-remote", url, ref)
+        for line in (out or "").splitlines():
+            sha, _, name = line.partition("\t")
+            if name == ref:
+                return sha
+        return None
+
+    def fetch_ref(self, url: str, ref: str):
+        """Fetch a ref from a remote into the local ref of the same name."""
+        self._git("fetch", "--no-tags", url, f"+{ref}:{ref}")
+
+    def commit_message(self, rev: str) -> str:
+        """Read the message of a commit."""
+        out, _ = self._git("cat-file", "commit", rev)
+        return out.partition("\n\n")[2]
+
+    def write_marker(self, message: str) -> str:
+        """Write a commit of the empty tree, with no parent, that no branch points to.
+
+        Parameters
+        ----------
+        message : str
+            The commit message.
+
+        Returns
+        -------
+        str
+            The SHA of the commit.
+        """
+        out, _ = self._git("commit-tree", EMPTY_TREE, "-m", message)
+        return out.strip()
+
+    def push_ref(self, url: str, ref: str, sha: Optional[str], lease: str):
+        """Set or delete a ref on a remote, if it still points to ``lease``.
+
+        Parameters
+        ----------
+        url : str
+            The remote name or URL.
+        ref : str
+            The full name of the ref.
+        sha : str or None
+            The object to point the ref to. ``None`` deletes the ref.
+        lease : str
+            The object the remote ref must point to. An empty string requires the
+            ref to not exist.
+        """
+        self._git(
+            "push", f"--force-with-lease={ref}:{lease}", url, f"{sha or ''}:{ref}"
+        )
+
+    def push(
+        self,
+        remote: str,
+        branch: str,
+        lease: Optional[str] = None,
+        source: Optional[str] = None,
+    ):
+        """Push a branch to a remote.
+
+        Parameters
+        ----------
+        remote : str
+            The remote name or URL.
+        branch : str
+            The name of the branch.
+        lease : str, optional (default None)
+            Force the push as long as the remote branch still points to this
+            commit. An empty string requires the remote branch to not exist.
+        source : str, optional (default None)
+            The revision to push to the remote ``branch``, e.g. ``HEAD``. Defaults
+            to the local ``branch``.
+        """
+        refspec = branch if source is None else f"{source}:refs/heads/{branch}"
+        if lease is None:
+            self._git("push", remote, refspec)
+        else:
+            self._git(
+                "push",
+                f"--force-with-lease=refs/heads/{branch}:{lease}",
+                remote,
+                refspec,
+            )
+
+
+class Pygit2Backend(GitBackend):
+    """Run the local ``git`` operations in-process with ``pygit2``.
+
+    Operations that talk to the remote are still delegated to the command line
+    so that existing credentials and transports keep working. Commits made through
+    this backend do not run any installed git hooks.
+
+    Parameters
+    ----------
+    run_command : Callable
+        Function used to execute the commands that are delegated to ``git``.
+    path : str, optional (default None)
+        A path inside the repository. Defaults to the current working directory.
+    """
+
+    name = "pygit2"
+
+    def __init__(self, run_command: RunCommand, path: Optional[str] = None):
+        """Initialize the backend."""
+        import pygit2
+
+        super().__init__(run_command, path)
+        self._pygit2 = pygit2
+        discovered = pygit2.discover_repository(path or os.getcwd())
+        if discovered is None:
+            raise RuntimeError(f"Unable to find a git repository at {path or '.'}")
+        self.repo = pygit2.Repository(discovered)
+
+    def show_prefix(self) -> str:
+        """Get the path of the working directory from the top of the worktree."""
+        workdir = Path(self.repo.workdir).resolve()
+        prefix = Path(self.path or os.getcwd()).resolve().relative_to(workdir)
+        return "" if prefix == Path() else f"{prefix.as_posix()}/"
+
+    def delete_branch(self, branch: str):
+        """Delete a local branch."""
+        ref = self.repo.branches.local.get(branch)
+        if ref is None:
+            raise RuntimeError(f"Branch {branch} not found.")
+        try:
+            ref.delete()
+        except self._pygit2.GitError as err:
+            raise RuntimeError(f"Unable to delete branch {branch}: {err}") from None
+
+    def clean(self):
+        """Remove untracked files and directories from the working directory."""
+        # ``git clean`` only looks below the working directory
+        prefix = self.show_prefix()
+        top = Path(self.repo.workdir, prefix)
+        parents = set()
+        for path, flags in self.repo.status(untracked_files="all").items():
+            if flags & self._pygit2.enums.FileStatus.WT_NEW and path.startswith(prefix):
+                Path(self.repo.workdir, path).unlink()
+                parents.update(Path(self.repo.workdir, path).parents)
+        # Remove the untracked directories left empty, deepest first
+        for parent in sorted(parents, key=lambda p: len(p.parts), reverse=True):
+            if top in parent.parents:
+                try:
+                    parent.rmdir()
+                except OSError:
+                    pass
+
+    def checkout_branch(self, branch: str, start_point: Optional[str] = None):
+        """Create and checkout a new branch."""
+        try:
+            if start_point is None:
+                commit = self.repo.head.peel(self._pygit2.Commit)
+            else:
+                commit = self.repo.revparse_single(start_point).peel(
+                    self._pygit2.Commit
+                )
+            ref = self.repo.branches.local.create(branch, commit)
+        except (KeyError, ValueError, self._pygit2.GitError) as err:
+            raise RuntimeError(f"Unable to create branch {branch}: {err}") from None
+        try:
+            self.repo.checkout(ref)
+        except self._pygit2.GitError as err:
+            # Leave no trace of the branch, like a failed ``git checkout -b``
+            ref.delete()
+            raise RuntimeError(f"Unable to checkout branch {branch}: {err}") from None
+
+    def changed_files(self, paths: Iterable[str]) -> List[str]:
+        """Get the tracked files that differ from ``HEAD``."""
+        ignore = (
+            self._pygit2.enums.FileStatus.CURRENT
+            | self._pygit2.enums.FileStatus.WT_NEW
+            | self._pygit2.enums.FileStatus.IGNORED
+        )
+        changed = []
+        for path in paths:
+            try:
+                flags = self.repo.status_file(self._root_path(path))
+            except KeyError:  # neither tracked nor in the working tree
+                continue
+            if flags & ~ignore:
+                changed.append(path)
+        return changed
+
+    def rev_parse(self, rev: str) -> str:
+        """Resolve a revision to a commit SHA."""
+        try:
+            return str(self.repo.revparse_single(rev).peel(self._pygit2.Commit).id)
+        except (KeyError, ValueError, self._pygit2.GitError) as err:
+            raise RuntimeError(f"Unable to resolve {rev}: {err}") from None
+
+    def commit_files(
+        self, branch: str, parent: str, paths: Iterable[str], message: str
+    ) -> str:
+        """Commit files from the working tree to a branch without checking it out."""
+        blobs = {}
+        for path in map(self._root_path, paths):
+            blobs[path] = (
+                self.repo.create_blob_fromworkdir(path)
+                if Path(self.repo.workdir, path).is_file()
+                else None
+            )
+        return self._commit_blobs(branch, parent, blobs, message)
+
+    def commit_contents(
+        self, branch: str, parent: str, files: Mapping[str, Optional[str]], message: str
+    ) -> str:
+        """Commit file contents to a branch without checking it out."""
+        blobs = {
+            self._root_path(path): (
+                None if text is None else self.repo.create_blob(text.encode("utf-8"))
+            )
+            for path, text in files.items()
+        }
+        return self._commit_blobs(branch, parent, blobs, message)
+
+    def _commit_blobs(self, branch: str, parent: str, blobs: Dict, message: str) -> str:
+        """Commit blobs on top of ``parent`` and point ``branch`` at the commit."""
+        parent_commit = self.repo[parent].peel(self._pygit2.Commit)
+        tree = self._write_tree(parent_commit.tree, blobs)
+        signature = self._signature()
+        commit = self.repo.create_commit(
+            None, signature, signature, message, tree, [parent_commit.id]
+        )
+        self.repo.references.create(f"refs/heads/{branch}", commit, force=True)
+        return str(commit)
+
+    def _write_tree(self, base, blobs: Dict):
+        """Write a copy of the ``base`` tree with some blobs replaced."""
+        filemode = self._pygit2.enums.FileMode
+        builder = (
+            self.repo.TreeBuilder() if base is None else self.repo.TreeBuilder(base)
+        )
+        subtrees: Dict[str, Dict] = {}
+        for path, oid in blobs.items():
+            name, sep, rest = path.partition("/")
+            if sep:
+                subtrees.setdefault(name, {})[rest] = oid
+            elif oid is None:
+                if builder.get(name) is not None:
+                    builder.remove(name)
+            else:
+                current = builder.get(name)
+                mode = filemode.BLOB if current is None else current.filemode
+                builder.insert(name, oid, mode)
+        for name, subblobs in subtrees.items():
+            current = builder.get(name)
+            sub = None
+            if current is not None and current.type_str == "tree":
+                sub = self.repo[current.id]
+            tree = self._write_tree(sub, subblobs)
+            if str(tree) == EMPTY_TREE:
+                if current is not None:
+                    builder.remove(name)
+            else:
+                builder.insert(name, tree, filemode.TREE)
+        return builder.write()
+
+    def read_file(self, rev: str, path: str) -> Optional[str]:
+        """Read a file in a commit."""
+        blob = self.blob_ids(rev, [path]).get(path)
+        return None if blob is None else self.repo[blob].read_raw().decode("utf-8")
+
+    def blob_ids(self, rev: str, paths: Iterable[str]) -> Dict[str, str]:
+        """Get the blob IDs of files in a commit."""
+        try:
+            tree = self.repo.revparse_single(rev).peel(self._pygit2.Tree)
+        except (KeyError, ValueError, self._pygit2.GitError) as err:
+            raise RuntimeError(f"Unable to read {rev}: {err}") from None
+        blobs = {}
+        for path in paths:
+            root = self._root_path(path)
+            if root in tree and tree[root].type_str == "blob":
+                blobs[path] = str(tree[root].id)
+        return blobs
+
+    def add(self, *paths: str):
+        """Add files to the index."""
+        try:
+            for path in paths:
+                self.repo.index.add(path)
+        except (OSError, KeyError, self._pygit2.GitError) as err:
+            raise RuntimeError(f"Unable to add {path}: {err}") from None
+        self.repo.index.write()
+
+    def _signature(self):
+        """Get the commit signature, honouring the ``GIT_AUTHOR_*`` variables."""
+        environ = command_environ()
+        if "GIT_AUTHOR_NAME" in environ and "GIT_AUTHOR_EMAIL" in environ:
+            return self._pygit2.Signature(
+                environ["GIT_AUTHOR_NAME"], environ["GIT_AUTHOR_EMAIL"]
+            )
+        return self.repo.default_signature
+
+    def commit(self, message: str):
+        """Commit the index."""
+        signature = self._signature()
+        tree = self.repo.index.write_tree()
+        self.repo.create_commit(
+            "HEAD", signature, signature, message, tree, [self.repo.head.target]
+        )
+
+
+BACKENDS: Dict[str, Type[GitBackend]] = {
+    GitBackend.name: GitBackend,
+    Pygit2Backend.name: Pygit2Backend,
+}
+
+
+def get_backend(name: str, run_command: RunCommand) -> GitBackend:
+    """Get a git backend by name.
+
+    Falls back to the command line backend if the requested backend can't be
+    loaded.
+
+    Parameters
+    ----------
+    name : str
+        The name of the backend.
+    run_command : Callable
+        Function used to execute commands.
+
+    Returns
+    -------
+    GitBackend
+        The backend.
+    """
+    try:
+        return BACKENDS[name](run_command)
+    except (ImportError, RuntimeError) as err:
+        LOG.info(f"Unable to load the {name} git backend ({err}). Using git CLI.")
+        return GitBackend(run_command)
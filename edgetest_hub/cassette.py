@@ -0,0 +1,412 @@
+"""Record the commands and API requests of a run, and replay them later.
+
+A cassette is a JSON lines file. Each line is one interaction:
+
+- ``command``: the argv and standard input of a git or hub command, the
+  environment variables changed since the cassette was opened, the standard
+  output, the standard error of a failed command, the exit code, or the timeout,
+  and the duration.
+- ``http``: the method, path and body of a GitHub REST API request, the status,
+  headers and body of the response, and the duration.
+- ``testers``: the outcome of the test environments, so ``edgetest-hub replay`` can
+  run the hook again without them.
+
+The token and the working directory are replaced by placeholders, so a cassette
+recorded in CI can be shared and replayed in another checkout. Lines are written
+as the run goes, so a run that times out or crashes still leaves its record.
+
+A replayed run answers every command and request from the cassette, without
+running git or opening a connection, so it runs at full speed and its trace only
+holds the time spent in the plugin itself.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from edgetest.logger import get_logger
+
+from edgetest_hub.github import Headers
+from edgetest_hub.tracing import annotate, span
+from edgetest_hub.utils import (
+    CommandError,
+    CommandTimeoutError,
+    command_environ,
+    redact,
+)
+
+LOG = get_logger(__name__)
+
+CASSETTE_MODES = ["record", "replay"]
+CWD_PLACEHOLDER = "{cwd}"
+# environment variables of the plugin worth recording, by prefix
+ENV_PREFIXES = ("GIT_", "HUB_", "GITHUB_")
+
+RunCommand = Callable[..., Tuple[str, int]]
+Send = Callable[[str, str, Optional[bytes], Dict[str, str]], Tuple[int, Headers, str]]
+
+
+class CassetteMismatchError(LookupError):
+    """Error raised when a replayed run makes a call that was not recorded.
+
+    It is not a ``RuntimeError``, so it is never mistaken for a failed command
+    that the plugin can continue after.
+
+    Parameters
+    ----------
+    kind : str
+        ``command`` or ``http``.
+    key : str
+        The call that was not found, e.g. the command line.
+    """
+
+    def __init__(self, kind: str, key: str):
+        """Initialize the error."""
+        self.kind = kind
+        self.key = key
+        super().__init__(f"No {kind} left in the cassette for {key}")
+
+
+class ReplayedTester:
+    """A stand-in for an edgetest ``TestPackage`` rebuilt from a cassette.
+
+    Parameters
+    ----------
+    envname : str
+        The name of the environment.
+    status : bool
+        Whether the tests passed.
+    setup_status : bool or None
+        Whether the environment was set up. None if the tester didn't say.
+    upgrade : List[str]
+        The packages upgraded in the environment.
+    upgraded : List[Dict[str, str]], optional (default None)
+        The upgraded packages and their versions, None if they could not be listed.
+    lowered : List[Dict[str, str]], optional (default None)
+        The lowered packages and their versions, None if they could not be listed.
+    """
+
+    def __init__(
+        self,
+        envname: str,
+        status: bool,
+        setup_status: Optional[bool],
+        upgrade: List[str],
+        upgraded: Optional[List[Dict[str, str]]] = None,
+        lowered: Optional[List[Dict[str, str]]] = None,
+    ):
+        """Initialize the tester."""
+        self.envname = envname
+        self.status = status
+        self.setup_status = setup_status
+        self.upgrade = upgrade
+        self._upgraded = upgraded
+        self._lowered = lowered
+
+    def upgraded_packages(self) -> List[Dict[str, str]]:
+        """List the upgraded packages."""
+        if self._upgraded is None:
+            raise RuntimeError(f"The packages of {self.envname} were not recorded.")
+        return self._upgraded
+
+    def lowered_packages(self) -> List[Dict[str, str]]:
+        """List the lowered packages."""
+        if self._lowered is None:
+            raise RuntimeError(f"The packages of {self.envname} were not recorded.")
+        return self._lowered
+
+
+def _packages(method: Callable[[], List[Dict[str, str]]]) -> Optional[List]:
+    """List packages of a tester, or None if its environment is missing."""
+    try:
+        return method()
+    except (RuntimeError, OSError, ValueError):
+        return None
+
+
+class Cassette:
+    """Record the commands and API requests of a run to a file, or replay them.
+
+    The wrappers returned by ``run_command`` and ``transport`` are thread safe, so
+    they can be used by steps run concurrently. A replayed call is answered by the
+    first interaction not replayed yet with the same command line and standard
+    input, or the same method, path and body, so concurrent steps can run in a
+    different order than they were recorded.
+
+    Parameters
+    ----------
+    path : str or Path
+        The cassette file. It is overwritten when recording.
+    mode : str, optional (default "record")
+        ``record`` or ``replay``.
+    """
+
+    def __init__(self, path: Union[str, Path], mode: str = "record"):
+        """Initialize the cassette."""
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Invalid cassette mode: {mode}")
+        self.path = Path(path).expanduser()
+        self.mode = mode
+        self._cwd = os.getcwd()
+        self._environ = dict(os.environ)
+        self._lock = threading.Lock()
+        self._interactions: List[Dict[str, Any]] = []
+        self._replayed: List[bool] = []
+        if mode == "record":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text("")
+        else:
+            self._interactions = self.load(self.path)
+            self._replayed = [False] * len(self._interactions)
+
+    @staticmethod
+    def load(path: Union[str, Path]) -> List[Dict[str, Any]]:
+        """Read the interactions of a cassette.
+
+        Parameters
+        ----------
+        path : str or Path
+            The cassette file.
+
+        Returns
+        -------
+        List[Dict]
+            The interactions, in the order they were recorded.
+        """
+        with open(Path(path).expanduser(), encoding="utf-8") as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    def _clean(self, text: str) -> str:
+        """Hide the token and the working directory in a text."""
+        return redact(text).replace(self._cwd, CWD_PLACEHOLDER)
+
+    def _restore(self, text: str) -> str:
+        """Put the working directory back in a recorded text."""
+        return text.replace(CWD_PLACEHOLDER, self._cwd)
+
+    def _env_delta(self) -> Dict[str, Optional[str]]:
+        """Get the environment variables changed since the cassette was opened."""
+        delta: Dict[str, Optional[str]] = {}
+        environ = command_environ()
+        for key in set(self._environ) | set(environ):
+            if not key.startswith(ENV_PREFIXES):
+                continue
+            value = environ.get(key)
+            if value != self._environ.get(key):
+                delta[key] = None if value is None else self._clean(value)
+        return dict(sorted(delta.items()))
+
+    def _write(self, interaction: Dict[str, Any]):
+        """Append an interaction to the file."""
+        line = json.dumps(interaction, sort_keys=True)
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+    def _next(self, kind: str, match: Dict[str, Any], key: str) -> Dict[str, Any]:
+        """Take the first interaction not replayed yet that matches a call."""
+        with self._lock:
+            for index, interaction in enumerate(self._interactions):
+                if (
+                    not self._replayed[index]
+                    and interaction["type"] == kind
+                    and all(interaction.get(k) == v for k, v in match.items())
+                ):
+                    self._replayed[index] = True
+                    return interaction
+        raise CassetteMismatchError(kind, key)
+
+    @property
+    def remaining(self) -> int:
+        """The number of recorded calls that were not replayed."""
+        return sum(
+            not replayed and interaction["type"] != "testers"
+            for interaction, replayed in zip(self._interactions, self._replayed)
+        )
+
+    def record_testers(self, testers: Sequence):
+        """Record the outcome of the test environments of the run.
+
+        Parameters
+        ----------
+        testers : Sequence
+            The testers of the run.
+        """
+        if self.mode != "record":
+            return
+        self._write(
+            {
+                "type": "testers",
+                "testers": [
+                    {
+                        "envname": tester.envname,
+                        "status": tester.status,
+                        # neither is in older edgetest releases
+                        "setup_status": getattr(tester, "setup_status", None),
+                        "upgrade": list(getattr(tester, "upgrade", None) or []),
+                        "upgraded": _packages(tester.upgraded_packages),
+                        "lowered": _packages(getattr(tester, "lowered_packages", list)),
+                    }
+                    for tester in testers
+                ],
+            }
+        )
+
+    def testers(self) -> List[ReplayedTester]:
+        """Rebuild the testers recorded in the cassette.
+
+        Returns
+        -------
+        List[ReplayedTester]
+            The testers of the recorded run.
+
+        Raises
+        ------
+        ValueError
+            Error raised when the cassette does not hold the testers.
+        """
+        for interaction in self._interactions or self.load(self.path):
+            if interaction["type"] == "testers":
+                return [ReplayedTester(**tester) for tester in interaction["testers"]]
+        raise ValueError(f"{self.path} does not hold the testers of the run.")
+
+    def run_command(self, run_command: RunCommand) -> RunCommand:
+        """Wrap a command runner, such as ``edgetest_hub.utils._run_command``.
+
+        Parameters
+        ----------
+        run_command : Callable
+            The runner used when recording.
+
+        Returns
+        -------
+        Callable
+            A runner with the same signature and errors.
+        """
+
+        def record(*args, stdin: Optional[str] = None) -> Tuple[str, int]:
+            interaction: Dict[str, Any] = {
+                "type": "command",
+                "argv": [self._clean(arg) for arg in args],
+                "stdin": stdin and self._clean(stdin),
+                "env": self._env_delta(),
+            }
+            start = time.perf_counter()
+            try:
+                if stdin is None:
+                    out, code = run_command(*args)
+                else:
+                    out, code = run_command(*args, stdin=stdin)
+            except CommandTimeoutError as err:
+                interaction.update(exit_code=None, timeout=err.timeout)
+                raise
+            except RuntimeError as err:
+                interaction.update(
+                    stdout=self._clean(getattr(err, "stdout", "") or ""),
+                    stderr=self._clean(getattr(err, "stderr", "") or ""),
+                    exit_code=getattr(err, "returncode", 1),
+                    error=self._clean(str(err)),
+                )
+                raise
+            else:
+                interaction.update(stdout=self._clean(out), stderr="", exit_code=code)
+            finally:
+                interaction["seconds"] = time.perf_counter() - start
+                if "exit_code" in interaction:
+                    self._write(interaction)
+            return out, code
+
+        def replay(*args, stdin: Optional[str] = None) -> Tuple[str, int]:
+            argv = [self._clean(arg) for arg in args]
+            with span(
+                redact(" ".join(args[:2])), "command", argv=argv, replayed=True
+            ) as attributes:
+                interaction = self._next(
+                    "command",
+                    {"argv": argv, "stdin": stdin and self._clean(stdin)},
+                    " ".join(argv),
+                )
+                attributes.update(
+                    exit_status=interaction["exit_code"],
+                    recorded_seconds=interaction["seconds"],
+                )
+                if "timeout" in interaction:
+                    raise CommandTimeoutError(
+                        redact(" ".join(args[:2])), interaction["timeout"]
+                    )
+                if "error" in interaction:
+                    raise CommandError(
+                        args,
+                        self._restore(interaction["stdout"]),
+                        self._restore(interaction["stderr"]),
+                        interaction["exit_code"],
+                    )
+                return self._restore(interaction["stdout"]), interaction["exit_code"]
+
+        return record if self.mode == "record" else replay
+
+    def transport(self, send: Send) -> Send:
+        """Wrap the transport of a ``edgetest_hub.github.GitHubClient``.
+
+        Parameters
+        ----------
+        send : Callable
+            The transport used when recording.
+
+        Returns
+        -------
+        Callable
+            A transport with the same signature.
+        """
+
+        def record(
+            method: str, path: str, body: Optional[bytes], headers: Dict[str, str]
+        ) -> Tuple[int, Headers, str]:
+            start = time.perf_counter()
+            status, response_headers, text = send(method, path, body, headers)
+            self._write(
+                {
+                    "type": "http",
+                    "method": method,
+                    "path": path,
+                    "body": None if body is None else self._clean(body.decode()),
+                    "status": status,
+                    "headers": dict(response_headers.items()),
+                    "response": self._clean(text),
+                    "seconds": time.perf_counter() - start,
+                }
+            )
+            return status, response_headers, text
+
+        def replay(
+            method: str, path: str, body: Optional[bytes], headers: Dict[str, str]
+        ) -> Tuple[int, Headers, str]:
+            from http.client import HTTPMessage
+
+            clean = None if body is None else self._clean(body.decode())
+            interaction = self._next(
+                "http",
+                {"method": method, "path": path, "body": clean},
+                f"{method} {path}",
+            )
+            annotate(replayed=True, recorded_seconds=interaction["seconds"])
+            response_headers = HTTPMessage()
+            for name, value in interaction["headers"].items():
+                response_headers[name] = value
+            return (
+                interaction["status"],
+                response_headers,
+                self._restore(interaction["response"]),
+            )
+
+        return record if self.mode == "record" else replay
+
+    def close(self):
+        """Log where the run was recorded, or the calls not made by the replay."""
+        if self.mode == "record":
+            LOG.info(f"Recorded the commands of the run to {self.path}.")
+        elif self.remaining:
+            LOG.info(
+                f"{self.remaining} recorded calls were not made by the replayed run."
+            )
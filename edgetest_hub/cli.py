@@ -0,0 +1,235 @@
+"""Command line interface of the hub plugin."""
+import os
+import time
+from pathlib import Path
+
+import click
+from tabulate import tabulate
+
+from edgetest_hub.cassette import Cassette, CassetteMismatchError
+from edgetest_hub.fleet import load_config, lookup_fleet, run_fleet, summarize
+from edgetest_hub.plugin import (
+    GIT_TOKEN_ENVNAME,
+    post_run_hook,
+    pre_run_hook,
+    run_spooled_job,
+)
+from edgetest_hub.spool import SPOOL_DIR, Spool
+
+spool_dir_option = click.option(
+    "--spool-dir",
+    default=SPOOL_DIR,
+    show_default=True,
+    help="The spool directory of the submissions handled in the background.",
+)
+
+
+@click.group()
+def cli():
+    """Run the hub plugin outside of an edgetest run."""
+
+
+@cli.command()
+@click.argument("repos", nargs=-1, required=True, type=click.Path(file_okay=False))
+@click.option(
+    "--config",
+    "-c",
+    default="setup.cfg",
+    show_default=True,
+    help="The edgetest configuration file, relative to each repository.",
+)
+@click.option(
+    "--processes",
+    "-p",
+    type=click.IntRange(min=1),
+    default=None,
+    help="The number of repositories handled at once. Defaults to the CPU count.",
+)
+def submit(repos, config, processes):
+    """Open a PR with the updated dependency files of each repository.
+
+    Each REPOS directory must hold the dependency files updated by an edgetest
+    run, and its configuration with an ``edgetest.hub`` section.
+    """
+    if GIT_TOKEN_ENVNAME not in os.environ:
+        raise click.ClickException(
+            f"Environment variable {GIT_TOKEN_ENVNAME} not found."
+        )
+    results = run_fleet(repos, config, processes)
+    click.echo(summarize(results))
+    if any(r.status in ("failed", "timed out") for r in results):
+        raise SystemExit(1)
+
+
+@cli.command()
+@click.argument("repos", nargs=-1, required=True, type=click.Path(file_okay=False))
+@click.option(
+    "--config",
+    "-c",
+    default="setup.cfg",
+    show_default=True,
+    help="The edgetest configuration file, relative to each repository.",
+)
+def lookup(repos, config):
+    """List the open PR and failure issue of each repository.
+
+    The repositories on the same GitHub host are looked up with a single GraphQL
+    query. Each REPOS directory must hold an edgetest configuration with an
+    ``edgetest.hub`` section.
+    """
+    if GIT_TOKEN_ENVNAME not in os.environ:
+        raise click.ClickException(
+            f"Environment variable {GIT_TOKEN_ENVNAME} not found."
+        )
+    click.echo(
+        tabulate(
+            [
+                (r["repo"], r["name"], r["pull_request"] or "", r["issue"] or "")
+                for r in lookup_fleet(repos, config)
+            ],
+            headers=["Repository", "GitHub", "Open PR", "Failure issue"],
+        )
+    )
+
+
+@cli.command()
+@spool_dir_option
+@click.option(
+    "--retry-failed",
+    is_flag=True,
+    help="Move the failed jobs back to pending before listing the jobs.",
+)
+def status(spool_dir, retry_failed):
+    """List the submissions handled in the background."""
+    spool = Spool(spool_dir)
+    if retry_failed:
+        click.echo(f"{spool.retry_failed()} failed jobs moved back to pending.")
+    jobs = spool.jobs()
+    if not jobs:
+        click.echo(f"No jobs in {spool.path}.")
+        return
+    click.echo(
+        tabulate(
+            [
+                (
+                    job["id"],
+                    job["state"],
+                    job["kind"],
+                    job["repo_dir"],
+                    job["attempts"],
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(job["retry_at"]))
+                    if job["state"] == "pending" and job["retry_at"]
+                    else "",
+                    job["error"] or "",
+                )
+                for job in jobs
+            ],
+            headers=[
+                "Job",
+                "State",
+                "Kind",
+                "Repository",
+                "Attempts",
+                "Retry at",
+                "Error",
+            ],
+        )
+    )
+
+
+@cli.command()
+@spool_dir_option
+@click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    default=5,
+    show_default=True,
+    help="The number of times a failed job is retried.",
+)
+@click.option("--watch", is_flag=True, help="Keep waiting for new jobs.")
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=1),
+    default=30,
+    show_default=True,
+    help="How often to look for new jobs with --watch, in seconds.",
+)
+def drain(spool_dir, retries, watch, interval):
+    """Run the spooled submissions.
+
+    This is started in the background by edgetest runs with
+    ``submit_mode = spool``. It can also run as a service with ``--watch``.
+    """
+    if GIT_TOKEN_ENVNAME not in os.environ:
+        raise click.ClickException(
+            f"Environment variable {GIT_TOKEN_ENVNAME} not found."
+        )
+    cwd = os.getcwd()
+
+    def run(job):
+        try:
+            run_spooled_job(job)
+        finally:
+            os.chdir(cwd)
+
+    count = Spool(spool_dir, retries=retries).drain(run, watch=watch, interval=interval)
+    click.echo(f"Ran {count} jobs.")
+
+
+@cli.command()
+@click.argument(
+    "cassette", type=click.Path(exists=True, dir_okay=False, resolve_path=True)
+)
+@click.option(
+    "--repo",
+    type=click.Path(exists=True, file_okay=False),
+    default=".",
+    show_default=True,
+    help="The repository the cassette was recorded in.",
+)
+@click.option(
+    "--config",
+    "-c",
+    default="setup.cfg",
+    show_default=True,
+    help="The edgetest configuration file, relative to the repository.",
+)
+@click.option(
+    "--trace-path",
+    type=click.Path(dir_okay=False, resolve_path=True),
+    default=None,
+    help="Write the trace of the replayed run to this file.",
+)
+def replay(cassette, repo, config, trace_path):
+    """Run the hub plugin again with the commands and API requests of a cassette.
+
+    Nothing is run and no connection is opened: every git and hub command and
+    every REST API request is answered from the CASSETTE recorded by a run with
+    ``cassette_path`` set. The lease of the updater branch is not taken again.
+    """
+    testers = Cassette(cassette, "replay").testers()
+    cwd = os.getcwd()
+    os.chdir(repo)
+    try:
+        conf = load_config(Path(config))
+        conf["hub"].update(
+            cassette_path=cassette,
+            cassette_mode="replay",
+            submit_mode="foreground",
+            trace_path=trace_path or "",
+            metrics_dir="",
+            lease=False,
+        )
+        os.environ.setdefault(GIT_TOKEN_ENVNAME, "replay")
+        start = time.perf_counter()
+        pre_run_hook(conf)
+        post_run_hook(testers, conf)
+    except CassetteMismatchError as err:
+        raise click.ClickException(str(err)) from None
+    finally:
+        os.chdir(cwd)
+    click.echo(f"Replayed {cassette} in {time.perf_counter() - start:.3f}s.")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,294 @@
+"""Submit the dependency updates of many repositories from one machine."""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from edgetest.interface import get_plugin_manager
+from edgetest.logger import get_logger
+from edgetest.schema import EdgetestValidator, Schema
+from edgetest.utils import parse_cfg
+from tabulate import tabulate
+
+from edgetest_hub.github import GraphQLClient, RateLimiter, api_url_for
+from edgetest_hub.plugin import (
+    FINGERPRINT_MARKER,
+    GIT_TOKEN_ENVNAME,
+    _get_github_client,
+    _open_state,
+    _submit,
+    _traced,
+)
+from edgetest_hub.utils import CommandTimeoutError, command_timeouts, redact
+
+LOG = get_logger(__name__)
+
+# The limiters of a worker process, shared by the repositories on the same host
+_LIMITERS: Dict[Tuple[str, float, int], RateLimiter] = {}
+
+
+class RepoResult(NamedTuple):
+    """The outcome of one repository.
+
+    Parameters
+    ----------
+    repo : str
+        The path to the repository.
+    status : str
+        The outcome of ``submit_update``: ``submitted``, ``no changes``,
+        ``cached``, ``up to date`` or ``leased``. Otherwise ``skipped`` without a
+        hub configuration, ``timed out`` or ``failed``.
+    seconds : float
+        The time spent on the repository.
+    detail : str, optional (default "")
+        The PR URL, or the reason the repository was skipped or failed.
+    waited : float, optional (default 0)
+        The time spent waiting for the GitHub API rate limits.
+    """
+
+    repo: str
+    status: str
+    seconds: float
+    detail: str = ""
+    waited: float = 0.0
+
+
+def load_config(filename: Path) -> Dict:
+    """Load and validate an edgetest configuration.
+
+    The options of every installed edgetest plugin are validated, and their
+    defaults filled in, the same way the ``edgetest`` CLI does.
+
+    Parameters
+    ----------
+    filename : Path
+        The ``.cfg`` or ``.toml`` configuration file.
+
+    Returns
+    -------
+    Dict
+        The validated configuration.
+
+    Raises
+    ------
+    ValueError
+        Error raised when the configuration is not valid.
+    """
+    if filename.suffix == ".toml":
+        from edgetest.utils import parse_toml  # not in older edgetest releases
+
+        conf = parse_toml(filename=str(filename))
+    else:
+        conf = parse_cfg(filename=str(filename))
+
+    schema = Schema()
+    get_plugin_manager().hook.addoption(schema=schema)
+    validator = EdgetestValidator(schema=schema.schema)
+    if not validator.validate(conf):
+        raise ValueError(f"Unable to validate configuration file: {validator.errors}")
+    document: Dict = validator.document
+    return document
+
+
+def _shared_limiter(conf: Dict, workers: int) -> RateLimiter:
+    """Get the limiter of this process for the GitHub host of a repository.
+
+    It paces the requests to an even share of ``api_rate`` between the
+    ``workers`` processes, so that together they stay within it.
+    """
+    key = (
+        conf["hub"].get("api_url") or api_url_for(conf["hub"]["git_url"]),
+        conf["hub"].get("api_rate", 0),
+        conf["hub"].get("api_retries", 5),
+    )
+    if key not in _LIMITERS:
+        _LIMITERS[key] = RateLimiter(key[1] / workers, key[2])
+    return _LIMITERS[key]
+
+
+def submit_repo(repo: str, config: str = "setup.cfg", workers: int = 1) -> RepoResult:
+    """Submit the dependency updates of one repository.
+
+    This runs in a worker process. It changes to the repository directory and
+    runs the same steps as ``post_run_hook`` after a passing run.
+
+    Parameters
+    ----------
+    repo : str
+        The path to the repository, with the updated dependency files.
+    config : str, optional (default "setup.cfg")
+        The edgetest configuration file, relative to the repository.
+    workers : int, optional (default 1)
+        The number of processes submitting at once. They share ``api_rate``.
+
+    Returns
+    -------
+    RepoResult
+        The outcome.
+    """
+    start = time.monotonic()
+    limiter = None
+    waited = 0.0
+
+    def result(status: str, detail: str = "") -> RepoResult:
+        return RepoResult(
+            repo,
+            status,
+            time.monotonic() - start,
+            redact(detail),
+            limiter.waited - waited if limiter else 0.0,
+        )
+
+    try:
+        os.chdir(repo)
+        conf = load_config(Path(config))
+        if not conf.get("hub"):
+            return result("skipped", "Hub plugin configuration not found.")
+        limiter = _shared_limiter(conf, workers)
+        waited = limiter.waited
+        client = _get_github_client(conf, limiter)
+        state = _open_state(conf)
+        try:
+            with _traced(conf, "submit_repo"), command_timeouts(
+                conf["hub"].get("command_timeout") or None,
+                conf["hub"].get("deadline") or None,
+            ):
+                outcome, url = _submit(conf, client, state, None)
+        finally:
+            client.close()
+            if state:
+                state.close()
+    except CommandTimeoutError as err:
+        return result("timed out", str(err))
+    except Exception as err:
+        LOG.info(f"Unable to submit the updates of {repo}.")
+        return result("failed", (str(err).strip().splitlines() or [repr(err)])[0])
+    return result(outcome, url or "")
+
+
+def run_fleet(
+    repos: Sequence[str],
+    config: str = "setup.cfg",
+    processes: Optional[int] = None,
+) -> List[RepoResult]:
+    """Submit the dependency updates of many repositories.
+
+    Each repository is handled in a separate process of a bounded pool, so a
+    failure, a hang or a change of directory in one cannot affect the others.
+    The requests of each process are paced to an even share of ``api_rate``.
+
+    Parameters
+    ----------
+    repos : Sequence[str]
+        The paths to the repositories.
+    config : str, optional (default "setup.cfg")
+        The edgetest configuration file, relative to each repository.
+    processes : int, optional (default None)
+        The maximum number of repositories handled at once. Defaults to the
+        number of CPUs.
+
+    Returns
+    -------
+    List[RepoResult]
+        The outcomes, in the order of ``repos``.
+    """
+    paths = [str(Path(repo).resolve()) for repo in repos]
+    workers = max(1, min(processes or os.cpu_count() or 1, len(paths)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(
+            pool.map(submit_repo, paths, [config] * len(paths), [workers] * len(paths))
+        )
+
+
+def summarize(results: Sequence[RepoResult]) -> str:
+    """Format the outcomes as a table.
+
+    Parameters
+    ----------
+    results : Sequence[RepoResult]
+        The outcomes.
+
+    Returns
+    -------
+    str
+        The table, followed by the number of repositories per status.
+    """
+    table = tabulate(
+        [
+            (r.repo, r.status, f"{r.seconds:.1f}", f"{r.waited:.1f}", r.detail)
+            for r in results
+        ],
+        headers=["Repository", "Status", "Seconds", "Rate limited", "Detail"],
+    )
+    counts: Dict[str, int] = {}
+    for r in results:
+        counts[r.status] = counts.get(r.status, 0) + 1
+    totals = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    waited = sum(r.waited for r in results)
+    return (
+        f"{table}\n\n{len(results)} repositories: {totals}\n"
+        f"Waited {waited:.1f}s in total for the GitHub API rate limits."
+    )
+
+
+def lookup_fleet(
+    repos: Sequence[str], config: str = "setup.cfg"
+) -> List[Dict[str, Optional[str]]]:
+    """Find the open PR and failure issue of many repositories.
+
+    The repositories on the same GitHub host are looked up with a single GraphQL
+    query, whatever their ``github_client``.
+
+    Parameters
+    ----------
+    repos : Sequence[str]
+        The paths to the repositories.
+    config : str, optional (default "setup.cfg")
+        The edgetest configuration file, relative to each repository.
+
+    Returns
+    -------
+    List[Dict[str, Optional[str]]]
+        The ``repo`` path, its GitHub ``name``, and the URL of its open
+        ``pull_request`` and of the ``issue`` opened for a failure, if any, in the
+        order of ``repos``. Repositories without a hub section are left out.
+    """
+    hosts: Dict[str, List] = {}
+    for repo in repos:
+        conf = load_config(Path(repo) / config)
+        if not conf.get("hub"):
+            LOG.info(f"Hub plugin configuration not found in {repo}. Skipping it.")
+            continue
+        hub = conf["hub"]
+        api_url = hub.get("api_url") or api_url_for(hub["git_url"])
+        hosts.setdefault(api_url, []).append(
+            (
+                repo,
+                (
+                    f"{hub['git_repo_org']}/{hub['git_repo_name']}",
+                    hub["updater_branch"],
+                    hub["pr_to_branch"],
+                ),
+            )
+        )
+
+    found: Dict[str, Dict[str, Optional[str]]] = {}
+    marker = FINGERPRINT_MARKER.split("{}")[0]
+    for api_url, targets in hosts.items():
+        client = GraphQLClient(
+            api_url, os.environ[GIT_TOKEN_ENVNAME], limiter=RateLimiter()
+        )
+        try:
+            results = client.find_many([target for _, target in targets], marker)
+        finally:
+            client.close()
+        for repo, (name, _, _) in targets:
+            found[repo] = {
+                "repo": repo,
+                "name": name,
+                "pull_request": None,
+                "issue": None,
+            }
+            found[repo].update(results.get(name, {}))
+    return [found[repo] for repo in repos if repo in found]
@@ -0,0 +1,1241 @@
+"""Clients used to open pull requests and issues on GitHub."""
+import json
+import queue
+import random
+import socket
+import threading
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+from urllib.parse import urlencode, urlsplit
+
+from edgetest.logger import get_logger
+
+from edgetest_hub.tracing import span
+from edgetest_hub.utils import CommandTimeoutError, remaining_time
+
+if TYPE_CHECKING:
+    from http.client import HTTPConnection, HTTPMessage
+
+LOG = get_logger(__name__)
+
+HUB_COMMAND = "hub"
+# characters of an issue or comment body above which hub reads it from stdin,
+# rather than from the command line
+HUB_MESSAGE_LIMIT = 16384
+GITHUB_API_URL = "https://api.github.com"
+# methods that can be sent again after a server error without doing the work twice
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+GRAPHQL_PATH = "/graphql"
+# permissions on a repository that allow the token to push
+PUSH_PERMISSIONS = ("ADMIN", "MAINTAIN", "WRITE")
+
+RunCommand = Callable[..., Tuple[str, int]]
+# the headers of a response, as read by ``http.client`` or recorded in a cassette
+Headers = Union[Mapping[str, str], "HTTPMessage"]
+
+
+def api_url_for(git_url: str) -> str:
+    """Map a git host to the base URL of its REST API.
+
+    Parameters
+    ----------
+    git_url : str
+        The git host, e.g. ``github.com`` or a GitHub Enterprise host.
+
+    Returns
+    -------
+    str
+        The base URL for the API.
+    """
+    if git_url in ("github.com", "www.github.com"):
+        return GITHUB_API_URL
+    return f"https://{git_url}/api/v3"
+
+
+def _number(url: str) -> str:
+    """Get the number of a pull request or issue from its URL."""
+    return url.rstrip("/").rsplit("/", 1)[-1]
+
+
+def _resource(url: str) -> str:
+    """Get the API resource of a pull request or issue from its URL."""
+    return "pulls" if "/pull/" in url else "issues"
+
+
+def _split(names: str) -> List[str]:
+    """Split a comma separated list of names."""
+    return [name.strip() for name in names.split(",") if name.strip()]
+
+
+def _find_issue(issues: List[Dict], text: str) -> Optional[str]:
+    """Get the URL of the first issue, not pull request, with the text in its body."""
+    for issue in issues:
+        if "pull_request" not in issue and text in (issue.get("body") or ""):
+            return str(issue["html_url"])
+    return None
+
+
+class GitHubAPIError(RuntimeError):
+    """Error raised when the GitHub API returns an error response.
+
+    Parameters
+    ----------
+    method : str
+        The HTTP method of the request.
+    path : str
+        The path of the request.
+    status : int
+        The HTTP status code of the response.
+    body : str
+        The body of the response.
+    """
+
+    def __init__(self, method: str, path: str, status: int, body: str):
+        """Initialize the error."""
+        super().__init__(
+            f"GitHub API request {method} {path} failed with status {status}: {body}"
+        )
+        self.status = status
+
+
+class RateLimiter:
+    """Pace the requests to the GitHub API and retry the rejected ones.
+
+    Requests are paced with a token bucket of ``rate`` requests per second. The
+    ``X-RateLimit-Remaining``, ``X-RateLimit-Reset`` and ``Retry-After`` headers of
+    each response pause every request sharing the limiter until the limit resets.
+    Rate limited responses, and server errors on idempotent requests, are retried
+    with jittered exponential backoff. It is safe to share between threads.
+
+    Parameters
+    ----------
+    rate : float, optional (default 0)
+        The maximum sustained number of requests per second. Bursts of up to
+        ``rate`` requests, and at least one, are allowed. No pacing if 0.
+    retries : int, optional (default 5)
+        The maximum number of times a request is retried.
+    backoff : float, optional (default 1)
+        The base of the exponential backoff, in seconds.
+    max_backoff : float, optional (default 60)
+        The maximum backoff, in seconds.
+    """
+
+    def __init__(
+        self,
+        rate: float = 0,
+        retries: int = 5,
+        backoff: float = 1,
+        max_backoff: float = 60,
+    ):
+        """Initialize the limiter."""
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.waited = 0.0
+        self.requests = 0
+        self._burst = max(1.0, rate)
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _sleep(self, seconds: float, command: str):
+        """Wait, unless it would run past the deadline."""
+        allowed = remaining_time(command)
+        if allowed is not None and seconds > allowed:
+            raise CommandTimeoutError(command, allowed)
+        time.sleep(seconds)
+        with self._lock:
+            self.waited += seconds
+
+    def acquire(self, command: str):
+        """Wait for the turn of a request.
+
+        Parameters
+        ----------
+        command : str
+            The request, used in the error message.
+
+        Raises
+        ------
+        CommandTimeoutError
+            Error raised when the wait would run past the deadline.
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = self._paused_until - now
+            if self.rate:
+                self._tokens = min(
+                    self._burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                self._tokens -= 1  # a negative balance queues the request
+                delay = max(delay, -self._tokens / self.rate)
+            self.requests += 1
+        if delay > 0:
+            self._sleep(delay, command)
+
+    def update(self, headers: Headers):
+        """Pause the requests if the response says the limit is reached.
+
+        Parameters
+        ----------
+        headers : Headers
+            The headers of the response.
+        """
+        pause = 0.0
+        if headers.get("Retry-After", "").isdigit():
+            pause = float(headers["Retry-After"])
+        elif headers.get("X-RateLimit-Remaining") == "0":
+            reset = headers.get("X-RateLimit-Reset", "")
+            if reset.isdigit():
+                pause = float(reset) - time.time()
+        if pause > 0:
+            LOG.info(f"GitHub API rate limit reached. Pausing for {pause:.1f}s.")
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+    def should_retry(
+        self, method: str, status: int, headers: Headers, body: str
+    ) -> bool:
+        """Check if an error response is worth retrying.
+
+        Rate limited requests were not processed, so they are always retried.
+        Server errors are only retried for idempotent methods, as the request may
+        have been processed, and a second ``POST`` would open a second PR.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method of the request.
+        status : int
+            The HTTP status code of the response.
+        headers : Headers
+            The headers of the response.
+        body : str
+            The body of the response.
+
+        Returns
+        -------
+        bool
+            Whether to retry.
+        """
+        if status == 429 or (
+            status == 403
+            and (
+                "Retry-After" in headers
+                or headers.get("X-RateLimit-Remaining") == "0"
+                or "rate limit" in body.lower()
+            )
+        ):
+            return True
+        return status >= 500 and method in IDEMPOTENT_METHODS
+
+    def wait_to_retry(self, attempt: int, command: str):
+        """Wait before a retry, with full jitter exponential backoff.
+
+        A pause set by ``update`` is waited for by the next ``acquire`` instead.
+
+        Parameters
+        ----------
+        attempt : int
+            The number of attempts made so far, starting at 1.
+        command : str
+            The request, used in the error message.
+        """
+        with self._lock:
+            if self._paused_until > time.monotonic():
+                return
+        delay = random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        )
+        self._sleep(delay, command)
+
+
+class HubClient:
+    """Open pull requests and issues with the ``hub`` CLI.
+
+    ``hub`` works out the repository from the git remotes of the current
+    directory, so the ``repo`` and ``head`` arguments are not used.
+
+    Parameters
+    ----------
+    run_command : Callable
+        Function used to execute the commands. It must follow the signature and
+        error handling of ``edgetest_hub.utils._run_command``.
+    """
+
+    name = "hub"
+
+    def __init__(self, run_command: RunCommand):
+        """Initialize the client."""
+        self._run_command = run_command
+
+    def create_pull_request(
+        self,
+        repo: str,
+        head: str,
+        base: str,
+        title: str,
+        reviewers: str,
+        checked_out: bool = True,
+        labels: str = "",
+        assignees: str = "",
+        draft: bool = False,
+    ) -> str:
+        """Push the current branch and open a pull request.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        head : str
+            The branch with the changes.
+        base : str
+            The branch to merge into.
+        title : str
+            The title of the pull request.
+        reviewers : str
+            Comma separated list of reviewers.
+        checked_out : bool, optional (default True)
+            Whether ``head`` is the current branch. If so, ``hub`` pushes it before
+            opening the pull request. Otherwise ``head`` must already be pushed.
+        labels : str, optional (default "")
+            Comma separated list of labels.
+        assignees : str, optional (default "")
+            Comma separated list of assignees.
+        draft : bool, optional (default False)
+            Open the pull request as a draft.
+
+        Returns
+        -------
+        str
+            The output of ``hub``, which is the URL of the pull request.
+        """
+        out, _ = self._run_command(
+            HUB_COMMAND,
+            "pull-request",
+            "-b",
+            base,
+            *(() if checked_out else ("-h", head)),
+            "-m",
+            title,
+            "-r",
+            reviewers,
+            *(("-l", labels) if labels else ()),
+            *(("-a", assignees) if assignees else ()),
+            *(("--draft",) if draft else ()),
+            *(("--push",) if checked_out else ()),
+        )
+        return out
+
+    def find_pull_request(self, repo: str, head: str, base: str) -> Optional[str]:
+        """Find an open pull request.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        head : str
+            The branch with the changes.
+        base : str
+            The branch to merge into.
+
+        Returns
+        -------
+        str or None
+            The URL of the pull request, if there is one.
+        """
+        out, _ = self._run_command(
+            HUB_COMMAND, "pr", "list", "-h", head, "-b", base, "-f", "%U%n"
+        )
+        urls = (out or "").split()
+        return urls[0] if urls else None
+
+    def create_issue(self, repo: str, title: str, *paragraphs: str) -> str:
+        """Open an issue.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        title : str
+            The title of the issue.
+        *paragraphs : str
+            The paragraphs of the issue body.
+
+        Returns
+        -------
+        str
+            The output of ``hub``, which is the URL of the issue.
+        """
+        if sum(len(paragraph) for paragraph in paragraphs) > HUB_MESSAGE_LIMIT:
+            out, _ = self._run_command(
+                HUB_COMMAND,
+                "issue",
+                "create",
+                "--file",
+                "-",
+                stdin="\n\n".join((title,) + paragraphs),
+            )
+            return out
+        messages = []
+        for message in (title,) + paragraphs:
+            messages.extend(["--message", message])
+        out, _ = self._run_command(HUB_COMMAND, "issue", "create", *messages)
+        return out
+
+    def find_issue(self, repo: str, text: str) -> Optional[str]:
+        """Find an open issue with some text in its body.
+
+        Only the 100 most recently created open issues are searched.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        text : str
+            The text to look for.
+
+        Returns
+        -------
+        str or None
+            The URL of the issue, if there is one.
+        """
+        out, _ = self._run_command(
+            HUB_COMMAND, "api", f"repos/{repo}/issues?state=open&per_page=100"
+        )
+        return _find_issue(json.loads(out or "[]"), text)
+
+    def is_open(self, repo: str, url: str) -> bool:
+        """Check if an issue or pull request is still open.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        url : str
+            The URL of the issue or pull request.
+
+        Returns
+        -------
+        bool
+            True if it is open.
+        """
+        out, _ = self._run_command(
+            HUB_COMMAND, "api", f"repos/{repo}/{_resource(url)}/{_number(url)}"
+        )
+        return bool(json.loads(out or "{}").get("state") == "open")
+
+    def comment_issue(self, repo: str, url: str, body: str):
+        """Comment on an issue.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        url : str
+            The URL of the issue.
+        body : str
+            The comment.
+        """
+        path = f"repos/{repo}/issues/{_number(url)}/comments"
+        if len(body) > HUB_MESSAGE_LIMIT:
+            self._run_command(
+                HUB_COMMAND,
+                "api",
+                path,
+                "--input",
+                "-",
+                stdin=json.dumps({"body": body}),
+            )
+            return
+        self._run_command(HUB_COMMAND, "api", path, "--raw-field", f"body={body}")
+
+    def close(self):
+        """Release any resources held by the client."""
+
+
+class GitHubClient:
+    """Open pull requests and issues through the GitHub REST API.
+
+    Connections are kept alive and reused for every request made by the client,
+    so a run pays for the TLS handshake once.
+
+    Parameters
+    ----------
+    api_url : str
+        The base URL of the API, e.g. ``https://api.github.com``.
+    token : str
+        The token used to authenticate.
+    timeout : float, optional (default 60)
+        The socket timeout for each request, in seconds. A smaller limit set with
+        ``edgetest_hub.utils.command_timeouts`` takes precedence.
+    limiter : RateLimiter, optional (default None)
+        Paces and retries the requests. Defaults to one that only follows the
+        rate limit headers.
+    """
+
+    name = "rest"
+
+    def __init__(
+        self,
+        api_url: str,
+        token: str,
+        timeout: float = 60,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        """Initialize the client."""
+        from http.client import HTTPConnection, HTTPSConnection
+
+        self.limiter = limiter or RateLimiter()
+        parts = urlsplit(api_url)
+        self._connection_class = (
+            HTTPConnection if parts.scheme == "http" else HTTPSConnection
+        )
+        self._netloc = parts.netloc
+        self._prefix = parts.path.rstrip("/")
+        self._timeout = timeout
+        self._headers = {
+            "Accept": "application/vnd.github+json",
+            "Authorization": f"token {token}",
+            "User-Agent": "edgetest-hub",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        # sends a request and returns the status, headers and body of the response
+        self.transport: Callable[
+            [str, str, Optional[bytes], Dict[str, str]],
+            Tuple[int, Headers, str],
+        ] = self._send
+
+    def _url_path(self, path: str) -> str:
+        """Get the path of a request on the server."""
+        return self._prefix + path
+
+    def _acquire(self) -> Tuple["HTTPConnection", bool]:
+        """Get an idle connection, or open a new one.
+
+        Returns
+        -------
+        HTTPConnection
+            The connection.
+        bool
+            Whether the connection was reused.
+        """
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._connection_class(self._netloc, timeout=self._timeout), False
+
+    def _send(
+        self, method: str, path: str, body: Optional[bytes], headers: Dict[str, str]
+    ) -> Tuple[int, "HTTPMessage", str]:
+        """Send a request over a kept-alive connection.
+
+        Returns
+        -------
+        int
+            The HTTP status code.
+        HTTPMessage
+            The headers of the response.
+        str
+            The body of the response.
+        """
+        from http.client import HTTPException
+
+        while True:
+            timeout = remaining_time(f"{method} {path}", self._timeout)
+            conn, reused = self._acquire()
+            conn.timeout = timeout
+            try:
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                conn.request(method, self._url_path(path), body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except socket.timeout:  # only raised when there is a timeout
+                conn.close()
+                raise CommandTimeoutError(f"{method} {path}", timeout or 0.0) from None
+            except (HTTPException, OSError):
+                conn.close()
+                if reused:  # the server closed the idle connection; retry once
+                    continue
+                raise
+            break
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+        return response.status, response.headers, data.decode("utf-8")
+
+    def request(self, method: str, path: str, payload: Optional[Dict] = None) -> Any:
+        """Send a request to the API.
+
+        The request is paced, and retried when it is rate limited or hits a
+        transient server error, by the ``limiter``.
+
+        Parameters
+        ----------
+        method : str
+            The HTTP method.
+        path : str
+            The path of the endpoint, relative to the API base URL.
+        payload : dict, optional (default None)
+            The JSON payload.
+
+        Returns
+        -------
+        Any
+            The decoded JSON response, if any.
+
+        Raises
+        ------
+        GitHubAPIError
+            Error raised when the API returns an error status.
+        CommandTimeoutError
+            Error raised when the request times out.
+        """
+        body = None if payload is None else json.dumps(payload).encode("utf-8")
+        headers = dict(self._headers)
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+
+        command = f"{method} {path}"
+        attempt = 0
+        with span(command, "api", method=method, path=path) as attributes:
+            while True:
+                self.limiter.acquire(command)
+                status, response_headers, text = self.transport(
+                    method, path, body, headers
+                )
+                self.limiter.update(response_headers)
+                attempt += 1
+                attributes.update(
+                    status=status,
+                    attempts=attempt,
+                    response_bytes=len(text.encode("utf-8")) if text else 0,
+                )
+                if status < 400:
+                    return json.loads(text) if text else None
+                if attempt > self.limiter.retries or not self.limiter.should_retry(
+                    method, status, response_headers, text
+                ):
+                    raise GitHubAPIError(method, path, status, text)
+                LOG.info(f"GitHub API request {command} returned {status}. Retrying.")
+                self.limiter.wait_to_retry(attempt, command)
+
+    def create_pull_request(
+        self,
+        repo: str,
+        head: str,
+        base: str,
+        title: str,
+        reviewers: str,
+        checked_out: bool = True,
+        labels: str = "",
+        assignees: str = "",
+        draft: bool = False,
+    ) -> str:
+        """Open a pull request, request reviews, and add labels and assignees.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        head : str
+            The branch with the changes. It must already be pushed.
+        base : str
+            The branch to merge into.
+        title : str
+            The title of the pull request.
+        reviewers : str
+            Comma separated list of reviewers.
+        checked_out : bool, optional (default True)
+            Not used, ``head`` is always expected to be pushed.
+        labels : str, optional (default "")
+            Comma separated list of labels.
+        assignees : str, optional (default "")
+            Comma separated list of assignees.
+        draft : bool, optional (default False)
+            Open the pull request as a draft.
+
+        Returns
+        -------
+        str
+            The URL of the pull request.
+        """
+        payload: Dict[str, Any] = {"head": head, "base": base, "title": title}
+        if draft:
+            payload["draft"] = True
+        pull = self.request("POST", f"/repos/{repo}/pulls", payload)
+        self.request_reviewers(repo, pull["html_url"], reviewers)
+        update = {
+            key: names
+            for key, names in (
+                ("labels", _split(labels)),
+                ("assignees", _split(assignees)),
+            )
+            if names
+        }
+        if update:  # a pull request is an issue
+            self.request(
+                "PATCH", f"/repos/{repo}/issues/{_number(pull['html_url'])}", update
+            )
+        return str(pull["html_url"])
+
+    def request_reviewers(self, repo: str, url: str, reviewers: str):
+        """Request reviews on a pull request.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        url : str
+            The URL of the pull request.
+        reviewers : str
+            Comma separated list of reviewers. Nothing is requested if empty.
+        """
+        logins = _split(reviewers)
+        if logins:
+            self.request(
+                "POST",
+                f"/repos/{repo}/pulls/{_number(url)}/requested_reviewers",
+                {"reviewers": logins},
+            )
+
+    def can_push(self, repo: str) -> bool:
+        """Check the token is valid and allowed to push to a repository.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+
+        Returns
+        -------
+        bool
+            Whether the token can push.
+
+        Raises
+        ------
+        GitHubAPIError
+            Error raised when the token is rejected or the repository not found.
+        """
+        permissions = self.request("GET", f"/repos/{repo}").get("permissions", {})
+        return bool(permissions.get("push"))
+
+    def find_pull_request(self, repo: str, head: str, base: str) -> Optional[str]:
+        """Find an open pull request.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        head : str
+            The branch with the changes.
+        base : str
+            The branch to merge into.
+
+        Returns
+        -------
+        str or None
+            The URL of the pull request, if there is one.
+        """
+        query = urlencode(
+            {"state": "open", "head": f"{repo.split('/')[0]}:{head}", "base": base}
+        )
+        pulls = self.request("GET", f"/repos/{repo}/pulls?{query}")
+        return pulls[0]["html_url"] if pulls else None
+
+    def create_issue(self, repo: str, title: str, *paragraphs: str) -> str:
+        """Open an issue.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        title : str
+            The title of the issue.
+        *paragraphs : str
+            The paragraphs of the issue body.
+
+        Returns
+        -------
+        str
+            The URL of the issue.
+        """
+        issue = self.request(
+            "POST",
+            f"/repos/{repo}/issues",
+            {"title": title, "body": "\n\n".join(paragraphs)},
+        )
+        return str(issue["html_url"])
+
+    def find_issue(self, repo: str, text: str) -> Optional[str]:
+        """Find an open issue with some text in its body.
+
+        Only the 100 most recently created open issues are searched.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        text : str
+            The text to look for.
+
+        Returns
+        -------
+        str or None
+            The URL of the issue, if there is one.
+        """
+        issues = self.request("GET", f"/repos/{repo}/issues?state=open&per_page=100")
+        return _find_issue(issues, text)
+
+    def is_open(self, repo: str, url: str) -> bool:
+        """Check if an issue or pull request is still open.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        url : str
+            The URL of the issue or pull request.
+
+        Returns
+        -------
+        bool
+            True if it is open.
+        """
+        item = self.request("GET", f"/repos/{repo}/{_resource(url)}/{_number(url)}")
+        return bool(item.get("state") == "open")
+
+    def comment_issue(self, repo: str, url: str, body: str):
+        """Comment on an issue.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        url : str
+            The URL of the issue.
+        body : str
+            The comment.
+        """
+        self.request(
+            "POST", f"/repos/{repo}/issues/{_number(url)}/comments", {"body": body}
+        )
+
+    def close(self):
+        """Close the idle connections."""
+        if self.limiter.waited:
+            LOG.info(
+                f"Waited {self.limiter.waited:.1f}s for the GitHub API rate limits "
+                f"over {self.limiter.requests} requests."
+            )
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class GraphQLClient(GitHubClient):
+    """Open pull requests through the GitHub GraphQL API.
+
+    The IDs of the repository, the open pull request, the reviewers, the assignees
+    and the labels are looked up in one query, and the pull request is opened and
+    given its reviewers, labels and assignees with two mutations: GraphQL can't
+    pass the ID of the new pull request to other mutations of the same request,
+    and ``createPullRequest`` takes no reviewers, labels nor assignees. The IDs
+    are kept by the client, so the next pull requests with the same reviewers,
+    labels and assignees only take the two mutations. Issues are handled through
+    the REST API, like ``GitHubClient``.
+
+    Takes the same parameters as ``GitHubClient``.
+    """
+
+    name = "graphql"
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the client."""
+        super().__init__(*args, **kwargs)
+        # the last lookup of each repository, reviewers, labels and assignees
+        self._lookups: Dict[Tuple[str, str, str, str], Dict[str, Any]] = {}
+
+    def _url_path(self, path: str) -> str:
+        """Get the path of a request on the server.
+
+        The GraphQL endpoint of GitHub Enterprise is ``/api/graphql``, next to the
+        ``/api/v3`` REST API.
+        """
+        if path == GRAPHQL_PATH and self._prefix.endswith("/v3"):
+            return self._prefix[: -len("/v3")] + GRAPHQL_PATH
+        return super()._url_path(path)
+
+    def graphql(
+        self, query: str, variables: Dict[str, Any], allow_missing: bool = False
+    ) -> Dict[str, Any]:
+        """Send a GraphQL query or mutation.
+
+        Parameters
+        ----------
+        query : str
+            The document.
+        variables : Dict[str, Any]
+            The values of its variables.
+        allow_missing : bool, optional (default False)
+            Return the data when the only errors are objects not found, which are
+            then None.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The data of the response.
+
+        Raises
+        ------
+        GitHubAPIError
+            Error raised when the API returns an error.
+        """
+        response = self.request(
+            "POST", GRAPHQL_PATH, {"query": query, "variables": variables}
+        )
+        errors = response.get("errors")
+        if errors and not (
+            allow_missing
+            and response.get("data")
+            and all(error.get("type") == "NOT_FOUND" for error in errors)
+        ):
+            raise GitHubAPIError("POST", GRAPHQL_PATH, 200, json.dumps(errors))
+        data: Dict[str, Any] = response["data"]
+        return data
+
+    def lookup(
+        self,
+        repo: str,
+        head: str,
+        base: str,
+        reviewers: str = "",
+        labels: str = "",
+        assignees: str = "",
+    ) -> Dict[str, Any]:
+        """Look up everything needed to open a pull request, in one query.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        head : str
+            The branch with the changes.
+        base : str
+            The branch to merge into.
+        reviewers : str, optional (default "")
+            Comma separated list of reviewers. ``org/team`` names a team.
+        labels : str, optional (default "")
+            Comma separated list of labels.
+        assignees : str, optional (default "")
+            Comma separated list of assignees.
+
+        Returns
+        -------
+        Dict[str, Any]
+            - ``repository_id``: the ID of the repository.
+            - ``can_push``: whether the token can push to it.
+            - ``pull_request``: the URL of the open pull request, if any.
+            - ``users``, ``teams`` and ``labels``: the ID of each reviewer,
+              assignee, team and label, by name. Those that don't exist are left
+              out.
+
+        Raises
+        ------
+        GitHubAPIError
+            Error raised when the token is rejected or the repository not found.
+        """
+        owner, name = repo.split("/", 1)
+        logins = list(dict.fromkeys(_split(reviewers) + _split(assignees)))
+        users = [login for login in logins if "/" not in login]
+        teams = [login for login in logins if "/" in login]
+        label_names = _split(labels)
+
+        variables = {"owner": owner, "name": name, "head": head, "base": base}
+        declarations = [f"${key}: String!" for key in variables]
+        fields, repo_fields = [], []
+        for index, login in enumerate(users):
+            variables[f"u{index}"] = login
+            declarations.append(f"$u{index}: String!")
+            fields.append(f"u{index}: user(login: $u{index}) {{ id }}")
+        for index, team in enumerate(teams):
+            variables[f"o{index}"], variables[f"s{index}"] = team.split("/", 1)
+            declarations += [f"$o{index}: String!", f"$s{index}: String!"]
+            fields.append(
+                f"t{index}: organization(login: $o{index}) "
+                f"{{ team(slug: $s{index}) {{ id }} }}"
+            )
+        for index, label in enumerate(label_names):
+            variables[f"l{index}"] = label
+            declarations.append(f"$l{index}: String!")
+            repo_fields.append(f"l{index}: label(name: $l{index}) {{ id }}")
+        query = (
+            f"query Lookup({', '.join(declarations)}) {{ "
+            "repository(owner: $owner, name: $name) { id viewerPermission "
+            "pullRequests(states: OPEN, headRefName: $head, baseRefName: $base, "
+            f"first: 1) {{ nodes {{ url }} }} {' '.join(repo_fields)} }} "
+            f"{' '.join(fields)} }}"
+        )
+        data = self.graphql(query, variables, allow_missing=True)
+        repository = data.get("repository")
+        if repository is None:
+            raise GitHubAPIError("POST", GRAPHQL_PATH, 404, f"{repo} not found")
+
+        def found(names: List[str], prefix: str, get: Callable) -> Dict[str, str]:
+            ids = {}
+            for index, item in enumerate(names):
+                node = get(f"{prefix}{index}")
+                if node:
+                    ids[item] = node["id"]
+                else:
+                    LOG.info(f"{item} not found on GitHub. Leaving it out.")
+            return ids
+
+        pulls = repository["pullRequests"]["nodes"]
+        result = {
+            "repository_id": repository["id"],
+            "can_push": repository["viewerPermission"] in PUSH_PERMISSIONS,
+            "pull_request": pulls[0]["url"] if pulls else None,
+            "users": found(users, "u", data.get),
+            "teams": found(teams, "t", lambda key: (data.get(key) or {}).get("team")),
+            "labels": found(label_names, "l", repository.get),
+        }
+        self._lookups[(repo, reviewers, labels, assignees)] = result
+        return result
+
+    def can_push(self, repo: str) -> bool:
+        """Check the token is valid and allowed to push to a repository.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+
+        Returns
+        -------
+        bool
+            Whether the token can push.
+
+        Raises
+        ------
+        GitHubAPIError
+            Error raised when the token is rejected or the repository not found.
+        """
+        owner, name = repo.split("/", 1)
+        data = self.graphql(
+            "query CanPush($owner: String!, $name: String!) { "
+            "repository(owner: $owner, name: $name) { viewerPermission } }",
+            {"owner": owner, "name": name},
+        )
+        return data["repository"]["viewerPermission"] in PUSH_PERMISSIONS
+
+    def find_pull_request(self, repo: str, head: str, base: str) -> Optional[str]:
+        """Find an open pull request.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        head : str
+            The branch with the changes.
+        base : str
+            The branch to merge into.
+
+        Returns
+        -------
+        str or None
+            The URL of the pull request, if there is one.
+        """
+        pull_request: Optional[str] = self.lookup(repo, head, base)["pull_request"]
+        return pull_request
+
+    def find_many(
+        self, targets: List[Tuple[str, str, str]], text: Optional[str] = None
+    ) -> Dict[str, Dict[str, Optional[str]]]:
+        """Find the open pull requests, and issues, of many repositories at once.
+
+        Only the 100 most recently created open issues of each repository are
+        searched.
+
+        Parameters
+        ----------
+        targets : List[Tuple[str, str, str]]
+            The repository, as ``org/name``, head branch and base branch of each
+            pull request.
+        text : str, optional (default None)
+            The text to look for in the body of the issues. No issue is looked
+            up if None.
+
+        Returns
+        -------
+        Dict[str, Dict[str, Optional[str]]]
+            The URL of the ``pull_request`` and of the ``issue``, if any, of each
+            repository. Repositories that are not found are left out.
+        """
+        variables: Dict[str, str] = {}
+        declarations, fields = [], []
+        issues = (
+            "issues(states: OPEN, first: 100, "
+            "orderBy: {field: CREATED_AT, direction: DESC}) { nodes { url body } }"
+            if text is not None
+            else ""
+        )
+        for index, (repo, head, base) in enumerate(targets):
+            owner, name = repo.split("/", 1)
+            keys = [f"{key}{index}" for key in "onhb"]
+            variables.update(zip(keys, (owner, name, head, base)))
+            declarations += [f"${key}: String!" for key in keys]
+            fields.append(
+                f"r{index}: repository(owner: $o{index}, name: $n{index}) {{ "
+                f"pullRequests(states: OPEN, headRefName: $h{index}, "
+                f"baseRefName: $b{index}, first: 1) {{ nodes {{ url }} }} {issues} }}"
+            )
+        if not fields:
+            return {}
+        data = self.graphql(
+            f"query FindMany({', '.join(declarations)}) {{ {' '.join(fields)} }}",
+            variables,
+            allow_missing=True,
+        )
+        found = {}
+        for index, (repo, _, _) in enumerate(targets):
+            repository = data.get(f"r{index}")
+            if repository is None:
+                LOG.info(f"{repo} not found on GitHub.")
+                continue
+            pulls = repository["pullRequests"]["nodes"]
+            found[repo] = {
+                "pull_request": pulls[0]["url"] if pulls else None,
+                "issue": None,
+            }
+            for issue in (repository.get("issues") or {}).get("nodes", []):
+                if text in (issue.get("body") or ""):
+                    found[repo]["issue"] = issue["url"]
+                    break
+        return found
+
+    def create_pull_request(
+        self,
+        repo: str,
+        head: str,
+        base: str,
+        title: str,
+        reviewers: str,
+        checked_out: bool = True,
+        labels: str = "",
+        assignees: str = "",
+        draft: bool = False,
+        lookup: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Open a pull request, request reviews, and add labels and assignees.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``org/name``.
+        head : str
+            The branch with the changes. It must already be pushed.
+        base : str
+            The branch to merge into.
+        title : str
+            The title of the pull request.
+        reviewers : str
+            Comma separated list of reviewers. ``org/team`` names a team.
+        checked_out : bool, optional (default True)
+            Not used, ``head`` is always expected to be pushed.
+        labels : str, optional (default "")
+            Comma separated list of labels.
+        assignees : str, optional (default "")
+            Comma separated list of assignees.
+        draft : bool, optional (default False)
+            Open the pull request as a draft.
+        lookup : Dict, optional (default None)
+            The result of ``lookup`` with the same reviewers, labels and
+            assignees, if it was done ahead of time. Defaults to the last one
+            done by the client, and only then to a new lookup.
+
+        Returns
+        -------
+        str
+            The URL of the pull request.
+        """
+        if lookup is None:
+            lookup = self._lookups.get((repo, reviewers, labels, assignees))
+        if lookup is None:
+            lookup = self.lookup(repo, head, base, reviewers, labels, assignees)
+        created = self.graphql(
+            "mutation CreatePullRequest($input: CreatePullRequestInput!) { "
+            "createPullRequest(input: $input) { pullRequest { id url } } }",
+            {
+                "input": {
+                    "repositoryId": lookup["repository_id"],
+                    "headRefName": head,
+                    "baseRefName": base,
+                    "title": title,
+                    "draft": draft,
+                }
+            },
+        )["createPullRequest"]["pullRequest"]
+
+        def ids(names: str, kind: str) -> List[str]:
+            return [lookup[kind][n] for n in _split(names) if n in lookup[kind]]
+
+        variables = {
+            "users": ids(reviewers, "users"),
+            "teams": ids(reviewers, "teams"),
+            "labels": ids(labels, "labels"),
+            "assignees": ids(assignees, "users"),
+        }
+        fields = []
+        if variables["users"] or variables["teams"]:
+            fields.append(
+                "requestReviews(input: {pullRequestId: $id, userIds: $users, "
+                "teamIds: $teams}) { clientMutationId }"
+            )
+        else:
+            del variables["users"], variables["teams"]
+        if variables["labels"]:
+            fields.append(
+                "addLabelsToLabelable(input: {labelableId: $id, labelIds: $labels}) "
+                "{ clientMutationId }"
+            )
+        else:
+            del variables["labels"]
+        if variables["assignees"]:
+            fields.append(
+                "addAssigneesToAssignable(input: {assignableId: $id, "
+                "assigneeIds: $assignees}) { clientMutationId }"
+            )
+        else:
+            del variables["assignees"]
+        if fields:
+            declarations = ["$id: ID!"] + [f"${key}: [ID!]!" for key in variables]
+            self.graphql(
+                f"mutation FinishPullRequest({', '.join(declarations)}) {{ "
+                f"{' '.join(fields)} }}",
+                {"id": created["id"], **variables},
+            )
+        return str(created["url"])
+
+
+CLIENTS = [HubClient.name, GitHubClient.name, GraphQLClient.name]
@@ -0,0 +1,246 @@
+"""Lease on an updater branch, so a single run submits to it at a time.
+
+Two runs on the same repository, e.g. a nightly run and a manual re-run, would
+otherwise delete each other's branch and race on the PR. The lease is held in
+two places:
+
+- a file lock, for the runs on the same machine. It is released by the system
+  when the process exits, even if it crashes.
+- a ref on the remote, ``refs/edgetest/locks/<updater_branch>``, for the runs on
+  other machines. It points to a commit of the empty tree whose message records
+  the owner and when the lease expires. It is created and removed with
+  ``--force-with-lease``, so only one run can take it, and a lease left behind by
+  a run that crashed is taken over once it expires.
+"""
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import IO, Any, Dict, Optional, Union
+
+from edgetest.logger import get_logger
+
+from edgetest_hub.backends import GitBackend
+from edgetest_hub.utils import remaining_time
+
+LOG = get_logger(__name__)
+
+LEASE_DIR = "~/.cache/edgetest-hub/locks"
+LEASE_REF = "refs/edgetest/locks/{}"
+
+
+class LeaseHeldError(RuntimeError):
+    """Error raised when another run holds the lease of a branch.
+
+    Parameters
+    ----------
+    branch : str
+        The updater branch.
+    owner : str
+        The run holding the lease, if known.
+    """
+
+    def __init__(self, branch: str, owner: str):
+        """Initialize the error."""
+        self.branch = branch
+        self.owner = owner
+        super().__init__(f"The lease of {branch} is held by {owner}.")
+
+
+def lease_owner() -> str:
+    """Name the current run, as ``host:pid``."""
+    import socket
+
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Lease:
+    """Lease on the updater branch of a repository.
+
+    Parameters
+    ----------
+    git : GitBackend
+        The git backend used to read and write the remote ref.
+    url : str
+        The remote URL.
+    branch : str
+        The updater branch.
+    key : str
+        The repository, e.g. ``host/org/name``. It names the lock file.
+    ttl : float, optional (default 3600)
+        How long the lease is held at most, in seconds. Another run takes over a
+        lease that is older, so it must be longer than a submission.
+    lock_dir : str or Path, optional (default LEASE_DIR)
+        The directory of the lock files. It is created if needed.
+    """
+
+    def __init__(
+        self,
+        git: GitBackend,
+        url: str,
+        branch: str,
+        key: str,
+        ttl: float = 3600,
+        lock_dir: Union[str, Path] = LEASE_DIR,
+    ):
+        """Initialize the lease."""
+        self.git = git
+        self.url = url
+        self.branch = branch
+        self.ref = LEASE_REF.format(branch)
+        self.ttl = ttl
+        self.owner = lease_owner()
+        self.sha: Optional[str] = None
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "-", f"{key}-{branch}")
+        self._lock_path = Path(lock_dir).expanduser() / f"{slug}.lock"
+        self._lock_file: Optional[IO] = None
+
+    def _lock(self) -> bool:
+        """Take the file lock, without waiting."""
+        try:
+            import fcntl
+        except ImportError:  # not POSIX, rely on the remote ref alone
+            return True
+        self._lock_path.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self._lock_path, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _unlock(self):
+        """Release the file lock."""
+        if self._lock_file is not None:
+            import fcntl
+
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _read(self, sha: str) -> Dict[str, Any]:
+        """Read the owner and expiry of a lease commit on the remote."""
+        try:
+            self.git.fetch_ref(self.url, self.ref)
+            holder = json.loads(self.git.commit_message(sha))
+            return {"owner": str(holder["owner"]), "expires": float(holder["expires"])}
+        except (RuntimeError, ValueError, KeyError, TypeError):
+            return {"owner": sha, "expires": 0.0}
+
+    def holder(self) -> Optional[Dict[str, Any]]:
+        """Read the lease on the remote.
+
+        Returns
+        -------
+        Dict or None
+            The ``owner`` of the lease, and when it ``expires``, in seconds since
+            the epoch. None if nobody holds it. A lease that can't be read has
+            expired.
+        """
+        sha = self.git.remote_ref(self.url, self.ref)
+        return None if sha is None else self._read(sha)
+
+    def try_acquire(self) -> Optional[str]:
+        """Take the lease, without waiting.
+
+        Returns
+        -------
+        str or None
+            None if the lease was taken, or the run holding it.
+
+        Raises
+        ------
+        RuntimeError
+            Error raised when the remote lease can't be read or written.
+        """
+        if not self._lock():
+            return "another run on this machine"
+        try:
+            current = self.git.remote_ref(self.url, self.ref)
+            if current is not None:
+                holder = self._read(current)
+                if holder["expires"] > time.time():
+                    self._unlock()
+                    return str(holder["owner"])
+                LOG.info(
+                    f"The lease of {self.branch} held by {holder['owner']} expired. "
+                    "Taking it over."
+                )
+            now = time.time()
+            sha = self.git.write_marker(
+                json.dumps(
+                    {"owner": self.owner, "acquired": now, "expires": now + self.ttl}
+                )
+            )
+            try:
+                self.git.push_ref(self.url, self.ref, sha, current or "")
+            except RuntimeError:
+                if self.git.remote_ref(self.url, self.ref) == current:
+                    raise
+                self._unlock()  # another run took the lease first
+                return "another run"
+        except BaseException:
+            self._unlock()
+            raise
+        self.sha = sha
+        return None
+
+    def acquire(self, wait: float = 0, interval: float = 10) -> float:
+        """Take the lease, waiting for another run to release it.
+
+        Parameters
+        ----------
+        wait : float, optional (default 0)
+            How long to wait at most, in seconds.
+        interval : float, optional (default 10)
+            How often to try again while waiting, in seconds.
+
+        Raises
+        ------
+        LeaseHeldError
+            Error raised when another run still holds the lease after ``wait``.
+        CommandTimeoutError
+            Error raised when the deadline set with ``command_timeouts`` passes
+            while waiting.
+
+        Returns
+        -------
+        float
+            How long it waited for another run, in seconds. Anything looked up
+            before then may be out of date.
+        """
+        start = time.monotonic()
+        waited = 0.0
+        while True:
+            owner = self.try_acquire()
+            if owner is None:
+                LOG.info(f"Took the lease of {self.branch}.")
+                return waited
+            remaining = start + wait - time.monotonic()
+            if remaining <= 0:
+                raise LeaseHeldError(self.branch, owner)
+            # each wait is bounded like a command, never past the deadline
+            remaining = remaining_time("lease", remaining) or remaining
+            LOG.info(f"Waiting for the lease of {self.branch}, held by {owner}.")
+            time.sleep(min(interval, remaining))
+            waited = time.monotonic() - start
+
+    def release(self):
+        """Give the lease back.
+
+        The remote ref is only removed if it is still ours. If it can't be, it is
+        left to expire.
+        """
+        if self.sha is not None:
+            try:
+                self.git.push_ref(self.url, self.ref, None, self.sha)
+            except RuntimeError:
+                LOG.info(
+                    f"Unable to release the lease of {self.branch}. "
+                    "It will expire on its own."
+                )
+            self.sha = None
+        self._unlock()
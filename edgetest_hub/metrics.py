@@ -0,0 +1,297 @@
+"""Prometheus textfile and JSON metrics of the plugin runs."""
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from edgetest.logger import get_logger
+
+LOG = get_logger(__name__)
+
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+METRICS = {
+    "edgetest_hub_runs_total": (
+        "counter",
+        "Runs of the hub plugin, by outcome.",
+    ),
+    "edgetest_hub_run_seconds": (
+        "histogram",
+        "Duration of the hub plugin runs, by outcome.",
+    ),
+    "edgetest_hub_step_seconds": (
+        "histogram",
+        "Duration of the hub plugin steps.",
+    ),
+    "edgetest_hub_commands_total": (
+        "counter",
+        "Commands and GitHub API requests run by the hub plugin.",
+    ),
+    "edgetest_hub_last_run_timestamp_seconds": (
+        "gauge",
+        "When the last run of the hub plugin finished.",
+    ),
+    "edgetest_hub_last_run_seconds": (
+        "gauge",
+        "Duration of the last run of the hub plugin.",
+    ),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def run_summary(spans: List[Dict[str, Any]], root: str) -> Dict[str, Any]:
+    """Summarize the spans of a run.
+
+    Parameters
+    ----------
+    spans : List[Dict]
+        The spans recorded by a ``Tracer``.
+    root : str
+        The name of the span covering the whole run, e.g. ``post_run_hook``.
+
+    Returns
+    -------
+    Dict
+        The ``outcome`` and ``seconds`` of the run, the total ``steps`` seconds
+        by step name, and the number of ``commands`` by category. The outcome is
+        ``skipped`` when nothing was submitted nor reported, and ``failed`` when
+        the run raised an error without recording an outcome.
+    """
+    run = [span for span in spans if span["name"] == root and span["parent"] is None]
+    run_span = run[-1] if run else None
+    outcomes = [
+        span["attributes"]["outcome"]
+        for span in sorted(spans, key=lambda span: span["start"])
+        if "outcome" in span["attributes"]
+    ]
+    if outcomes:
+        outcome = outcomes[-1]
+    elif run_span and "error" in run_span["attributes"]:
+        outcome = "failed"
+    else:
+        outcome = "skipped"
+
+    steps: Dict[str, float] = {}
+    commands: Dict[str, int] = {}
+    for span in spans:
+        if span["category"] == "step":
+            steps[span["name"]] = steps.get(span["name"], 0.0) + span["duration"]
+        elif span["category"] in ("command", "api"):
+            commands[span["category"]] = commands.get(span["category"], 0) + 1
+    return {
+        "outcome": re.sub(r"\W+", "_", outcome),
+        "seconds": run_span["duration"] if run_span else 0.0,
+        "finished": time.time(),
+        "steps": steps,
+        "commands": commands,
+    }
+
+
+def _key(labels: Dict[str, str]) -> LabelKey:
+    """Get a hashable, ordered form of labels."""
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: LabelKey) -> str:
+    """Format labels for the Prometheus text format."""
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value."""
+    return repr(float(value)) if value % 1 else str(int(value))
+
+
+class Metrics:
+    """Cumulative counters, gauges and histograms of the plugin runs.
+
+    They are kept in a JSON summary next to the textfile, so each run adds to the
+    totals of the previous ones without any metrics service.
+    """
+
+    def __init__(self):
+        """Initialize empty metrics."""
+        self.samples: Dict[Tuple[str, LabelKey], float] = {}
+        self.histograms: Dict[Tuple[str, LabelKey], Dict[str, Any]] = {}
+
+    def inc(self, name: str, labels: Dict[str, str], value: float = 1):
+        """Add to a counter."""
+        key = (name, _key(labels))
+        self.samples[key] = self.samples.get(key, 0) + value
+
+    def set(self, name: str, labels: Dict[str, str], value: float):
+        """Set a gauge."""
+        self.samples[(name, _key(labels))] = value
+
+    def observe(self, name: str, labels: Dict[str, str], value: float):
+        """Add an observation to a histogram."""
+        histogram = self.histograms.setdefault(
+            (name, _key(labels)),
+            {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0},
+        )
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def to_json(self) -> Dict[str, Any]:
+        """Get the metrics as JSON data."""
+        return {
+            "samples": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.samples.items())
+            ],
+            "histograms": [
+                dict(histogram, name=name, labels=dict(labels))
+                for (name, labels), histogram in sorted(self.histograms.items())
+            ],
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Metrics":
+        """Load metrics saved with ``to_json``.
+
+        Histograms saved with other buckets are dropped.
+        """
+        metrics = cls()
+        for sample in data.get("samples", []):
+            metrics.samples[(sample["name"], _key(sample["labels"]))] = sample["value"]
+        for histogram in data.get("histograms", []):
+            if len(histogram["buckets"]) == len(BUCKETS):
+                metrics.histograms[(histogram["name"], _key(histogram["labels"]))] = {
+                    "buckets": histogram["buckets"],
+                    "sum": histogram["sum"],
+                    "count": histogram["count"],
+                }
+        return metrics
+
+    def to_prometheus(self) -> str:
+        """Format the metrics in the Prometheus text format."""
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            samples = sorted(
+                (labels, value)
+                for (sample, labels), value in self.samples.items()
+                if sample == name
+            )
+            histograms = sorted(
+                (labels, histogram)
+                for (sample, labels), histogram in self.histograms.items()
+                if sample == name
+            )
+            if not samples and not histograms:
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for labels, histogram in histograms:
+                for bound, count in zip(BUCKETS, histogram["buckets"]):
+                    bucket = _format_labels(labels + (("le", str(bound)),))
+                    lines.append(f"{name}_bucket{bucket} {count}")
+                bucket = _format_labels(labels + (("le", "+Inf"),))
+                lines.append(f"{name}_bucket{bucket} {histogram['count']}")
+                formatted = _format_labels(labels)
+                lines.append(f"{name}_sum{formatted} {_format_value(histogram['sum'])}")
+                lines.append(f"{name}_count{formatted} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _write(path: Path, text: str):
+    """Write a file atomically, so a collector never reads half of it."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _locked(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on a file, waiting for any other run."""
+    try:
+        import fcntl
+    except ImportError:  # not POSIX, rely on the atomic writes alone
+        yield
+        return
+    with open(path, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def write_metrics(
+    directory: Union[str, Path], repo: str, summary: Dict[str, Any]
+) -> Tuple[Path, Path]:
+    """Add a run to the metrics of a repository and write them.
+
+    The metrics are written to ``edgetest_hub_<repo>.prom``, for the textfile
+    collector of the node exporter, and ``edgetest_hub_<repo>.json``, which also
+    holds the summary of the last run. Runs of the same repository update them
+    one at a time, under a lock on ``.edgetest_hub_<repo>.lock``.
+
+    Parameters
+    ----------
+    directory : str or Path
+        The directory, e.g. the one read by the textfile collector. It is created
+        if needed.
+    repo : str
+        The repository, as ``host/org/name``.
+    summary : Dict
+        The summary of the run, from ``run_summary``.
+
+    Returns
+    -------
+    Path
+        The textfile.
+    Path
+        The JSON summary.
+    """
+    directory = Path(directory).expanduser()
+    directory.mkdir(parents=True, exist_ok=True)
+    slug = re.sub(r"[^\w.-]+", "_", repo)
+    prom, summary_path = (
+        directory / f"edgetest_hub_{slug}.prom",
+        directory / f"edgetest_hub_{slug}.json",
+    )
+
+    with _locked(directory / f".edgetest_hub_{slug}.lock"):
+        data: Optional[Dict[str, Any]] = None
+        try:
+            data = json.loads(summary_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            LOG.info(f"Unable to read {summary_path}. Starting the metrics over.")
+        metrics = Metrics.from_json(data or {})
+
+        labels = {"repo": repo}
+        outcome = dict(labels, outcome=summary["outcome"])
+        metrics.inc("edgetest_hub_runs_total", outcome)
+        metrics.observe("edgetest_hub_run_seconds", outcome, summary["seconds"])
+        for step, seconds in summary["steps"].items():
+            metrics.observe(
+                "edgetest_hub_step_seconds", dict(labels, step=step), seconds
+            )
+        for kind, count in summary["commands"].items():
+            metrics.inc("edgetest_hub_commands_total", dict(labels, kind=kind), count)
+        metrics.set(
+            "edgetest_hub_last_run_timestamp_seconds",
+            labels,
+            round(summary["finished"]),
+        )
+        metrics.set("edgetest_hub_last_run_seconds", labels, summary["seconds"])
+
+        data = dict(metrics.to_json(), last_run=dict(summary, repo=repo))
+        _write(summary_path, json.dumps(data, indent=2))
+        _write(prom, metrics.to_prometheus())
+    return prom, summary_path
@@ -1,178 +1,1458 @@
 """Plugin for hub functionality with ``edgetest``."""
+import contextvars
 import os
-from typing import Dict, List
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple, Union
 
 import pluggy
 from edgetest.logger import get_logger
-from edgetest.report import gen_report
-from edgetest.schema import Schema
-from edgetest.utils import _run_command
+
+from edgetest_hub.backends import BACKENDS, GitBackend, get_backend, worktree_blob_ids
+from edgetest_hub.cassette import CASSETTE_MODES, Cassette
+from edgetest_hub.github import (
+    CLIENTS,
+    GitHubClient,
+    GraphQLClient,
+    HubClient,
+    RateLimiter,
+    api_url_for,
+)
+from edgetest_hub.lease import LEASE_DIR, Lease, LeaseHeldError
+from edgetest_hub.metrics import run_summary, write_metrics
+from edgetest_hub.report import (
+    MAX_COMMENTS,
+    REPORT_ARTIFACTS,
+    REPORT_BYTES,
+    REPORT_DIR,
+    Report,
+    artifact_chunks,
+    build_report,
+)
+from edgetest_hub.scheduler import Step, run_steps
+from edgetest_hub.spool import SPOOL_DIR, Spool
+from edgetest_hub.state import Run, StateStore
+from edgetest_hub.tracing import Tracer, annotate, span, traced, tracing
+from edgetest_hub.utils import (
+    CommandTimeoutError,
+    _run_command,
+    command_timeouts,
+    git_environment,
+    redact,
+    remaining_time,
+)
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from edgetest.schema import Schema
 
 LOG = get_logger(__name__)
 
 hookimpl = pluggy.HookimplMarker("edgetest")
 
-HUB_COMMAND = "hub"
-GIT_COMMAND = "git"
+GitHubClientType = Union[HubClient, GitHubClient, GraphQLClient]
+
 GIT_TOKEN_ENVNAME = "GITHUB_TOKEN"
+DEPENDENCY_FILES = ("setup.cfg", "requirements.txt")
+COMMIT_MESSAGE = "environmentally friendly"
+COMMIT_MODES = ["checkout", "plumbing", "worktree"]
+ISSUE_DEDUPE = ["skip", "comment", "off"]
+SUBMIT_MODES = ["foreground", "spool"]
+SPLIT_MODES = ["off", "package", "environment"]
+# the name of the package required on a line of ``requirements.txt`` or ``setup.cfg``
+REQUIREMENT_LINE = re.compile(
+    r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*(?:[<>=!~]=|[<>;]|$)"
+)
+FINGERPRINT_MARKER = "<!-- edgetest-hub fingerprint: {} -->"
 
+# background lookups started by ``pre_run_hook``, keyed by ``id(conf)``
+_PREFETCH: Dict[int, "Future"] = {}
+# spans of a run, from ``pre_run_hook`` until ``post_run_hook`` exports them
+_TRACERS: Dict[int, Tracer] = {}
+# cassettes of a run, opened by the first command, which can run in the background
+_CASSETTES: Dict[int, Cassette] = {}
+_CASSETTES_LOCK = threading.Lock()
 
-def configure_branch(conf: Dict):
-    """Configure the git and the branch before we submit a PR with hub.
 
-    Parameters
-    ----------
-    conf: Dict
+def _cassette(conf: Dict) -> Optional[Cassette]:
+    """Get the cassette of the run, if ``cassette_path`` is set."""
+    if not conf["hub"].get("cassette_path"):
+        return None
+    with _CASSETTES_LOCK:
+        if id(conf) not in _CASSETTES:
+            _CASSETTES[id(conf)] = Cassette(
+                conf["hub"]["cassette_path"], conf["hub"].get("cassette_mode", "record")
+            )
+        return _CASSETTES[id(conf)]
 
 
-    Returns
-    -------
-    None
+def _runner(conf: Dict):
+    """Get the command runner of the run, recorded or replayed with a cassette."""
+    cassette = _cassette(conf)
+    return cassette.run_command(_run_command) if cassette else _run_command
+
+
+def _get_git_backend(conf: Dict) -> GitBackend:
+    """Get the git backend set in the configuration."""
+    return get_backend(conf["hub"].get("git_backend", "cli"), _runner(conf))
+
+
+def _get_github_client(
+    conf: Dict, limiter: Optional[RateLimiter] = None
+) -> GitHubClientType:
+    """Get the client set in the configuration to open PRs and issues.
+
+    The API clients pace their requests with ``limiter``, or a new one following
+    ``api_rate`` and ``api_retries``.
     """
-    git_repo_url = (
+    api_clients = {cls.name: cls for cls in (GitHubClient, GraphQLClient)}
+    if conf["hub"].get("github_client", "hub") in api_clients:
+        if limiter is None:
+            limiter = RateLimiter(
+                conf["hub"].get("api_rate", 0), conf["hub"].get("api_retries", 5)
+            )
+        client = api_clients[conf["hub"]["github_client"]](
+            conf["hub"].get("api_url") or api_url_for(conf["hub"]["git_url"]),
+            os.environ[GIT_TOKEN_ENVNAME],
+            limiter=limiter,
+        )
+        cassette = _cassette(conf)
+        if cassette:
+            client.transport = cassette.transport(client.transport)
+        return client
+    return HubClient(_runner(conf))
+
+
+def _git_repo_url(conf: Dict) -> str:
+    """Get the authenticated URL of the repository."""
+    return (
         f"https://{os.environ[GIT_TOKEN_ENVNAME]}@{conf['hub']['git_url']}/"
         f"{conf['hub']['git_repo_org']}/{conf['hub']['git_repo_name']}.git"
     )
-    out, _ = _run_command(
-        GIT_COMMAND, "config", "user.name", conf["hub"]["git_username"]
+
+
+def _git_environment(conf: Dict):
+    """Pass the git and hub settings of the run through the environment.
+
+    Commits are attributed to ``git_username`` and ``git_useremail``, pushes to the
+    ``git_url`` host are authenticated with the token, and ``hub`` is told about
+    the host. Nothing is written to the repository or global git config, and git
+    fails rather than prompting for credentials.
+    """
+    host = conf["hub"]["git_url"]
+    token_url = f"https://{os.environ[GIT_TOKEN_ENVNAME]}@{host}/"
+    config = [
+        (f"url.{token_url}.pushInsteadOf", prefix)
+        for prefix in (f"https://{host}/", f"git@{host}:", f"ssh://git@{host}/")
+    ]
+    if conf["hub"].get("github_client", "hub") == HubClient.name:
+        config += [("hub.protocol", "https"), ("hub.host", host)]
+    return git_environment(
+        config,
+        {
+            "GIT_AUTHOR_NAME": conf["hub"]["git_username"],
+            "GIT_AUTHOR_EMAIL": conf["hub"]["git_useremail"],
+            "GIT_COMMITTER_NAME": conf["hub"]["git_username"],
+            "GIT_COMMITTER_EMAIL": conf["hub"]["git_useremail"],
+            "GIT_TERMINAL_PROMPT": "0",
+        },
     )
-    out, _ = _run_command(
-        GIT_COMMAND, "config", "user.email", conf["hub"]["git_useremail"]
+
+
+def _tracer(conf: Dict) -> Optional[Tracer]:
+    """Get the tracer of the run, if ``trace_path`` or ``metrics_dir`` is set."""
+    if not (conf["hub"].get("trace_path") or conf["hub"].get("metrics_dir")):
+        return None
+    return _TRACERS.setdefault(id(conf), Tracer())
+
+
+@contextmanager
+def _traced(conf: Dict, name: str) -> Iterator[None]:
+    """Record a phase that ends the run, then export the spans and metrics."""
+    try:
+        with tracing(_tracer(conf)), span(name, "phase"):
+            yield
+    finally:
+        with _CASSETTES_LOCK:
+            cassette = _CASSETTES.pop(id(conf), None)
+        if cassette is not None:
+            cassette.close()
+        tracer = _TRACERS.pop(id(conf), None)
+        if tracer is not None and conf["hub"].get("trace_path"):
+            path = tracer.export(conf["hub"]["trace_path"])
+            LOG.info(f"Wrote the trace of the run to {path}.")
+        if tracer is not None and conf["hub"].get("metrics_dir"):
+            try:
+                path, _ = write_metrics(
+                    conf["hub"]["metrics_dir"],
+                    _repo_key(conf),
+                    run_summary(tracer.spans, name),
+                )
+            except OSError as err:
+                LOG.info(f"Unable to write the metrics of the run. {err}")
+            else:
+                LOG.info(f"Wrote the metrics of the run to {path}.")
+
+
+def _open_state(conf: Dict) -> Optional[StateStore]:
+    """Open the state store set in the configuration, if any."""
+    if not conf["hub"].get("state_path"):
+        return None
+    return StateStore(
+        conf["hub"]["state_path"], conf["hub"].get("state_retention_days", 30)
     )
-    out, _ = _run_command(GIT_COMMAND, "remote", "set-url", "origin", git_repo_url)
-    out, _ = _run_command(GIT_COMMAND, "config", "--global", "hub.protocol", "https")
-    out, _ = _run_command(
-        GIT_COMMAND,
-        "config",
-        "--global",
-        "--add",
-        "hub.host",
-        conf["hub"]["git_url"],
+
+
+def _repo_key(conf: Dict) -> str:
+    """Get the key of the repository in the state store."""
+    return (
+        f"{conf['hub']['git_url']}/{conf['hub']['git_repo_org']}/"
+        f"{conf['hub']['git_repo_name']}"
     )
 
-    try:  # delete any remote updater_branch
-        out, _ = _run_command(
-            GIT_COMMAND, "push", git_repo_url, "--delete", conf["hub"]["updater_branch"]
-        )
+
+def _is_open(client: GitHubClientType, repo: str, url: str) -> bool:
+    """Check if an issue or PR recorded in the state store is still open.
+
+    It is taken as closed if it can't be looked up, e.g. after it was deleted.
+    """
+    try:
+        return client.is_open(repo, url)
+    except RuntimeError as err:
+        LOG.info(f"Unable to look up {url}.")
+        LOG.debug(str(err))
+        return False
+
+
+def _content_key(conf: Dict, git: GitBackend) -> str:
+    """Hash the local ``pr_to_branch`` commit and the dependency files."""
+    import hashlib
+
+    try:
+        base = git.rev_parse(conf["hub"]["pr_to_branch"])
     except RuntimeError:
-        LOG.info(
-            f"Remote branch {conf['hub']['updater_branch']} not found. Continuing on."
-        )
+        base = git.rev_parse("HEAD")
+    blobs = sorted(worktree_blob_ids(DEPENDENCY_FILES).items())
+    return hashlib.sha256(f"{base} {blobs}".encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def _leased(conf: Dict, git: GitBackend) -> Iterator[float]:
+    """Hold the lease of the updater branch, if ``lease`` is set.
+
+    Yields how long it waited for another run, in seconds.
+    """
+    if not conf["hub"].get("lease"):
+        yield 0.0
+        return
+    lease = Lease(
+        git,
+        _git_repo_url(conf),
+        conf["hub"]["updater_branch"],
+        _repo_key(conf),
+        ttl=conf["hub"].get("lease_ttl", 3600),
+        lock_dir=conf["hub"].get("lease_dir") or LEASE_DIR,
+    )
+    with span("acquire_lease", "step"), _git_environment(conf):
+        waited = lease.acquire(conf["hub"].get("lease_wait", 0))
+        annotate(waited=waited)
+    try:
+        yield waited
+    finally:
+        lease.release()
+
+
+def _pull_request_options(conf: Dict) -> Dict[str, Any]:
+    """Get the labels, assignees and draft state of the PRs."""
+    return {
+        "labels": conf["hub"].get("pr_labels", ""),
+        "assignees": conf["hub"].get("pr_assignees", ""),
+        "draft": conf["hub"].get("pr_draft", False),
+    }
+
+
+def _lookup(conf: Dict, client: GraphQLClient) -> Dict[str, Any]:
+    """Look up the IDs needed to open the PR with the GraphQL API."""
+    return client.lookup(
+        f"{conf['hub']['git_repo_org']}/{conf['hub']['git_repo_name']}",
+        conf["hub"]["updater_branch"],
+        conf["hub"]["pr_to_branch"],
+        conf["hub"]["pr_reviewers"],
+        conf["hub"].get("pr_labels", ""),
+        conf["hub"].get("pr_assignees", ""),
+    )
+
+
+def _lookup_step(conf: Dict, client: GraphQLClient) -> Step:
+    """Get the step that runs ``_lookup``."""
+
+    def lookup(results: Dict) -> Dict[str, Any]:
+        return _lookup(conf, client)
+
+    return Step("lookup", lookup)
+
+
+def _worktree_path(conf: Dict, git: GitBackend) -> Path:
+    """Get the location of the cached worktree for the updater branch."""
+    if conf["hub"].get("worktree_dir"):
+        return Path(conf["hub"]["worktree_dir"]).resolve()
+    return git.common_dir() / "edgetest-hub" / "worktree"
 
-    try:  # delete any local updater_branch
-        out, _ = _run_command(
-            GIT_COMMAND, "branch", "-D", conf["hub"]["updater_branch"]
+
+def _package_name(name: str) -> str:
+    """Normalize a package name, as pip does."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _requirement_name(line: str) -> Optional[str]:
+    """Get the normalized name of the package required on a line, if any."""
+    match = REQUIREMENT_LINE.match(line)
+    return _package_name(match.group(1)) if match else None
+
+
+def apply_packages(base: str, updated: str, packages: List[str]) -> str:
+    """Apply the requirements of some packages from an updated file to its base.
+
+    Each line of ``base`` requiring one of ``packages`` is replaced by the line
+    requiring the same package in ``updated``, in order, keeping its indentation.
+    Every other line is kept as it is in ``base``.
+
+    Parameters
+    ----------
+    base : str
+        The content of the file on ``pr_to_branch``.
+    updated : str
+        The content of the file updated by edgetest.
+    packages : List[str]
+        The packages to update.
+
+    Returns
+    -------
+    str
+        The content of the file with only those packages updated.
+    """
+    wanted = {_package_name(name) for name in packages}
+    lines: Dict[str, List[str]] = {}
+    for line in updated.splitlines():
+        name = _requirement_name(line)
+        if name in wanted:
+            lines.setdefault(name, []).append(line.strip())
+    result = []
+    for line in base.splitlines(keepends=True):
+        name = _requirement_name(line)
+        if name in wanted and lines.get(name):
+            body = line.rstrip("\r\n")
+            indent = body[: len(body) - len(body.lstrip())]
+            result.append(indent + lines[name].pop(0) + line[len(body) :])
+        else:
+            result.append(line)
+    return "".join(result)
+
+
+def split_groups(testers: List, mode: str) -> Dict[str, Dict[str, str]]:
+    """Group the upgraded packages of a run, one group per PR.
+
+    Parameters
+    ----------
+    testers : List
+        The testers of the run.
+    mode : str
+        ``package`` for a group per package upgraded in the last environment,
+        whose versions are exported, or ``environment`` for a group per passing
+        environment.
+
+    Returns
+    -------
+    Dict[str, Dict[str, str]]
+        The version of each package of each group, keyed by group name.
+    """
+    groups: Dict[str, Dict[str, str]] = {}
+    for tester in testers[-1:] if mode == "package" else testers:
+        if not tester.status:
+            continue
+        try:
+            packages = {
+                pkg["name"]: pkg["version"] for pkg in tester.upgraded_packages()
+            }
+        except (RuntimeError, OSError, ValueError):  # the environment is missing
+            LOG.info(f"Unable to list the packages upgraded in {tester.envname}.")
+            continue
+        if mode == "package":
+            groups.update({name: {name: version} for name, version in packages.items()})
+        elif packages:
+            groups[tester.envname] = packages
+    return groups
+
+
+def _group_conf(conf: Dict, group: str) -> Dict:
+    """Get the configuration of the PR of a group, on its own branch."""
+    slug = re.sub(r"[^A-Za-z0-9._]+", "-", group).strip("-").lower()
+    return {
+        **conf,
+        "hub": {
+            **conf["hub"],
+            "updater_branch": f"{conf['hub']['updater_branch']}-{slug}",
+            "commit_mode": "plumbing",
+        },
+    }
+
+
+@traced()
+def is_unchanged(
+    conf: Dict,
+    git: Optional[GitBackend] = None,
+    prefetched: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """Check if the remote updater branch already has the same dependency files.
+
+    Only the ``updater_branch`` ref is fetched, and its blob IDs are compared with
+    the ones of the files in the working tree. Nothing else is changed.
+
+    Parameters
+    ----------
+    conf: Dict
+
+    git: GitBackend, optional (default None)
+        The git backend to use. Defaults to the one set in the configuration.
+    prefetched: Dict, optional (default None)
+        The results of ``prefetch``. The branch is not fetched again if it was
+        fetched there.
+
+    Returns
+    -------
+    bool
+        Whether the files to commit are identical to the remote branch.
+    """
+    git = git or _get_git_backend(conf)
+    if prefetched and "fetch_updater_branch" in prefetched:
+        rev = prefetched["fetch_updater_branch"]
+    else:
+        try:
+            git.fetch(_git_repo_url(conf), conf["hub"]["updater_branch"])
+            rev = "FETCH_HEAD"
+        except RuntimeError:
+            rev = None
+    if rev is None:
+        LOG.info(f"Remote branch {conf['hub']['updater_branch']} not found.")
+        return False
+    return git.blob_ids(rev, DEPENDENCY_FILES) == worktree_blob_ids(DEPENDENCY_FILES)
+
+
+def _branch_steps(conf: Dict, git: GitBackend) -> List[Step]:
+    """Get the steps that prepare the updater branch."""
+
+    def delete_remote_branch(results: Dict):
+        if "remote_head" in results and results["remote_head"] is None:
+            LOG.info(
+                f"Remote branch {conf['hub']['updater_branch']} not found. "
+                "Continuing on."
+            )
+            return
+        try:  # delete any remote updater_branch
+            git.delete_remote_branch(_git_repo_url(conf), conf["hub"]["updater_branch"])
+        except RuntimeError:
+            LOG.info(
+                f"Remote branch {conf['hub']['updater_branch']} not found. "
+                "Continuing on."
+            )
+
+    def prepare_branch(results: Dict):
+        if conf["hub"].get("commit_mode", "checkout") == "plumbing":
+            return  # the branch is written directly by the commit step
+        if conf["hub"].get("commit_mode", "checkout") == "worktree":
+            git.prepare_worktree(
+                str(_worktree_path(conf, git)),
+                conf["hub"]["updater_branch"],
+                conf["hub"]["pr_to_branch"],
+                DEPENDENCY_FILES,
+            )
+            return
+
+        try:  # delete any local updater_branch
+            git.delete_branch(conf["hub"]["updater_branch"])
+        except RuntimeError:
+            LOG.info(
+                f"Local branch {conf['hub']['updater_branch']} not found. "
+                "Continuing on."
+            )
+
+        git.clean()
+
+        try:
+            git.checkout_branch(
+                conf["hub"]["updater_branch"], conf["hub"]["pr_to_branch"]
+            )
+        except RuntimeError:
+            git.checkout_branch(conf["hub"]["updater_branch"])
+
+    steps = []
+    if conf["hub"].get("update_strategy", "recreate") == "recreate":
+        steps.append(Step("delete_remote_branch", delete_remote_branch))
+    steps.append(Step("prepare_branch", prepare_branch))
+    return steps
+
+
+def _commit(conf: Dict, git: GitBackend, paths: List[str]) -> GitBackend:
+    """Commit the dependency files, as set by ``commit_mode``.
+
+    Returns
+    -------
+    GitBackend
+        The backend of the working tree holding the commit.
+    """
+    if conf["hub"].get("commit_mode", "checkout") == "plumbing":
+        try:
+            parent = git.rev_parse(conf["hub"]["pr_to_branch"])
+        except RuntimeError:
+            parent = git.rev_parse("HEAD")
+        git.commit_files(conf["hub"]["updater_branch"], parent, paths, COMMIT_MESSAGE)
+        LOG.info(f"Committing {' and '.join(paths)} without a checkout.")
+        return git
+    if conf["hub"].get("commit_mode", "checkout") == "worktree":
+        path = _worktree_path(conf, git)
+        # the worktree is checked out from the top, not from the working directory
+        roots = [git.show_prefix() + dep_file for dep_file in paths]
+        for dep_file, root in zip(paths, roots):
+            if Path(dep_file).is_file():
+                shutil.copyfile(dep_file, path / root)
+            else:
+                (path / root).unlink(missing_ok=True)
+        worktree = git.worktree(str(path))
+        worktree.add(*roots)
+        worktree.commit(COMMIT_MESSAGE)
+        LOG.info(f"Committing {' and '.join(paths)} in the worktree {path}.")
+        return worktree
+
+    git.add(*paths)
+    LOG.info(f"Adding {' and '.join(paths)}")
+
+    git.commit(COMMIT_MESSAGE)
+    LOG.info("Committing changes.")
+    return git
+
+
+def _push_steps(
+    conf: Dict,
+    git: GitBackend,
+    client: GitHubClientType,
+    paths: List[str],
+    title: Optional[str] = None,
+) -> List[Step]:
+    """Get the steps that commit, push and open the PR.
+
+    The commit only waits for the local branch. The push waits for the commit and
+    the remote branch deletion. With the ``update`` strategy, looking up the
+    remote head and the existing PR does not wait for anything. The steps of the
+    PR are those of ``_pull_request_steps`` or ``_graphql_pull_request_steps``.
+    """
+    update = conf["hub"].get("update_strategy", "recreate") == "update"
+    if title is None:
+        title = (
+            f"[EDGETEST] Updating {conf['hub']['git_repo_name']} dependency versions"
         )
-    except RuntimeError:
-        LOG.info(
-            f"Local branch {conf['hub']['updater_branch']} not found. Continuing on."
+
+    def commit(results: Dict) -> GitBackend:
+        return _commit(conf, git, paths)
+
+    def remote_head(results: Dict) -> Optional[str]:
+        return git.remote_head(_git_repo_url(conf), conf["hub"]["updater_branch"])
+
+    def push(results: Dict):
+        options: Dict[str, Any] = {}
+        if update:
+            options["lease"] = results["remote_head"] or ""
+        if results["commit"] is not git:
+            # the worktree may be on a detached HEAD, see GitBackend.prepare_worktree
+            options["source"] = "HEAD"
+        results["commit"].push(
+            _git_repo_url(conf), conf["hub"]["updater_branch"], **options
         )
+        LOG.info("Pushing changes to remote.")
 
-    out, _ = _run_command(GIT_COMMAND, "clean", "-fd")
+    steps = [Step("commit", commit, ("prepare_branch",))]
+    if update:
+        steps.append(Step("remote_head", remote_head))
+        steps.append(Step("push", push, ("commit", "remote_head")))
+    else:
+        steps.append(Step("push", push, ("commit", "delete_remote_branch")))
+    if isinstance(client, GraphQLClient):
+        return steps + _graphql_pull_request_steps(conf, client, title)
+    return steps + _pull_request_steps(conf, client, title)
 
-    try:
-        out, _ = _run_command(
-            GIT_COMMAND,
-            "checkout",
-            "-b",
+
+def _pull_request_steps(
+    conf: Dict, client: Union[HubClient, GitHubClient], title: str
+) -> List[Step]:
+    """Get the steps that find or open the PR with ``hub`` or the REST API.
+
+    ``hub`` requests the reviewers with the PR, the REST API once it is open.
+    """
+    repo = f"{conf['hub']['git_repo_org']}/{conf['hub']['git_repo_name']}"
+    rest = isinstance(client, GitHubClient)
+
+    def find_pull_request(results: Dict) -> Optional[str]:
+        return client.find_pull_request(
+            repo, conf["hub"]["updater_branch"], conf["hub"]["pr_to_branch"]
+        )
+
+    def pull_request(results: Dict) -> Optional[str]:
+        if results.get("find_pull_request"):
+            LOG.info(f"Updated existing PR {results['find_pull_request']}.")
+            return None
+        url = client.create_pull_request(
+            repo,
             conf["hub"]["updater_branch"],
             conf["hub"]["pr_to_branch"],
+            title,
+            "" if rest else conf["hub"]["pr_reviewers"],
+            checked_out=conf["hub"].get("commit_mode", "checkout") == "checkout",
+            **_pull_request_options(conf),
         )
-    except RuntimeError:
-        out, _ = _run_command(
-            GIT_COMMAND,
-            "checkout",
-            "-b",
+        LOG.info("Submitting PR.")
+        return url
+
+    def request_reviewers(results: Dict):
+        if results["pull_request"] and isinstance(client, GitHubClient):
+            client.request_reviewers(
+                repo, results["pull_request"], conf["hub"]["pr_reviewers"]
+            )
+
+    steps = []
+    if conf["hub"].get("update_strategy", "recreate") == "update":
+        steps.append(Step("find_pull_request", find_pull_request))
+        steps.append(Step("pull_request", pull_request, ("push", "find_pull_request")))
+    else:
+        steps.append(Step("pull_request", pull_request, ("push",)))
+    if rest:
+        steps.append(Step("request_reviewers", request_reviewers, ("pull_request",)))
+    return steps
+
+
+def _graphql_pull_request_steps(
+    conf: Dict, client: GraphQLClient, title: str
+) -> List[Step]:
+    """Get the steps that find or open the PR with the GraphQL API.
+
+    The IDs needed to open the PR and the existing PR are looked up in one query,
+    while the branch is pushed. The reviewers are requested with the PR.
+    """
+    repo = f"{conf['hub']['git_repo_org']}/{conf['hub']['git_repo_name']}"
+
+    def find_pull_request(results: Dict) -> Optional[str]:
+        pull_request: Optional[str] = results["lookup"]["pull_request"]
+        return pull_request
+
+    def pull_request(results: Dict) -> Optional[str]:
+        if results.get("find_pull_request"):
+            LOG.info(f"Updated existing PR {results['find_pull_request']}.")
+            return None
+        url = client.create_pull_request(
+            repo,
             conf["hub"]["updater_branch"],
+            conf["hub"]["pr_to_branch"],
+            title,
+            conf["hub"]["pr_reviewers"],
+            checked_out=conf["hub"].get("commit_mode", "checkout") == "checkout",
+            lookup=results["lookup"],
+            **_pull_request_options(conf),
         )
+        LOG.info("Submitting PR.")
+        return url
+
+    steps = [_lookup_step(conf, client)]
+    if conf["hub"].get("update_strategy", "recreate") == "update":
+        steps.append(Step("find_pull_request", find_pull_request, ("lookup",)))
+        steps.append(Step("pull_request", pull_request, ("push", "find_pull_request")))
+    else:
+        steps.append(Step("pull_request", pull_request, ("push", "lookup")))
+    return steps
+
+
+@traced()
+def configure_branch(conf: Dict, git: Optional[GitBackend] = None):
+    """Configure the git and the branch before we submit a PR with hub.
+
+    Parameters
+    ----------
+    conf: Dict
+
+    git: GitBackend, optional (default None)
+        The git backend to use. Defaults to the one set in the configuration.
+
+    Returns
+    -------
+    None
+    """
+    run_steps(_branch_steps(conf, git or _get_git_backend(conf)))
 
 
-def push_branch(conf: Dict):
+@traced()
+def push_branch(
+    conf: Dict,
+    git: Optional[GitBackend] = None,
+    client: Optional[GitHubClientType] = None,
+    paths: Optional[List[str]] = None,
+):
     """Push the branch and submit a PR with hub.
 
     Parameters
     ----------
     conf: Dict
 
+    git: GitBackend, optional (default None)
+        The git backend to use. Defaults to the one set in the configuration.
+    client: HubClient or GitHubClient, optional (default None)
+        The client used to open the PR. Defaults to the one set in the configuration.
+    paths: List[str], optional (default None)
+        The changed dependency files to commit. Detected if not provided.
 
     Returns
     -------
     None
     """
-    try:
-        out, _ = _run_command(GIT_COMMAND, "diff-index", "--quiet", "HEAD")
+    git = git or _get_git_backend(conf)
+    if paths is None:
+        paths = git.changed_files(DEPENDENCY_FILES)
+    if not paths:
         LOG.info("No changes detected. No pull request opened.")
-    except RuntimeError:
-        out, _ = _run_command(
-            GIT_COMMAND,
-            "add",
-            "setup.cfg",
-            "requirements.txt",
-        )
-        LOG.info("Adding setup.cfg and requirements.txt")
-
-        os.environ["PRE_COMMIT_ALLOW_NO_CONFIG"] = "1"
-        out, _ = _run_command(
-            GIT_COMMAND,
-            "commit",
-            "-m",
-            "environmentally friendly",
+    else:
+        client = client or _get_github_client(conf)
+        run_steps(_push_steps(conf, git, client, paths))
+
+
+@traced()
+def prefetch(
+    conf: Dict,
+    git: Optional[GitBackend] = None,
+    client: Optional[GitHubClientType] = None,
+) -> Dict[str, Any]:
+    """Run the read-only network lookups of a submission ahead of time.
+
+    Nothing is written to the working tree, the index or the remote, so this can
+    run while the test environments are built. The results are passed to
+    ``submit_update`` as the results of the same steps.
+
+    - ``remote_head``: the commit of the remote ``updater_branch``.
+    - ``fetch_updater_branch``: the same commit, fetched, with ``skip_unchanged``.
+    - ``find_pull_request``: the open PR, with the ``update`` strategy and the
+      ``rest`` or ``graphql`` client.
+    - ``can_push``: whether the token can push, with the ``rest`` or ``graphql``
+      client.
+    - ``lookup``: the IDs needed to open the PR, with the ``graphql`` client. The
+      open PR and whether the token can push are taken from the same query.
+
+    Parameters
+    ----------
+    conf: Dict
+
+    git: GitBackend, optional (default None)
+        The git backend to use. Defaults to the one set in the configuration.
+    client: HubClient or GitHubClient, optional (default None)
+        The client used for the lookups. Defaults to the one set in the
+        configuration. ``hub`` needs its host set in the environment, which can't
+        be done while the tests run, so it is not used.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The results of the lookups, keyed by step name.
+    """
+    git = git or _get_git_backend(conf)
+    repo = f"{conf['hub']['git_repo_org']}/{conf['hub']['git_repo_name']}"
+
+    def remote_head(results: Dict) -> Optional[str]:
+        return git.remote_head(_git_repo_url(conf), conf["hub"]["updater_branch"])
+
+    def fetch_updater_branch(results: Dict) -> Optional[str]:
+        if results["remote_head"] is None:
+            return None
+        git.fetch(_git_repo_url(conf), conf["hub"]["updater_branch"])
+        return git.rev_parse("FETCH_HEAD")
+
+    steps = [Step("remote_head", remote_head)]
+    if conf["hub"].get("skip_unchanged"):
+        steps.append(
+            Step("fetch_updater_branch", fetch_updater_branch, ("remote_head",))
         )
-        LOG.info("Committing changes.")
+    if not isinstance(client, GitHubClient):
+        return run_steps(steps, max_workers=conf["hub"].get("concurrency", 1))
 
-        out, _ = _run_command(
-            GIT_COMMAND,
-            "push",
-            "origin",
-            conf["hub"]["updater_branch"],
+    def find_pull_request(results: Dict) -> Optional[str]:
+        if "lookup" in results:
+            pull_request: Optional[str] = results["lookup"]["pull_request"]
+            return pull_request
+        return client.find_pull_request(
+            repo, conf["hub"]["updater_branch"], conf["hub"]["pr_to_branch"]
         )
-        LOG.info("Pushing changes to remote.")
 
-        out, _ = _run_command(
-            HUB_COMMAND,
-            "pull-request",
-            "-b",
-            conf["hub"]["pr_to_branch"],
-            "-m",
-            f"[EDGETEST] Updating {conf['hub']['git_repo_name']} dependency versions",
-            "-r",
-            conf["hub"]["pr_reviewers"],
-            "--push",
+    def can_push(results: Dict) -> bool:
+        if "lookup" in results:
+            allowed = bool(results["lookup"]["can_push"])
+        else:
+            allowed = client.can_push(repo)
+        if not allowed:
+            LOG.error(f"The token in {GIT_TOKEN_ENVNAME} can't push to {repo}.")
+        return allowed
+
+    looked_up: Tuple[str, ...] = ()
+    if isinstance(client, GraphQLClient):
+        steps.append(_lookup_step(conf, client))
+        looked_up = ("lookup",)
+    steps.append(Step("can_push", can_push, looked_up))
+    if conf["hub"].get("update_strategy", "recreate") == "update":
+        steps.append(Step("find_pull_request", find_pull_request, looked_up))
+    return run_steps(steps, max_workers=conf["hub"].get("concurrency", 1))
+
+
+def _start_prefetch(conf: Dict):
+    """Run ``prefetch`` in a background thread."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    tracer = _tracer(conf)
+
+    def run() -> Dict[str, Any]:
+        client = _get_github_client(conf)
+        try:
+            with tracing(tracer), command_timeouts(
+                conf["hub"].get("command_timeout") or None
+            ):
+                return prefetch(conf, client=client)
+        finally:
+            client.close()
+
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="edgetest-hub")
+    _PREFETCH[id(conf)] = pool.submit(contextvars.copy_context().run, run)
+    pool.shutdown(wait=False)
+    LOG.info("Looking up the remote branch and PR while the tests run.")
+
+
+def _collect_prefetch(conf: Dict) -> Dict[str, Any]:
+    """Wait for the results of ``_start_prefetch``, if it was started."""
+    from concurrent.futures import TimeoutError as FutureTimeoutError
+
+    future = _PREFETCH.pop(id(conf), None)
+    if future is None:
+        return {}
+    try:
+        results: Dict[str, Any] = future.result(timeout=remaining_time("prefetch"))
+    except FutureTimeoutError:  # the lookups are run again, within the deadline
+        LOG.info("The lookups ahead of time are still running. Running them again.")
+        return {}
+    except Exception as err:  # the lookups are run again
+        LOG.info(f"Unable to look up the remote ahead of time: {redact(str(err))}")
+        return {}
+    return results
+
+
+def _report(testers: List, conf: Dict, fingerprint: str) -> Report:
+    """Build the failure report of the run, within ``report_bytes``."""
+    return build_report(
+        testers,
+        conf["hub"].get("report_bytes", REPORT_BYTES),
+        conf["hub"].get("report_logs", ""),
+        conf["hub"].get("report_dir") or REPORT_DIR,
+        fingerprint,
+    )
+
+
+def _comment_artifact(
+    client: GitHubClientType, repo: str, url: str, artifact: str, size: int
+):
+    """Post the full report to an issue, in comments of at most ``size`` bytes."""
+    chunks = artifact_chunks(artifact, size - 64)
+    for number, chunk in enumerate(chunks, start=1):
+        if number > MAX_COMMENTS:
+            LOG.info(f"The rest of the full report is in {artifact}.")
+            break
+        client.comment_issue(
+            repo, url, f"Full report, part {number}:\n\n````\n{chunk}\n````"
         )
-        LOG.info("Submitting PR.")
 
 
-def create_issue(message: str):
+def failure_fingerprint(testers: List) -> str:
+    """Fingerprint the failure of a run.
+
+    The fingerprint covers the failing environments, whether their setup worked,
+    and the versions of the packages upgraded in each of them. It does not change
+    from one run to the next while the same upgrade keeps failing.
+
+    Parameters
+    ----------
+    testers: List
+        The testers of the run.
+
+    Returns
+    -------
+    str
+        The fingerprint.
+    """
+    import hashlib
+
+    signature = []
+    for tester in testers:
+        if tester.status:
+            continue
+        try:
+            packages = [
+                f"{pkg['name']}=={pkg['version']}" for pkg in tester.upgraded_packages()
+            ]
+        except (RuntimeError, OSError, ValueError):  # the environment is missing
+            packages = list(getattr(tester, "upgrade", None) or [])
+        setup = getattr(tester, "setup_status", None)  # not in older edgetest releases
+        signature.append(f"{tester.envname}|{setup}|{','.join(sorted(packages))}")
+    digest = hashlib.sha256("\n".join(sorted(signature)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+@traced()
+def create_issue(
+    message: str,
+    conf: Optional[Dict] = None,
+    client: Optional[GitHubClientType] = None,
+    fingerprint: Optional[str] = None,
+    state: Optional[StateStore] = None,
+    artifact: Optional[str] = None,
+) -> Optional[str]:
     """Create an issue with Hub.
 
+    With a ``fingerprint``, an open issue carrying the same one is looked for
+    first. If there is one, it is commented on or left alone, depending on the
+    ``issue_dedupe`` option, and no new issue is opened. An issue recorded in the
+    ``state`` store for the fingerprint is used without searching for it, once it
+    is checked to still be open.
+
+    With an ``artifact``, the issue points to it, or with ``report_artifact =
+    comments``, the full report is posted to the new issue as comments.
+
     Parameters
     ----------
     message: str
 
+    conf: Dict, optional (default None)
+        The configuration. Required by clients other than ``hub``.
+    client: HubClient or GitHubClient, optional (default None)
+        The client used to open the issue. Defaults to ``hub``.
+    fingerprint: str, optional (default None)
+        The fingerprint of the failure, from ``failure_fingerprint``.
+    state: StateStore, optional (default None)
+        Where the run is recorded.
+    artifact: str, optional (default None)
+        The full report, from ``build_report``, if the message leaves some out.
 
     Returns
     -------
-    None
+    str or None
+        The URL of the issue opened, commented on or found. None if the issue
+        could not be opened.
+    """
+    if client is None:
+        client = _get_github_client(conf) if conf else HubClient(_run_command)
+    repo = (
+        f"{conf['hub']['git_repo_org']}/{conf['hub']['git_repo_name']}" if conf else ""
+    )
+    dedupe = conf["hub"].get("issue_dedupe", "skip") if conf else "off"
+    marker = FINGERPRINT_MARKER.format(fingerprint) if fingerprint else None
+    comments = bool(
+        artifact and conf and conf["hub"].get("report_artifact") == "comments"
+    )
+    if comments:
+        message += "\n\nThe full report and logs follow in the comments."
+    elif artifact:
+        message += (
+            f"\n\nThe full report and logs are in `{artifact}`, on the machine that "
+            "ran edgetest."
+        )
+    started, outcome, url = time.time(), "failed", None
+    try:
+        existing = None
+        if marker and dedupe != "off":
+            if state and conf and fingerprint:
+                existing = state.issue_for(_repo_key(conf), fingerprint)
+            if existing and not _is_open(client, repo, existing):
+                LOG.info(f"The issue {existing} in the state store is closed.")
+                existing = None
+            if existing:
+                LOG.info(f"Found the issue {existing} in the state store.")
+            else:
+                existing = client.find_issue(repo, marker)
+        if existing and dedupe == "comment":
+            client.comment_issue(
+                repo,
+                existing,
+                "Edgetest ran again and failed with the same environments and "
+                "package versions.",
+            )
+            LOG.info(f"Commented on the existing issue {existing}.")
+            outcome, url = "issue commented", existing
+        elif existing:
+            LOG.info(f"The failure is already tracked in {existing}. Skipping.")
+            outcome, url = "issue exists", existing
+        else:
+            url = client.create_issue(
+                repo,
+                "[EDGETEST] Issue updating dependencies",
+                "Edgetest ran, but there were some issues with the tests passing. Edgetest created an issue to let you know.",  # noqa: E501
+                message,
+                *((marker,) if marker else ()),
+            )
+            url = url.strip() if url else None
+            LOG.info("Creating issue.")
+            outcome = "issue"
+            if comments and url and conf and artifact:
+                try:
+                    _comment_artifact(
+                        client,
+                        repo,
+                        url,
+                        artifact,
+                        conf["hub"].get("report_bytes", REPORT_BYTES),
+                    )
+                except RuntimeError as err:
+                    LOG.info(f"Unable to post the full report. It is in {artifact}.")
+                    LOG.debug(str(err))
+    except RuntimeError as err:
+        LOG.info(f"There was a problem creating an Issue. {err}")
+        outcome, url = "failed", None
+    except CommandTimeoutError:
+        outcome = "timed out"
+        raise
+    finally:
+        annotate(outcome=outcome)
+        if state and conf:
+            state.record(
+                Run(
+                    _repo_key(conf),
+                    conf["hub"]["updater_branch"],
+                    started,
+                    time.time() - started,
+                    outcome,
+                    issue_url=url,
+                    fingerprint=fingerprint,
+                )
+            )
+    return url
+
+
+@traced()
+def submit_update(
+    conf: Dict,
+    client: Optional[GitHubClientType] = None,
+    state: Optional[StateStore] = None,
+    prefetched: Optional[Dict[str, Any]] = None,
+) -> Optional[str]:
+    """Commit the updated dependency files and submit them in a PR.
+
+    The working tree is checked for changes to the dependency files first, so
+    nothing is configured, fetched or deleted when there is nothing to submit.
+    If the ``state`` store shows the same files were already submitted on top of
+    the same ``pr_to_branch`` commit, in a PR that is still open, nothing is sent
+    either.
+
+    With ``lease = True``, the rest is done while holding the lease of the updater
+    branch, and skipped if another run holds it for longer than ``lease_wait``.
+
+    Parameters
+    ----------
+    conf: Dict
+
+    client: HubClient or GitHubClient, optional (default None)
+        The client used to open the PR. Defaults to the one set in the configuration.
+    state: StateStore, optional (default None)
+        Where the run is recorded.
+    prefetched: Dict, optional (default None)
+        The results of ``prefetch``. Those lookups are not run again.
+
+    Returns
+    -------
+    str or None
+        The URL of the PR opened or updated, if any.
+    """
+    return _submit(conf, client, state, prefetched)[1]
+
+
+def _submit(
+    conf: Dict,
+    client: Optional[GitHubClientType],
+    state: Optional[StateStore],
+    prefetched: Optional[Dict[str, Any]],
+) -> Tuple[str, Optional[str]]:
+    """Submit the updated dependency files, see ``submit_update``.
+
+    Returns
+    -------
+    str
+        The outcome of the run, as recorded in the ``state`` store.
+    str or None
+        The URL of the PR opened or updated, if any.
+    """
+    started, outcome, url, content = time.time(), "failed", None, None
+    try:
+        git = _get_git_backend(conf)
+        paths = git.changed_files(DEPENDENCY_FILES)
+        if not paths:
+            LOG.info("No changes detected. No pull request opened.")
+            outcome = "no changes"
+            return outcome, None
+
+        with _leased(conf, git) as waited:
+            if waited:  # the other run may have changed the remote meanwhile
+                prefetched = None
+            if state:
+                content = _content_key(conf, git)
+                last = state.last_submission(
+                    _repo_key(conf), conf["hub"]["updater_branch"]
+                )
+                repo = f"{conf['hub']['git_repo_org']}/{conf['hub']['git_repo_name']}"
+                client = client or _get_github_client(conf)
+                if (
+                    last
+                    and last.pr_url
+                    and last.content == content
+                    and _is_open(client, repo, last.pr_url)
+                ):
+                    LOG.info(
+                        f"These changes were already submitted in {last.pr_url}. "
+                        "No pull request opened."
+                    )
+                    outcome, url = "cached", last.pr_url
+                    return outcome, url
+
+            if conf["hub"].get("skip_unchanged") and is_unchanged(
+                conf, git, prefetched
+            ):
+                LOG.info(
+                    f"Remote branch {conf['hub']['updater_branch']} is up to date. "
+                    "No pull request opened."
+                )
+                outcome = "up to date"
+                return outcome, None
+
+            client = client or _get_github_client(conf)
+            with _git_environment(conf):
+                results = run_steps(
+                    _branch_steps(conf, git) + _push_steps(conf, git, client, paths),
+                    max_workers=conf["hub"].get("concurrency", 1),
+                    done=prefetched,
+                )
+        url = results.get("find_pull_request") or results.get("pull_request")
+        url = url.strip() if url else None
+        outcome = "submitted"
+        return outcome, url
+    except LeaseHeldError as err:
+        LOG.info(f"{err} No pull request opened.")
+        outcome = "leased"
+        return outcome, None
+    except CommandTimeoutError:
+        outcome = "timed out"
+        raise
+    finally:
+        annotate(outcome=outcome)
+        if state:
+            state.record(
+                Run(
+                    _repo_key(conf),
+                    conf["hub"]["updater_branch"],
+                    started,
+                    time.time() - started,
+                    outcome,
+                    content,
+                    pr_url=url,
+                )
+            )
+
+
+@traced()
+def submit_split_updates(
+    conf: Dict,
+    groups: Dict[str, Dict[str, str]],
+    client: Optional[GitHubClientType] = None,
+) -> Dict[str, Optional[str]]:
+    """Submit the updated dependency files in one PR per group of packages.
+
+    The branch of each group, ``<updater_branch>-<group>``, starts from
+    ``pr_to_branch`` and only gets the requirements of its packages. The branches
+    are committed one after the other without a checkout, then pushed and
+    submitted ``split_concurrency`` at a time. A group that fails does not stop
+    the others. With ``lease = True``, the lease of ``updater_branch`` is held
+    for all the groups.
+
+    Parameters
+    ----------
+    conf: Dict
+
+    groups: Dict[str, Dict[str, str]]
+        The version of each package of each group, from ``split_groups``.
+    client: HubClient or GitHubClient, optional (default None)
+        The client used to open the PRs. Defaults to the one set in the
+        configuration.
+
+    Returns
+    -------
+    Dict[str, Optional[str]]
+        The URL of the PR opened or updated for each group with changes.
+
+    Raises
+    ------
+    RuntimeError
+        Error raised when the PR of any group could not be submitted, after the
+        others are.
     """
+    outcome = "failed"
+    urls: Dict[str, Optional[str]] = {}
+    failed: List[str] = []
     try:
-        out, _ = _run_command(
-            HUB_COMMAND,
+        git = _get_git_backend(conf)
+        paths = git.changed_files(DEPENDENCY_FILES)
+        if not paths:
+            LOG.info("No changes detected. No pull request opened.")
+            outcome = "no changes"
+            return urls
+
+        with _leased(conf, git):
+            try:
+                base = git.rev_parse(conf["hub"]["pr_to_branch"])
+            except RuntimeError:
+                base = git.rev_parse("HEAD")
+            found = {path: git.read_file(base, path) for path in paths}
+            originals = {path: text for path, text in found.items() if text is not None}
+            updated = {
+                path: Path(path).read_text(encoding="utf-8")
+                for path in originals
+                if Path(path).is_file()
+            }
+            client = client or _get_github_client(conf)
+
+            def submit(group: str, group_conf: Dict, files: List[str], title: str):
+                def run(results: Dict) -> Optional[str]:
+                    try:
+                        done = run_steps(
+                            _branch_steps(group_conf, git)
+                            + _push_steps(group_conf, git, client, files, title),
+                            max_workers=conf["hub"].get("concurrency", 1),
+                            done={"prepare_branch": None, "commit": git},
+                        )
+                    except RuntimeError as err:
+                        LOG.error(
+                            f"Unable to submit the PR of {group}: {redact(str(err))}"
+                        )
+                        failed.append(group)
+                        return None
+                    url = done.get("find_pull_request") or done.get("pull_request")
+                    return url.strip() if url else None
+
+                return Step(group, run)
+
+            steps = []
+            with _git_environment(conf):
+                for group, packages in groups.items():
+                    files = {
+                        path: apply_packages(originals[path], text, list(packages))
+                        for path, text in updated.items()
+                    }
+                    files = {
+                        path: text
+                        for path, text in files.items()
+                        if text != originals[path]
+                    }
+                    if not files:
+                        LOG.info(f"No changes detected for {group}.")
+                        continue
+                    group_conf = _group_conf(conf, group)
+                    git.commit_contents(
+                        group_conf["hub"]["updater_branch"], base, files, COMMIT_MESSAGE
+                    )
+                    title = (
+                        f"[EDGETEST] Updating {group} to {packages[group]}"
+                        if list(packages) == [group]
+                        else f"[EDGETEST] Updating the {group} dependency versions of "
+                        f"{conf['hub']['git_repo_name']}"
+                    )
+                    steps.append(submit(group, group_conf, list(files), title))
+                results = run_steps(
+                    steps, max_workers=conf["hub"].get("split_concurrency", 4)
+                )
+        urls = {step.name: results[step.name] for step in steps}
+        if failed:
+            raise RuntimeError(
+                f"Unable to submit the PRs of {', '.join(sorted(failed))}."
+            )
+        outcome = "submitted" if steps else "no changes"
+        return urls
+    except LeaseHeldError as err:
+        LOG.info(f"{err} No pull request opened.")
+        outcome = "leased"
+        return urls
+    except CommandTimeoutError:
+        outcome = "timed out"
+        raise
+    finally:
+        annotate(
+            outcome=outcome, pull_requests=len([url for url in urls.values() if url])
+        )
+
+
+@traced()
+def spool_submission(testers: List, conf: Dict) -> Optional[str]:
+    """Spool the submission of a run, for a detached worker to handle.
+
+    Only the checks that need the working tree are done here. The updated
+    dependency files are copied into the job, so the worker submits them even if
+    the working tree changes in the meantime. The token is never written to the
+    spool: the worker inherits it from the environment.
+
+    Parameters
+    ----------
+    testers : List
+        The testers of the run.
+    conf : Dict
+        The configuration dictionary for ``edgetest``.
+
+    Returns
+    -------
+    str or None
+        The ID of the job, if one was spooled.
+    """
+    spool = Spool(conf["hub"]["spool_dir"], retries=conf["hub"]["spool_retries"])
+    job_conf = {"hub": conf["hub"]}
+    if testers[-1].status is True:
+        paths = _get_git_backend(conf).changed_files(DEPENDENCY_FILES)
+        if not paths:
+            LOG.info("No changes detected. No pull request opened.")
+            return None
+        files = {
+            path: Path(path).read_text(encoding="utf-8")
+            for path in DEPENDENCY_FILES
+            if Path(path).is_file()
+        }
+        split = conf["hub"].get("split_prs", "off")
+        job_id = spool.enqueue(
+            "update",
+            job_conf,
+            os.getcwd(),
+            files=files,
+            groups=None if split == "off" else split_groups(testers, split),
+        )
+    elif conf["hub"]["open_issue_on_fail"] is True:
+        fingerprint = failure_fingerprint(testers)
+        report = _report(testers, conf, fingerprint)
+        job_id = spool.enqueue(
             "issue",
-            "create",
-            "--message",
-            "[EDGETEST] Issue updating dependencies",
-            "--message",
-            "Edgetest ran, but there were some issues with the tests passing. Edgetest created an issue to let you know.",  # noqa: E501
-            "--message",
-            message,
+            job_conf,
+            os.getcwd(),
+            report=report.summary,
+            artifact=report.artifact,
+            fingerprint=fingerprint,
         )
-        LOG.info("Creating issue.")
-    except RuntimeError:
-        LOG.info("There was a problem creating an Issue.")
+    else:
+        LOG.info("Skipping Creating an Issue.")
+        return None
+    spool.start_worker()
+    return job_id
+
+
+@contextmanager
+def _spooled_worktree(conf: Dict, files: Dict[str, str]) -> Iterator[None]:
+    """Check out the spooled dependency files in a private worktree.
+
+    A sparse worktree of ``HEAD`` with only the dependency files is created in a
+    temporary directory, the spooled files are written there and the working
+    directory is moved into it. The working tree, index and branch of the
+    repository are never touched. The worktree is removed on exit.
+    """
+    git = _get_git_backend(conf)
+    prefix = git.show_prefix()
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp(prefix="edgetest-hub-")
+    path = os.path.join(directory, "worktree")
+    git.add_worktree(path, "HEAD", DEPENDENCY_FILES)
+    try:
+        os.makedirs(os.path.join(path, prefix), exist_ok=True)
+        os.chdir(os.path.join(path, prefix))
+        for dep_file in DEPENDENCY_FILES:
+            if dep_file in files:
+                Path(dep_file).write_text(files[dep_file], encoding="utf-8")
+            else:
+                Path(dep_file).unlink(missing_ok=True)
+        yield
+    finally:
+        os.chdir(cwd)
+        try:
+            git.remove_worktree(path)
+        except RuntimeError:
+            LOG.info(f"Unable to remove the worktree {path}.")
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run_spooled_job(job: Dict):
+    """Run a job spooled by ``spool_submission``.
+
+    An update is committed without a checkout, from a private worktree holding
+    the spooled files, so the repository directory is only read. The configured
+    ``commit_mode`` is overridden with ``plumbing``: the other modes check out the
+    updater branch, which may be checked out in the repository meanwhile.
+
+    Parameters
+    ----------
+    job : Dict
+        The job.
+
+    Raises
+    ------
+    RuntimeError
+        Error raised when the job did not succeed, so it is retried.
+    """
+    conf = job["conf"]
+    cwd = os.getcwd()
+    os.chdir(job["repo_dir"])
+    client = _get_github_client(conf)
+    state = _open_state(conf)
+    try:
+        with _traced(conf, f"spooled {job['kind']}"), command_timeouts(
+            conf["hub"].get("command_timeout") or None,
+            conf["hub"].get("deadline") or None,
+        ):
+            if job["kind"] == "update":
+                mode = conf["hub"].get("commit_mode", "checkout")
+                if mode != "plumbing":
+                    LOG.info(
+                        "Committing the spooled update without a checkout instead "
+                        f"of commit_mode = {mode}."
+                    )
+                conf = {**conf, "hub": {**conf["hub"], "commit_mode": "plumbing"}}
+                with _spooled_worktree(conf, job["files"]):
+                    if job.get("groups") is not None:
+                        submit_split_updates(conf, job["groups"], client)
+                    else:
+                        submit_update(conf, client=client, state=state)
+            elif job["kind"] == "issue":
+                with _git_environment(conf):
+                    url = create_issue(
+                        job["report"],
+                        conf,
+                        client,
+                        job["fingerprint"],
+                        state,
+                        job.get("artifact"),
+                    )
+                if url is None:
+                    raise RuntimeError("Unable to create or update the issue.")
+            else:
+                raise RuntimeError(f"Unknown job kind {job['kind']}.")
+    finally:
+        client.close()
+        if state:
+            state.close()
+        os.chdir(cwd)
 
 
 @hookimpl
-def addoption(schema: Schema):
+def addoption(schema: "Schema"):
     """Add an email global configuration option.
 
     Parameters
@@ -182,7 +1462,7 @@ def addoption(schema: Schema):
     """
 
     def to_bool(x):
-        return x.lower() in ["true", "1"]
+        return str(x).lower() in ["true", "1"]
 
     schema.add_globaloption(
         "hub",
@@ -234,27 +1514,286 @@ def addoption(schema: Schema):
                     "coerce": to_bool,
                     "required": True,
                 },
+                "git_backend": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "allowed": list(BACKENDS),
+                    "default": "cli",
+                },
+                "github_client": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "allowed": CLIENTS,
+                    "default": "hub",
+                },
+                "api_url": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": "",
+                },
+                "pr_labels": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": "",
+                },
+                "pr_assignees": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": "",
+                },
+                "pr_draft": {
+                    "type": "boolean",
+                    "coerce": to_bool,
+                    "default": False,
+                },
+                "update_strategy": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "allowed": ["recreate", "update"],
+                    "default": "recreate",
+                },
+                "commit_mode": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "allowed": COMMIT_MODES,
+                    "default": "checkout",
+                },
+                "worktree_dir": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": "",
+                },
+                "skip_unchanged": {
+                    "type": "boolean",
+                    "coerce": to_bool,
+                    "default": False,
+                },
+                "concurrency": {
+                    "type": "integer",
+                    "coerce": int,
+                    "min": 1,
+                    "default": 1,
+                },
+                "issue_dedupe": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "allowed": ISSUE_DEDUPE,
+                    "default": "skip",
+                },
+                "report_bytes": {
+                    "type": "integer",
+                    "coerce": int,
+                    "min": 1024,
+                    "default": REPORT_BYTES,
+                },
+                "report_logs": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": "",
+                },
+                "report_dir": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": REPORT_DIR,
+                },
+                "report_artifact": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "allowed": REPORT_ARTIFACTS,
+                    "default": "file",
+                },
+                "state_path": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": "",
+                },
+                "state_retention_days": {
+                    "type": "number",
+                    "coerce": float,
+                    "min": 0,
+                    "default": 30,
+                },
+                "api_rate": {
+                    "type": "number",
+                    "coerce": float,
+                    "min": 0,
+                    "default": 0,
+                },
+                "api_retries": {
+                    "type": "integer",
+                    "coerce": int,
+                    "min": 0,
+                    "default": 5,
+                },
+                "command_timeout": {
+                    "type": "number",
+                    "coerce": float,
+                    "min": 0,
+                    "default": 600,
+                },
+                "deadline": {
+                    "type": "number",
+                    "coerce": float,
+                    "min": 0,
+                    "default": 0,
+                },
+                "trace_path": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": "",
+                },
+                "metrics_dir": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": "",
+                },
+                "cassette_path": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": "",
+                },
+                "cassette_mode": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "allowed": CASSETTE_MODES,
+                    "default": "record",
+                },
+                "split_prs": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "allowed": SPLIT_MODES,
+                    "default": "off",
+                },
+                "split_concurrency": {
+                    "type": "integer",
+                    "coerce": int,
+                    "min": 1,
+                    "default": 4,
+                },
+                "lease": {
+                    "type": "boolean",
+                    "coerce": to_bool,
+                    "default": False,
+                },
+                "lease_wait": {
+                    "type": "number",
+                    "coerce": float,
+                    "min": 0,
+                    "default": 0,
+                },
+                "lease_ttl": {
+                    "type": "number",
+                    "coerce": float,
+                    "min": 1,
+                    "default": 3600,
+                },
+                "lease_dir": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": LEASE_DIR,
+                },
+                "prefetch": {
+                    "type": "boolean",
+                    "coerce": to_bool,
+                    "default": False,
+                },
+                "submit_mode": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "allowed": SUBMIT_MODES,
+                    "default": "foreground",
+                },
+                "spool_dir": {
+                    "type": "string",
+                    "coerce": "strip",
+                    "default": SPOOL_DIR,
+                },
+                "spool_retries": {
+                    "type": "integer",
+                    "coerce": int,
+                    "min": 0,
+                    "default": 5,
+                },
             },
         },
     )
 
 
+def _submit_or_report(testers: List, conf: Dict):
+    """Submit the updates if the tests passed, or open an issue."""
+    client = _get_github_client(conf)
+    state = _open_state(conf)
+    try:
+        with command_timeouts(
+            conf["hub"].get("command_timeout") or None,
+            conf["hub"].get("deadline") or None,
+        ):
+            prefetched = _collect_prefetch(conf)
+            split = conf["hub"].get("split_prs", "off")
+            if testers[-1].status is True and split != "off":
+                submit_split_updates(conf, split_groups(testers, split), client)
+            elif testers[-1].status is True:
+                submit_update(conf, client=client, state=state, prefetched=prefetched)
+            elif conf["hub"]["open_issue_on_fail"] is True:
+                fingerprint = failure_fingerprint(testers)
+                report = _report(testers, conf, fingerprint)
+                with _git_environment(conf):
+                    create_issue(
+                        report.summary,
+                        conf,
+                        client,
+                        fingerprint,
+                        state,
+                        report.artifact,
+                    )
+            else:
+                LOG.info("Skipping Creating an Issue.")
+    except CommandTimeoutError as err:
+        LOG.error(f"{err}. Stopping the Hub plugin.")
+    finally:
+        client.close()
+        if state:
+            state.close()
+
+
+@hookimpl
+def pre_run_hook(conf: Dict):
+    """Start the read-only lookups of the submission in the background.
+
+    With ``prefetch = True``, the remote branch, the existing PR and the token are
+    looked up while the test environments are built, and ``post_run_hook`` only
+    commits, pushes and opens the PR.
+    """
+    if (
+        GIT_TOKEN_ENVNAME in os.environ
+        and conf.get("hub")
+        and conf["hub"].get("prefetch")
+        and conf["hub"].get("submit_mode", "foreground") == "foreground"
+        and conf["hub"].get("split_prs", "off") == "off"
+    ):
+        _start_prefetch(conf)
+
+
 @hookimpl
 def post_run_hook(testers: List, conf: Dict):
-    """Invoke hub after the testing is complete."""
+    """Invoke hub after the testing is complete.
+
+    Each command is limited to ``command_timeout`` seconds and all of them
+    together to ``deadline`` seconds. A command that runs past either is killed
+    and the plugin stops. With ``submit_mode = spool``, the submission is left to
+    a detached worker and the hook returns at once.
+    """
     if GIT_TOKEN_ENVNAME in os.environ:
-        if testers[-1].status is True:
-            if conf.get("hub"):
-                configure_branch(conf)
-                push_branch(conf)
-        else:  # testers[-1].status is False
-            if conf.get("hub"):
-                if conf["hub"]["open_issue_on_fail"] is True:
-                    report = gen_report(testers, output_type="github")
-                    create_issue(report)
+        if conf.get("hub"):
+            with _traced(conf, "post_run_hook"):
+                cassette = _cassette(conf)
+                if cassette:
+                    cassette.record_testers(testers)
+                if conf["hub"].get("submit_mode") == "spool":
+                    spool_submission(testers, conf)
                 else:
-                    LOG.info("Skipping Creating an Issue.")
-            else:
-                LOG.info("Hub plugin configuration not found. Skipping Hub plugin")
+                    _submit_or_report(testers, conf)
+        else:
+            LOG.info("Hub plugin configuration not found. Skipping Hub plugin")
     else:
         LOG.info("Environment variable GITHUB_TOKEN not found. Skipping Hub plugin.")
@@ -0,0 +1,251 @@
+"""Failure report of a run, bounded in size, with the full detail in an artifact.
+
+The results are streamed one environment at a time, and the logs are copied or
+tailed from disk, so the memory used does not grow with the number of
+environments nor the size of the logs. The summary fits in ``budget`` bytes, for
+the body of a GitHub issue. Whatever it leaves out, the rows that don't fit and
+the logs, is written to a gzip-compressed artifact.
+"""
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import IO, Iterator, List, NamedTuple, Optional, Union
+
+from edgetest.logger import get_logger
+
+LOG = get_logger(__name__)
+
+REPORT_HEADERS = [
+    "Environment",
+    "Setup successful",
+    "Passing tests",
+    "Upgraded packages",
+    "Lowered packages",
+    "Package version",
+]
+REPORT_BYTES = 60000
+REPORT_DIR = ".edgetest"
+# where the issue points to for the full report
+REPORT_ARTIFACTS = ["file", "comments"]
+ARTIFACT_NAME = "edgetest-hub-report-{}.md.gz"
+# comments of an issue holding the full report, at most
+MAX_COMMENTS = 10
+# bytes of the budget kept for the notes around the table and the logs
+NOTES_BYTES = 512
+# size of the blocks copied from the logs to the artifact
+BLOCK_BYTES = 64 * 1024
+
+
+class Report(NamedTuple):
+    """Failure report of a run.
+
+    Attributes
+    ----------
+    summary : str
+        The summary, at most ``budget`` bytes.
+    artifact : str or None
+        The path to the compressed artifact holding the full report and logs.
+        None if the summary holds everything.
+    omitted : int
+        The number of rows of the table left out of the summary.
+    """
+
+    summary: str
+    artifact: Optional[str]
+    omitted: int
+
+
+def report_rows(testers: List) -> Iterator[List]:
+    """Yield the rows of the report table, one environment at a time.
+
+    The rows are those of ``edgetest.report.gen_report``. Testers of edgetest
+    releases without ``setup_status`` or ``lowered_packages`` have no setup status
+    and no lowered packages.
+    """
+    for env in testers:
+        setup_status = getattr(env, "setup_status", None)
+        for pkg in env.upgraded_packages():
+            yield [
+                env.envname,
+                setup_status,
+                env.status,
+                pkg["name"],
+                "",
+                pkg["version"],
+            ]
+        for pkg in getattr(env, "lowered_packages", list)():
+            yield [
+                env.envname,
+                setup_status,
+                env.status,
+                "",
+                pkg["name"],
+                pkg["version"],
+            ]
+
+
+def _table_size(widths: List[int], rows: int) -> int:
+    """Size of a GitHub table, with a header, of ``rows`` rows."""
+    line = sum(widths) + 3 * len(widths) + 1
+    return (rows + 2) * (line + 1) - 1
+
+
+def _table(rows: List[List]) -> str:
+    """Render rows as a GitHub table."""
+    from tabulate import tabulate
+
+    return str(tabulate(rows, headers=REPORT_HEADERS, tablefmt="github"))
+
+
+def log_tail(path: Union[str, Path], size: int) -> str:
+    """Read the end of a file, from the first full line within ``size`` bytes."""
+    with open(path, "rb") as log:
+        log.seek(0, os.SEEK_END)
+        start = max(log.tell() - size, 0)
+        log.seek(start)
+        tail = log.read(size)
+    if start and b"\n" in tail:
+        tail = tail[tail.index(b"\n") + 1 :]
+    return tail.decode("utf-8", errors="replace")
+
+
+def _markdown_row(row: List) -> str:
+    """Render a row as an unpadded GitHub table line."""
+    return "| " + " | ".join(str(cell) for cell in row) + " |\n"
+
+
+def build_report(
+    testers: List,
+    budget: int = REPORT_BYTES,
+    logs: str = "",
+    artifact_dir: Union[str, Path] = REPORT_DIR,
+    name: str = "report",
+) -> Report:
+    """Build the failure report of a run.
+
+    Parameters
+    ----------
+    testers : List
+        The testers of the run.
+    budget : int, optional (default REPORT_BYTES)
+        The size of the summary, in UTF-8 bytes, at most.
+    logs : str, optional (default "")
+        The path to the log of each environment, with ``{env}`` in place of its
+        name. The logs of the failing environments that exist are tailed in the
+        summary and copied in full to the artifact.
+    artifact_dir : str or Path, optional (default REPORT_DIR)
+        Where the artifact is written. It is created if needed.
+    name : str, optional (default "report")
+        The name of the artifact, e.g. the failure fingerprint.
+
+    Returns
+    -------
+    Report
+        The report. The table of the summary is that of
+        ``edgetest.report.gen_report`` when it fits.
+    """
+    import gzip
+
+    logs_of = {}
+    if logs:
+        for tester in testers:
+            path = Path(logs.format(env=tester.envname))
+            if not tester.status and path.is_file():
+                logs_of[tester.envname] = path
+    room = budget - NOTES_BYTES
+    table_budget = room // 2 if logs_of else room
+
+    directory = Path(artifact_dir).expanduser().resolve()
+    directory.mkdir(parents=True, exist_ok=True)
+    artifact = directory / ARTIFACT_NAME.format(name)
+    partial = artifact.with_name(artifact.name + ".partial")
+    kept: List[List] = []
+    widths = [len(header) + 2 for header in REPORT_HEADERS]
+    omitted = 0
+    with gzip.open(partial, "wt", encoding="utf-8") as out:
+        out.write("# Edgetest report\n\n")
+        out.write(_markdown_row(REPORT_HEADERS))
+        out.write(_markdown_row(["---"] * len(REPORT_HEADERS)))
+        for row in report_rows(testers):
+            out.write(_markdown_row(row))
+            if omitted:
+                omitted += 1
+                continue
+            grown = [
+                max(width, len(str(cell).encode("utf-8")))
+                for width, cell in zip(widths, row)
+            ]
+            if _table_size(grown, len(kept) + 1) > table_budget:
+                omitted += 1
+                continue
+            kept.append(row)
+            widths = grown
+        for envname, path in logs_of.items():
+            out.write(f"\n## Log of {envname}\n\n```\n")
+            with open(path, encoding="utf-8", errors="replace") as log:
+                shutil.copyfileobj(log, out, BLOCK_BYTES)
+            out.write("\n```\n")
+
+    table = _table(kept)
+    while len(table.encode("utf-8")) > table_budget and kept:
+        kept.pop()
+        omitted += 1
+        table = _table(kept)
+    parts = [table]
+    if omitted:
+        parts.append(f"{omitted} more rows are in the full report.")
+    if logs_of:
+        share = (room - len(table.encode("utf-8"))) // len(logs_of)
+        for envname, path in logs_of.items():
+            header = f"<details><summary>End of the log of {envname}</summary>"
+            size = share - len(header.encode("utf-8")) - 32
+            if size <= 0:
+                break
+            tail = log_tail(path, size).rstrip("\n")
+            fence = "`" * max([3] + [len(run) + 1 for run in re.findall("`+", tail)])
+            parts.append(f"{header}\n\n{fence}\n{tail}\n{fence}\n\n</details>")
+    if not omitted and not logs_of:
+        partial.unlink()
+        return Report(table, None, 0)
+    os.replace(partial, artifact)
+    LOG.info(f"The full report is in {artifact}.")
+    summary = "\n\n".join(parts)
+    while len(summary.encode("utf-8")) > room and len(parts) > 1:
+        parts.pop()  # a log decoded to more bytes than it was read from
+        summary = "\n\n".join(parts)
+    return Report(summary, str(artifact), omitted)
+
+
+def artifact_chunks(path: Union[str, Path], size: int) -> Iterator[str]:
+    """Yield the text of an artifact in chunks of at most ``size`` UTF-8 bytes.
+
+    The chunks break at line ends where possible.
+    """
+    import gzip
+
+    with gzip.open(path, "rt", encoding="utf-8") as artifact:
+        yield from _chunks(artifact, size)
+
+
+def _chunks(text: IO[str], size: int) -> Iterator[str]:
+    """Split a text stream in chunks of at most ``size`` UTF-8 bytes."""
+    chunk: List[str] = []
+    used = 0
+    for line in iter(lambda: text.readline(BLOCK_BYTES), ""):
+        while line:
+            length = len(line.encode("utf-8"))
+            if used + length <= size:
+                chunk.append(line)
+                used += length
+                break
+            if chunk:
+                yield "".join(chunk)
+                chunk, used = [], 0
+                continue
+            # a single line longer than a chunk
+            head = line.encode("utf-8")[:size].decode("utf-8", errors="ignore")
+            yield head
+            line = line[len(head) :]
+    if chunk:
+        yield "".join(chunk)
@@ -0,0 +1,123 @@
+"""Run the steps of the plugin as a small dependency graph."""
+import contextvars
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from edgetest.logger import get_logger
+
+from edgetest_hub.tracing import span
+from edgetest_hub.utils import CURRENT_STEP
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+LOG = get_logger(__name__)
+
+
+class Step(NamedTuple):
+    """A unit of work.
+
+    Parameters
+    ----------
+    name : str
+        The name of the step. Other steps refer to it by this name.
+    func : Callable
+        The function to run. It is called with the results of the steps run so
+        far, keyed by name, and its return value is stored under ``name``.
+    requires : Tuple[str, ...], optional (default ())
+        The names of the steps that must finish before this one starts.
+    """
+
+    name: str
+    func: Callable[[Dict[str, Any]], Any]
+    requires: Tuple[str, ...] = ()
+
+
+def _call(step: Step, results: Dict[str, Any]) -> Any:
+    """Run a step in a span, with its name set in ``CURRENT_STEP``."""
+    CURRENT_STEP.set(step.name)
+    with span(step.name, "step"):
+        return step.func(results)
+
+
+def run_steps(
+    steps: List[Step], max_workers: int = 1, done: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Run steps once their requirements are met.
+
+    With ``max_workers`` of 1 the steps run in the order given, in the calling
+    thread. Otherwise independent steps run concurrently in a thread pool, so the
+    network calls overlap with the local work. Each step runs in a copy of the
+    caller's ``contextvars`` context, with ``CURRENT_STEP`` set to its name.
+
+    Requirements that are not part of ``steps`` are considered met, so part of a
+    graph can be run on its own. Steps with a result in ``done`` are not run again.
+
+    Parameters
+    ----------
+    steps : List[Step]
+        The steps, in the order they should run when there is no concurrency.
+    max_workers : int, optional (default 1)
+        The maximum number of steps to run at the same time.
+    done : Dict[str, Any], optional (default None)
+        The results of steps that already ran, e.g. in the background while the
+        tests ran, keyed by name.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The results of the steps, keyed by name.
+
+    Raises
+    ------
+    ValueError
+        Error raised when the step names are not unique, or a step requires one
+        listed after it.
+    Exception
+        The first error raised by a step. The steps that depend on it are not
+        run, and the ones already running are waited for.
+    """
+    names = [step.name for step in steps]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Step names are not unique: {names}")
+    for index, step in enumerate(steps):
+        later = set(step.requires) & set(names[index:])
+        if later:
+            raise ValueError(f"Step {step.name} requires later steps {sorted(later)}")
+
+    results: Dict[str, Any] = dict(done or {})
+    steps = [step for step in steps if step.name not in results]
+    if max_workers <= 1:
+        for step in steps:
+            LOG.debug(f"Running step {step.name}")
+            results[step.name] = contextvars.copy_context().run(_call, step, results)
+        return results
+
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    waiting = list(steps)
+    running: Dict["Future", Step] = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while waiting or running:
+            if error is None:
+                for step in list(waiting):
+                    if all(r in results or r not in names for r in step.requires):
+                        LOG.debug(f"Running step {step.name}")
+                        context = contextvars.copy_context()
+                        future = pool.submit(context.run, _call, step, results)
+                        running[future] = step
+                        waiting.remove(step)
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                try:
+                    results[step.name] = future.result()
+                except Exception as err:
+                    LOG.debug(f"Step {step.name} failed")
+                    error = error or err
+
+    if error is not None:
+        raise error
+    return results
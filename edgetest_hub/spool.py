@@ -0,0 +1,320 @@
+"""Spool directory for submissions handled outside of the edgetest process."""
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Union
+
+from edgetest.logger import get_logger
+
+from edgetest_hub.utils import redact
+
+LOG = get_logger(__name__)
+
+SPOOL_DIR = "~/.cache/edgetest-hub/spool"
+PENDING = "pending"
+RUNNING = "running"
+FAILED = "failed"
+STATES = (PENDING, RUNNING, FAILED)
+
+
+def _alive(pid: Optional[int]) -> bool:
+    """Check if a process is running."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # running, as another user
+        return True
+    return True
+
+
+class Spool:
+    """Queue of submission jobs kept as JSON files.
+
+    A job moves between the ``pending``, ``running`` and ``failed`` directories
+    with atomic renames, so it is never lost or run twice, even if a worker
+    crashes. Jobs are removed once they succeed.
+
+    Parameters
+    ----------
+    path : str or Path
+        The spool directory. It is created if needed.
+    retries : int, optional (default 5)
+        The number of times a failed job is retried before it is moved to
+        ``failed``.
+    backoff : float, optional (default 60)
+        The delay before the first retry, in seconds. It doubles with each retry.
+    """
+
+    def __init__(
+        self, path: Union[str, Path] = SPOOL_DIR, retries: int = 5, backoff: float = 60
+    ):
+        """Initialize the spool."""
+        self.path = Path(path).expanduser().resolve()
+        self.retries = retries
+        self.backoff = backoff
+        for state in STATES:
+            (self.path / state).mkdir(parents=True, exist_ok=True)
+
+    def _write(self, state: str, job: Dict):
+        """Write a job atomically."""
+        tmp = self.path / f".{job['id']}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps(job, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path / state / f"{job['id']}.json")
+
+    def enqueue(self, kind: str, conf: Dict, repo_dir: str, **data) -> str:
+        """Add a job.
+
+        Parameters
+        ----------
+        kind : str
+            The type of job, e.g. ``update`` or ``issue``.
+        conf : Dict
+            The edgetest configuration. It must not hold any secret.
+        repo_dir : str
+            The repository the job runs in.
+        **data
+            Anything else the job needs.
+
+        Returns
+        -------
+        str
+            The ID of the job.
+        """
+        import uuid
+
+        job_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "conf": conf,
+            "repo_dir": repo_dir,
+            "created": time.time(),
+            "attempts": 0,
+            "retry_at": 0,
+            "error": None,
+            **data,
+        }
+        self._write(PENDING, job)
+        LOG.info(f"Spooled {kind} job {job_id} in {self.path}.")
+        return job_id
+
+    def jobs(self) -> List[Dict]:
+        """List the jobs.
+
+        Returns
+        -------
+        List[Dict]
+            The jobs, oldest first, each with its ``state``.
+        """
+        jobs = []
+        for state in STATES:
+            for path in (self.path / state).glob("*.json"):
+                try:
+                    job: Dict = json.loads(path.read_text(encoding="utf-8"))
+                except (FileNotFoundError, ValueError):  # moved while listing
+                    continue
+                jobs.append(dict(job, state=state))
+        return sorted(jobs, key=lambda job: job["id"])
+
+    def claim(self) -> Optional[Dict]:
+        """Take the oldest pending job that is due.
+
+        Returns
+        -------
+        Dict or None
+            The job, now in ``running``, if there is one.
+        """
+        now = time.time()
+        for path in sorted((self.path / PENDING).glob("*.json")):
+            try:
+                job: Dict = json.loads(path.read_text(encoding="utf-8"))
+                if job.get("retry_at", 0) > now:
+                    continue
+                os.rename(path, self.path / RUNNING / path.name)
+            except (FileNotFoundError, ValueError):  # claimed by another worker
+                continue
+            job["worker_pid"] = os.getpid()
+            self._write(RUNNING, job)
+            return job
+        return None
+
+    def finish(self, job: Dict, error: Optional[str] = None):
+        """Remove a job that succeeded, or schedule a retry of one that failed.
+
+        Parameters
+        ----------
+        job : Dict
+            The job, as returned by ``claim``.
+        error : str, optional (default None)
+            The reason the job failed.
+        """
+        running = self.path / RUNNING / f"{job['id']}.json"
+        if error is None:
+            running.unlink(missing_ok=True)
+            LOG.info(f"Job {job['id']} done.")
+            return
+
+        job = dict(job, attempts=job["attempts"] + 1, error=error, worker_pid=None)
+        if job["attempts"] > self.retries:
+            self._write(FAILED, job)
+            LOG.info(f"Job {job['id']} failed {job['attempts']} times. Giving up.")
+        else:
+            delay = self.backoff * 2 ** (job["attempts"] - 1)
+            job["retry_at"] = time.time() + delay
+            self._write(PENDING, job)
+            LOG.info(f"Job {job['id']} failed. Retrying in {delay:.0f}s.")
+        running.unlink(missing_ok=True)
+
+    def recover(self) -> int:
+        """Put back the running jobs whose worker is gone.
+
+        Returns
+        -------
+        int
+            The number of jobs put back.
+        """
+        count = 0
+        for job in self.jobs():
+            if job["state"] == RUNNING and not _alive(job.get("worker_pid")):
+                job = {k: v for k, v in job.items() if k != "state"}
+                try:
+                    os.rename(
+                        self.path / RUNNING / f"{job['id']}.json",
+                        self.path / PENDING / f"{job['id']}.json",
+                    )
+                except FileNotFoundError:
+                    continue
+                LOG.info(f"Job {job['id']} was interrupted. Putting it back.")
+                count += 1
+        return count
+
+    def retry_failed(self) -> int:
+        """Move the failed jobs back to pending, with their attempts reset.
+
+        Returns
+        -------
+        int
+            The number of jobs moved.
+        """
+        count = 0
+        for job in self.jobs():
+            if job["state"] == FAILED:
+                job = {k: v for k, v in job.items() if k != "state"}
+                self._write(PENDING, dict(job, attempts=0, retry_at=0))
+                (self.path / FAILED / f"{job['id']}.json").unlink(missing_ok=True)
+                count += 1
+        return count
+
+    @contextmanager
+    def _drain_lock(self) -> Iterator[bool]:
+        """Hold the lock that allows a single worker to drain the spool."""
+        try:
+            import fcntl
+        except ImportError:  # not POSIX, rely on the atomic renames alone
+            yield True
+            return
+        with open(self.path / "drain.lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def drain(
+        self,
+        run: Callable[[Dict], None],
+        watch: bool = False,
+        interval: float = 30,
+    ) -> int:
+        """Run the pending jobs.
+
+        Only one worker drains the spool at a time. Any other returns at once.
+
+        Parameters
+        ----------
+        run : Callable
+            Runs a job. The job fails if it raises an exception.
+        watch : bool, optional (default False)
+            Keep waiting for new jobs, rather than returning when none is due.
+        interval : float, optional (default 30)
+            How often to look for new jobs when watching, in seconds.
+
+        Returns
+        -------
+        int
+            The number of jobs run.
+        """
+        count = 0
+        while True:
+            with self._drain_lock() as locked:
+                if not locked:
+                    LOG.info(f"Another worker is draining {self.path}.")
+                    return count
+                self.recover()
+                while True:
+                    job = self.claim()
+                    if job is None:
+                        if not watch:
+                            break
+                        time.sleep(interval)
+                        self.recover()
+                        continue
+                    count += 1
+                    try:
+                        run(job)
+                    except Exception as err:  # any failure is retried
+                        self.finish(job, redact(f"{type(err).__name__}: {err}"))
+                    else:
+                        self.finish(job)
+            # a job spooled just before the lock was released has no worker yet
+            if not self._due():
+                return count
+
+    def _due(self) -> bool:
+        """Check if a pending job is due."""
+        now = time.time()
+        return any(
+            job["state"] == PENDING and job.get("retry_at", 0) <= now
+            for job in self.jobs()
+        )
+
+    def start_worker(self) -> subprocess.Popen:
+        """Start a detached worker that drains the spool.
+
+        The worker outlives the current process, and logs to ``worker.log`` in the
+        spool directory.
+
+        Returns
+        -------
+        subprocess.Popen
+            The worker process.
+        """
+        with open(self.path / "worker.log", "a") as log:
+            return subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "edgetest_hub.cli",
+                    "drain",
+                    "--spool-dir",
+                    str(self.path),
+                    "--retries",
+                    str(self.retries),
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+                close_fds=True,
+            )
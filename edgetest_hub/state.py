@@ -0,0 +1,167 @@
+"""Local record of the plugin runs, kept in SQLite."""
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional, Union
+
+from edgetest.logger import get_logger
+
+LOG = get_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    repo TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    started REAL NOT NULL,
+    seconds REAL NOT NULL,
+    outcome TEXT NOT NULL,
+    content TEXT,
+    pr_url TEXT,
+    issue_url TEXT,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_repo_branch ON runs (repo, branch, started);
+"""
+
+
+class Run(NamedTuple):
+    """A recorded run.
+
+    Parameters
+    ----------
+    repo : str
+        The repository, as ``host/org/name``.
+    branch : str
+        The updater branch.
+    started : float
+        When the run started, in seconds since the epoch.
+    seconds : float
+        How long the run took.
+    outcome : str
+        What the run did, e.g. ``submitted`` or ``issue``.
+    content : str or None
+        The hash of the base commit and dependency files that were submitted.
+    pr_url : str or None
+        The URL of the PR opened or updated.
+    issue_url : str or None
+        The URL of the issue opened or commented on.
+    fingerprint : str or None
+        The fingerprint of the failure.
+    """
+
+    repo: str
+    branch: str
+    started: float
+    seconds: float
+    outcome: str
+    content: Optional[str] = None
+    pr_url: Optional[str] = None
+    issue_url: Optional[str] = None
+    fingerprint: Optional[str] = None
+
+
+class StateStore:
+    """Record the outcome of each run, to skip work a later run would repeat.
+
+    The database can be shared by many repositories and processes. Records older
+    than ``retention_days`` are removed when the store is opened.
+
+    Parameters
+    ----------
+    path : str or Path
+        The location of the SQLite database. Its directory is created if needed.
+    retention_days : float, optional (default 30)
+        How long records are kept.
+    """
+
+    def __init__(self, path: Union[str, Path], retention_days: float = 30):
+        """Open the store."""
+        import sqlite3
+
+        path = Path(path).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path), timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self.prune(retention_days)
+
+    def prune(self, retention_days: float):
+        """Remove the records older than ``retention_days``.
+
+        Parameters
+        ----------
+        retention_days : float
+            How long records are kept.
+        """
+        cursor = self._conn.execute(
+            "DELETE FROM runs WHERE started < ?",
+            (time.time() - retention_days * 86400,),
+        )
+        if cursor.rowcount:
+            LOG.debug(f"Removed {cursor.rowcount} old runs from the state store.")
+
+    def record(self, run: Run):
+        """Record a run.
+
+        Parameters
+        ----------
+        run : Run
+            The run.
+        """
+        self._conn.execute(
+            f"INSERT INTO runs ({', '.join(Run._fields)}) "
+            f"VALUES ({', '.join('?' * len(Run._fields))})",
+            tuple(run),
+        )
+
+    def _last(self, where: str, *params) -> Optional[Run]:
+        """Get the latest run matching a condition."""
+        row = self._conn.execute(
+            f"SELECT {', '.join(Run._fields)} FROM runs WHERE {where} "
+            "ORDER BY started DESC, id DESC LIMIT 1",
+            params,
+        ).fetchone()
+        return Run(*row) if row else None
+
+    def last_submission(self, repo: str, branch: str) -> Optional[Run]:
+        """Get the latest run that opened or updated a PR.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``host/org/name``.
+        branch : str
+            The updater branch.
+
+        Returns
+        -------
+        Run or None
+            The run, if any.
+        """
+        return self._last(
+            "repo = ? AND branch = ? AND pr_url IS NOT NULL", repo, branch
+        )
+
+    def issue_for(self, repo: str, fingerprint: str) -> Optional[str]:
+        """Get the issue opened for a failure.
+
+        Parameters
+        ----------
+        repo : str
+            The repository, as ``host/org/name``.
+        fingerprint : str
+            The fingerprint of the failure.
+
+        Returns
+        -------
+        str or None
+            The URL of the issue, if any.
+        """
+        run = self._last(
+            "repo = ? AND fingerprint = ? AND issue_url IS NOT NULL", repo, fingerprint
+        )
+        return run.issue_url if run else None
+
+    def close(self):
+        """Close the database."""
+        self._conn.close()
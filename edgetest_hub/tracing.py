@@ -0,0 +1,197 @@
+"""Timed spans of the plugin steps, exported as a Chrome trace."""
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar, Union
+
+_TRACER: ContextVar[Optional["Tracer"]] = ContextVar("tracer", default=None)
+# the ID and attributes of the current span
+_SPAN: ContextVar[Optional[Tuple[int, Dict[str, Any]]]] = ContextVar(
+    "span", default=None
+)
+_IDS = itertools.count(1)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class Tracer:
+    """Collect the spans of a run.
+
+    Spans can be added from any thread. Each one records its parent, so the
+    steps run concurrently by the scheduler still nest under their phase.
+    """
+
+    def __init__(self):
+        """Initialize the tracer."""
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Dict[str, Any]):
+        """Add a finished span.
+
+        Parameters
+        ----------
+        span : Dict
+            The span, with its ``name``, ``category``, ``start`` and ``duration``
+            in seconds, ``thread``, ``id``, ``parent`` and ``attributes``.
+        """
+        with self._lock:
+            self.spans.append(span)
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """Format the spans as a Chrome trace.
+
+        Returns
+        -------
+        Dict
+            The trace, with one complete (``X``) event per span, in the Trace Event
+            Format read by ``chrome://tracing`` and Perfetto.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+        return {
+            "displayTimeUnit": "ms",
+            "traceEvents": [
+                {
+                    "name": span["name"],
+                    "cat": span["category"],
+                    "ph": "X",
+                    "ts": round(span["start"] * 1e6),
+                    "dur": round(span["duration"] * 1e6),
+                    "pid": os.getpid(),
+                    "tid": span["thread"],
+                    "args": {
+                        **span["attributes"],
+                        "span_id": span["id"],
+                        "parent_id": span["parent"],
+                    },
+                }
+                for span in spans
+            ],
+        }
+
+    def export(self, path: Union[str, Path]) -> Path:
+        """Write the spans to a Chrome trace file.
+
+        Parameters
+        ----------
+        path : str or Path
+            The file. Its directory is created if needed.
+
+        Returns
+        -------
+        Path
+            The file written.
+        """
+        path = Path(path).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_chrome(), default=str), encoding="utf-8")
+        return path
+
+
+@contextmanager
+def tracing(tracer: Optional[Tracer]) -> Iterator[Optional[Tracer]]:
+    """Record the spans started in this context with a tracer.
+
+    Parameters
+    ----------
+    tracer : Tracer or None
+        The tracer. Nothing is recorded if ``None``.
+    """
+    token = _TRACER.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _TRACER.reset(token)
+
+
+@contextmanager
+def span(name: str, category: str = "step", **attributes) -> Iterator[Dict[str, Any]]:
+    """Time a block of work.
+
+    Nothing is recorded outside of ``tracing``, so instrumented code costs nearly
+    nothing when tracing is off.
+
+    Parameters
+    ----------
+    name : str
+        The name of the span, e.g. the step or the command.
+    category : str, optional (default "step")
+        The kind of span, e.g. ``phase``, ``step``, ``command`` or ``api``.
+    **attributes
+        Details of the span. Never pass a secret.
+
+    Yields
+    ------
+    Dict
+        The attributes, which can be added to until the block ends. The type of
+        any error raised in the block is added as ``error``.
+    """
+    tracer = _TRACER.get()
+    if tracer is None:
+        yield attributes
+        return
+
+    span_id = next(_IDS)
+    parent = _SPAN.get()
+    token = _SPAN.set((span_id, attributes))
+    start = time.time()
+    counter = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as err:
+        attributes["error"] = type(err).__name__
+        raise
+    finally:
+        _SPAN.reset(token)
+        tracer.add(
+            {
+                "name": name,
+                "category": category,
+                "start": start,
+                "duration": time.perf_counter() - counter,
+                "thread": threading.get_ident(),
+                "id": span_id,
+                "parent": parent[0] if parent else None,
+                "attributes": attributes,
+            }
+        )
+
+
+def annotate(**attributes):
+    """Add details to the current span, if there is one.
+
+    Parameters
+    ----------
+    **attributes
+        The details. Never pass a secret.
+    """
+    current = _SPAN.get()
+    if current is not None:
+        current[1].update(attributes)
+
+
+def traced(category: str = "phase") -> Callable[[F], F]:
+    """Run each call of a function in a span named after it.
+
+    Parameters
+    ----------
+    category : str, optional (default "phase")
+        The kind of span.
+    """
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(func.__name__, category):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
@@ -0,0 +1,259 @@
+"""Utility functions."""
+import os
+import signal
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from subprocess import DEVNULL, PIPE, Popen, TimeoutExpired
+from typing import Dict, Iterable, Mapping, Optional, Sequence, Tuple
+
+from edgetest.logger import get_logger
+
+from edgetest_hub.tracing import span
+
+LOG = get_logger(__name__)
+
+# (timeout of each command in seconds, deadline as a ``time.monotonic`` value)
+_TIMEOUTS: ContextVar[Tuple[Optional[float], Optional[float]]] = ContextVar(
+    "timeouts", default=(None, None)
+)
+CURRENT_STEP: ContextVar[Optional[str]] = ContextVar("current_step", default=None)
+# environment variables set with ``git_environment`` for the commands of a context
+_ENVIRON: ContextVar[Mapping[str, str]] = ContextVar("environ", default={})
+
+
+class CommandError(RuntimeError):
+    """Error raised when a command exits with a non-zero status.
+
+    Parameters
+    ----------
+    args : Sequence[str]
+        The arguments of the command.
+    stdout : str
+        The standard output of the command.
+    stderr : str
+        The standard error of the command.
+    returncode : int
+        The exit code of the command.
+    """
+
+    def __init__(self, args: Sequence[str], stdout: str, stderr: str, returncode: int):
+        """Initialize the error."""
+        self.command = list(args)
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = returncode
+        super().__init__(
+            f"Unable to run the following command: \n\n {' '.join(args)} \n\n"
+            f"Returned the following stdout: \n\n {stdout} \n\n"
+            f"Returned the following stderr: \n\n {stderr} \n\n"
+        )
+
+
+class CommandTimeoutError(TimeoutError):
+    """Error raised when a command runs past its timeout or the deadline.
+
+    It is not a ``RuntimeError``, so it is never mistaken for a failed command
+    that the plugin can continue after.
+
+    Parameters
+    ----------
+    command : str
+        The command, or the API request, that timed out.
+    timeout : float
+        The time the command was allowed, in seconds.
+    """
+
+    def __init__(self, command: str, timeout: float):
+        """Initialize the error."""
+        self.command = command
+        self.timeout = timeout
+        self.step = CURRENT_STEP.get()
+        super().__init__(
+            f"Step {self.step or 'unknown'} timed out after {timeout:.1f}s running "
+            f"{command}"
+        )
+
+
+@contextmanager
+def command_timeouts(timeout: Optional[float] = None, budget: Optional[float] = None):
+    """Limit the time of the commands run in this context.
+
+    Parameters
+    ----------
+    timeout : float, optional (default None)
+        The maximum time of each command, in seconds.
+    budget : float, optional (default None)
+        The maximum time of all the commands together, in seconds, counted from
+        now.
+    """
+    deadline = None if budget is None else time.monotonic() + budget
+    token = _TIMEOUTS.set((timeout, deadline))
+    try:
+        yield
+    finally:
+        _TIMEOUTS.reset(token)
+
+
+def remaining_time(command: str, default: Optional[float] = None) -> Optional[float]:
+    """Get the time a command is allowed.
+
+    Parameters
+    ----------
+    command : str
+        The command, used in the error message.
+    default : float, optional (default None)
+        The timeout to use if there is no smaller limit.
+
+    Returns
+    -------
+    float or None
+        The time allowed, in seconds, or None if there is no limit.
+
+    Raises
+    ------
+    CommandTimeoutError
+        Error raised when the deadline has already passed.
+    """
+    timeout, deadline = _TIMEOUTS.get()
+    limits = [limit for limit in (default, timeout) if limit]
+    if deadline is not None:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise CommandTimeoutError(command, 0)
+        limits.append(left)
+    return min(limits) if limits else None
+
+
+def _kill(popen: Popen):
+    """Kill a command started in its own session, and anything it started."""
+    try:
+        os.killpg(popen.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError):  # not POSIX, or already gone
+        popen.kill()
+    popen.communicate()
+
+
+def _run_command(*args, stdin: Optional[str] = None) -> Tuple[str, int]:
+    """Run a command using ``subprocess.Popen``.
+
+    Same as ``edgetest.utils._run_command``, but it can also feed ``stdin`` and
+    the command is killed if it runs past the limits set with
+    ``command_timeouts``. The command runs with the environment set with
+    ``git_environment``, and never reads from the terminal.
+
+    Parameters
+    ----------
+    *args
+        Arguments for the command.
+    stdin : str, optional (default None)
+        Text to send to the standard input of the command.
+
+    Returns
+    -------
+    str
+        The output
+    int
+        The exit code
+
+    Raises
+    ------
+    CommandError
+        Error raised when the command is not successfully executed.
+    CommandTimeoutError
+        Error raised when the command times out.
+    """
+    LOG.debug(f"Running the following command: \n\n {' '.join(args)}")
+    with span(
+        redact(" ".join(args[:2])), "command", argv=[redact(arg) for arg in args]
+    ) as attributes:
+        timeout = remaining_time(args[0] if args else "")
+        popen = Popen(
+            args,
+            stdin=DEVNULL if stdin is None else PIPE,
+            stdout=PIPE,
+            stderr=PIPE,
+            universal_newlines=True,
+            start_new_session=True,
+            env=command_environ() if _ENVIRON.get() else None,
+        )
+        try:
+            out, err = popen.communicate(stdin, timeout=timeout)
+        except TimeoutExpired:
+            _kill(popen)
+            raise CommandTimeoutError(" ".join(args[:2]), timeout or 0.0) from None
+        attributes.update(
+            exit_status=popen.returncode,
+            stdout_bytes=len(out.encode("utf-8")) if out else 0,
+            stderr_bytes=len(err.encode("utf-8")) if err else 0,
+        )
+        if popen.returncode:
+            raise CommandError(args, out, err, popen.returncode) from None
+
+    return out, popen.returncode
+
+
+def redact(text: str, envname: str = "GITHUB_TOKEN") -> str:
+    """Hide the token in a text, e.g. an error message with an authenticated URL.
+
+    Parameters
+    ----------
+    text : str
+        The text.
+    envname : str, optional (default "GITHUB_TOKEN")
+        The environment variable holding the token.
+
+    Returns
+    -------
+    str
+        The text, with the token replaced by ``***``.
+    """
+    token = os.environ.get(envname)
+    return text.replace(token, "***") if token else text
+
+
+def command_environ() -> Dict[str, str]:
+    """Get the environment of the commands run in this context.
+
+    Returns
+    -------
+    Dict[str, str]
+        ``os.environ``, updated with the variables set with ``git_environment``.
+    """
+    return {**os.environ, **_ENVIRON.get()}
+
+
+@contextmanager
+def git_environment(config: Iterable[Tuple[str, str]], env: Dict[str, str]):
+    """Pass git configuration to child processes through the environment.
+
+    The configuration is set with ``GIT_CONFIG_COUNT``, ``GIT_CONFIG_KEY_<n>`` and
+    ``GIT_CONFIG_VALUE_<n>`` (git 2.31 or later), after any entries already in the
+    environment. Nothing is written to a git config file.
+
+    The variables are not set in ``os.environ``, which is shared by all the
+    threads, but in a context variable read by ``_run_command``. They apply to the
+    commands run in this context, including the steps started from it by
+    ``run_steps``, and are dropped on exit.
+
+    Parameters
+    ----------
+    config : Iterable[Tuple[str, str]]
+        The configuration keys and values. Keys can be repeated for multi-valued
+        options.
+    env : Dict[str, str]
+        Other environment variables to set.
+    """
+    count = int(command_environ().get("GIT_CONFIG_COUNT", "0"))
+    update = dict(env)
+    for index, (key, value) in enumerate(config, start=count):
+        update[f"GIT_CONFIG_KEY_{index}"] = key
+        update[f"GIT_CONFIG_VALUE_{index}"] = value
+        count = index + 1
+    update["GIT_CONFIG_COUNT"] = str(count)
+
+    token = _ENVIRON.set({**_ENVIRON.get(), **update})
+    try:
+        yield
+    finally:
+        _ENVIRON.reset(token)
@@ -0,0 +1,61 @@
+"""Fixtures and stand-ins shared by the tests."""
+import subprocess
+
+import pytest
+
+IDENTITY = {
+    "GIT_AUTHOR_NAME": "Jenkins",
+    "GIT_AUTHOR_EMAIL": "noreply@capitalone.com",
+    "GIT_COMMITTER_NAME": "Jenkins",
+    "GIT_COMMITTER_EMAIL": "noreply@capitalone.com",
+}
+
+
+def hub_conf(**overrides) -> dict:
+    """Build a configuration submitting the updates of ``test-org/test-repo``."""
+    return {
+        "hub": {
+            "git_url": "github.com",
+            "git_repo_org": "test-org",
+            "git_repo_name": "test-repo",
+            "git_username": "Jenkins",
+            "git_useremail": "noreply@capitalone.com",
+            "updater_branch": "dep-updates",
+            "pr_to_branch": "develop",
+            "pr_reviewers": "abc123",
+            **overrides,
+        }
+    }
+
+
+def run_git(*args, cwd=None) -> str:
+    """Run a git command, in ``cwd`` or the current directory, and get its output."""
+    return subprocess.run(
+        ("git",) + args, cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+@pytest.fixture
+def git_identity(monkeypatch):
+    """Commit as ``Jenkins``, through the environment."""
+    for key, value in IDENTITY.items():
+        monkeypatch.setenv(key, value)
+
+
+class FakeTester:
+    """A tester that already ran."""
+
+    def __init__(self, envname, status, packages):
+        """Initialize the tester."""
+        self.envname = envname
+        self.status = status
+        self.setup_status = True
+        self.packages = packages
+
+    def upgraded_packages(self):
+        """List the upgraded packages."""
+        return [{"name": name, "version": v} for name, v in self.packages.items()]
+
+    def lowered_packages(self):
+        """List the lowered packages."""
+        return []
@@ -0,0 +1,257 @@
+"""A local stand-in for the GitHub REST and GraphQL APIs."""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlsplit
+
+
+class FakeGitHub:
+    """Serve a small subset of the GitHub REST and GraphQL APIs from memory.
+
+    Use it as a context manager. The base URL for the API is ``url``. Every request
+    is recorded in ``requests`` and every accepted TCP connection is counted in
+    ``connections``. Responses are held back for ``delay`` seconds. Queued
+    ``(status, headers, response)`` tuples in ``errors`` are returned, in order,
+    before any request is handled.
+
+    The GraphQL operations of ``GraphQLClient`` are told apart by their name and
+    answered from their variables. Every user and team exists, except the logins
+    starting with ``ghost``, and only the labels in ``labels`` exist.
+    """
+
+    def __init__(self):
+        """Initialize the server."""
+        self.requests: List[Dict] = []
+        self.connections = 0
+        self.pulls: List[Dict] = []
+        self.issues: List[Dict] = []
+        self.labels: List[str] = ["dependencies"]
+        self.delay = 0.0
+        self.errors: List[tuple] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True
+        )
+
+    def __enter__(self):
+        """Start the server."""
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, method: str, path: str, payload) -> tuple:
+        """Route a request and return the status, headers and JSON response."""
+        with self._lock:
+            self.requests.append(
+                {
+                    "method": method,
+                    "path": path,
+                    "json": payload,
+                    "time": time.monotonic(),
+                }
+            )
+            if self.errors:
+                return self.errors.pop(0)
+            status, response = self._route(method, path, payload)
+            return status, {}, response
+
+    def _route(self, method: str, path: str, payload) -> tuple:
+        """Handle a request and return the status and JSON response."""
+        parts = urlsplit(path)
+        query = {key: value[0] for key, value in parse_qs(parts.query).items()}
+        if method == "POST" and parts.path == "/graphql":
+            return 200, self._graphql(payload["query"], payload["variables"])
+        if method == "GET" and re.fullmatch(r"/repos/[^/]+/[^/]+", parts.path):
+            return 200, {"full_name": parts.path[7:], "permissions": {"push": True}}
+        match = re.fullmatch(
+            r"/repos/([^/]+/[^/]+)/(\w+)(?:/(\d+)(?:/(\w+))?)?", parts.path
+        )
+        if match is None:
+            return 404, {"message": "Not Found"}
+        repo, resource, number, action = match.groups()
+        if method == "PATCH" and resource == "issues" and action is None:
+            self.pulls[int(number) - 1].update(payload)  # only PRs are updated
+            return 200, self.pulls[int(number) - 1]
+        if method == "POST" and resource == "pulls" and number is None:
+            pull = dict(payload, number=len(self.pulls) + 1, state="open")
+            pull["html_url"] = f"https://github.com/{repo}/pull/{pull['number']}"
+            self.pulls.append(pull)
+            return 201, pull
+        if method == "GET" and resource == "pulls" and number is None:
+            return 200, [
+                pull
+                for pull in self.pulls
+                if pull["state"] == query.get("state", "open")
+                and f"{repo.split('/')[0]}:{pull['head']}" == query.get("head")
+                and pull["base"] == query.get("base", pull["base"])
+            ]
+        if method == "GET" and number is not None and action is None:
+            items = self.pulls if resource == "pulls" else self.issues
+            if int(number) > len(items):
+                return 404, {"message": "Not Found"}
+            return 200, items[int(number) - 1]
+        if method == "POST" and action == "requested_reviewers":
+            self.pulls[int(number) - 1]["reviewers"] = payload["reviewers"]
+            return 201, self.pulls[int(number) - 1]
+        if method == "GET" and resource == "issues" and number is None:
+            return (
+                200,
+                [
+                    issue
+                    for issue in self.issues
+                    if issue["state"] == query.get("state", "open")
+                ][::-1],
+            )
+        if method == "POST" and resource == "issues" and action == "comments":
+            self.issues[int(number) - 1].setdefault("comments", []).append(
+                payload["body"]
+            )
+            return 201, {"body": payload["body"]}
+        if method == "POST" and resource == "issues" and number is None:
+            issue = dict(payload, number=len(self.issues) + 1, state="open")
+            issue["html_url"] = f"https://github.com/{repo}/issues/{issue['number']}"
+            self.issues.append(issue)
+            return 201, issue
+        return 404, {"message": "Not Found"}
+
+    def _open_pull(self, repo: str, head: str, base: str) -> List[Dict]:
+        """List the open pull requests of a head and base branch."""
+        return [
+            {"url": pull["html_url"]}
+            for pull in self.pulls
+            if pull["state"] == "open"
+            and pull["html_url"].startswith(f"https://github.com/{repo}/")
+            and (pull["head"], pull["base"]) == (head, base)
+        ]
+
+    def _graphql(self, query: str, variables: Dict) -> Dict:
+        """Answer a GraphQL operation of ``GraphQLClient``."""
+        operation = re.match(r"(?:query|mutation) (\w+)", query).group(1)
+        data: Dict = {}
+        errors = []
+
+        def missing(key: str):
+            errors.append({"type": "NOT_FOUND", "path": [key]})
+
+        if operation in ("Lookup", "CanPush"):
+            repo = f"{variables['owner']}/{variables['name']}"
+            data["repository"] = {"id": f"R_{repo}", "viewerPermission": "WRITE"}
+        if operation == "Lookup":
+            data["repository"]["pullRequests"] = {
+                "nodes": self._open_pull(repo, variables["head"], variables["base"])
+            }
+            for key, value in variables.items():
+                if re.fullmatch(r"u\d+", key):
+                    data[key] = (
+                        None if value.startswith("ghost") else {"id": f"U_{value}"}
+                    )
+                    if data[key] is None:
+                        missing(key)
+                elif re.fullmatch(r"o\d+", key):
+                    team = f"{value}/{variables['s' + key[1:]]}"
+                    data[f"t{key[1:]}"] = {"team": {"id": f"T_{team}"}}
+                elif re.fullmatch(r"l\d+", key):
+                    label = {"id": f"L_{value}"} if value in self.labels else None
+                    data["repository"][key] = label
+                    if label is None:
+                        missing(key)
+        elif operation == "FindMany":
+            for key, owner in variables.items():
+                if not re.fullmatch(r"o\d+", key):
+                    continue
+                index = key[1:]
+                repo = f"{owner}/{variables['n' + index]}"
+                if owner.startswith("ghost"):
+                    data[f"r{index}"] = None
+                    missing(f"r{index}")
+                    continue
+                nodes = self._open_pull(
+                    repo, variables[f"h{index}"], variables[f"b{index}"]
+                )
+                data[f"r{index}"] = {"pullRequests": {"nodes": nodes}}
+                if "issues(" in query:
+                    data[f"r{index}"]["issues"] = {
+                        "nodes": [
+                            {"url": issue["html_url"], "body": issue["body"]}
+                            for issue in self.issues[::-1]
+                            if issue["state"] == "open"
+                            and issue["html_url"].startswith(
+                                f"https://github.com/{repo}/"
+                            )
+                        ]
+                    }
+        elif operation == "CreatePullRequest":
+            fields = variables["input"]
+            repo = fields["repositoryId"][2:]
+            pull = {
+                "head": fields["headRefName"],
+                "base": fields["baseRefName"],
+                "title": fields["title"],
+                "draft": fields["draft"],
+                "number": len(self.pulls) + 1,
+                "state": "open",
+            }
+            pull["html_url"] = f"https://github.com/{repo}/pull/{pull['number']}"
+            self.pulls.append(pull)
+            data["createPullRequest"] = {
+                "pullRequest": {"id": f"PR_{pull['number']}", "url": pull["html_url"]}
+            }
+        elif operation == "FinishPullRequest":
+            pull = self.pulls[int(variables["id"][3:]) - 1]
+            for key, field in (
+                ("users", "reviewers"),
+                ("teams", "team_reviewers"),
+                ("labels", "labels"),
+                ("assignees", "assignees"),
+            ):
+                if key in variables:
+                    pull[field] = [node_id[2:] for node_id in variables[key]]
+            data = {"done": True}
+        response: Dict = {"data": data}
+        if errors:
+            response["errors"] = errors
+        return response
+
+
+def _handler(github: FakeGitHub):
+    """Create a request handler bound to the fake GitHub."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # else the body waits for a delayed ACK
+
+        def setup(self):
+            super().setup()
+            with github._lock:
+                github.connections += 1
+
+        def _respond(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length)) if length else None
+            status, headers, response = github.handle(self.command, self.path, payload)
+            time.sleep(github.delay)
+            body = json.dumps(response).encode("utf-8")
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = _respond
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,447 @@
+"""Test the git backends."""
+import os
+from unittest.mock import patch
+
+import pytest
+
+from edgetest_hub.backends import (
+    GitBackend,
+    Pygit2Backend,
+    blob_id,
+    get_backend,
+    parse_porcelain_v2,
+    worktree_blob_ids,
+)
+from edgetest_hub.scheduler import Step, run_steps
+from edgetest_hub.utils import _run_command, command_environ, git_environment
+from tests.conftest import run_git
+
+BACKEND_NAMES = ["cli", "pygit2"]
+FILES = ["setup.cfg", "requirements.txt"]
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    """Create a repository with a ``develop`` branch and chdir into it."""
+    monkeypatch.chdir(tmp_path)
+    run_git("init", "--initial-branch=develop")
+    run_git("config", "user.name", "Tester")
+    run_git("config", "user.email", "tester@example.com")
+    (tmp_path / "setup.cfg").write_text("[metadata]\nname = pkg\n")
+    (tmp_path / "requirements.txt").write_text("pandas==1.0.0\n")
+    run_git("add", "setup.cfg", "requirements.txt")
+    run_git("commit", "-m", "initial")
+
+    return tmp_path
+
+
+def _backend(name):
+    """Load a backend, skipping the test if it is not installed."""
+    if name == "pygit2":
+        pytest.importorskip("pygit2")
+    return get_backend(name, _run_command)
+
+
+@pytest.mark.parametrize("name", BACKEND_NAMES)
+def test_checkout_and_commit(name, repo, git_identity):
+    """Test the branch preparation and commit."""
+    git = _backend(name)
+    assert git.changed_files(FILES) == []
+
+    (repo / "requirements.txt").write_text("pandas==2.0.0\n")
+    (repo / "untracked").mkdir()
+    (repo / "untracked" / "file.txt").write_text("remove me")
+    git.clean()
+    assert not (repo / "untracked").exists()
+
+    git.checkout_branch("dep-updates", "develop")
+    assert run_git("rev-parse", "--abbrev-ref", "HEAD") == "dep-updates"
+    assert (repo / "requirements.txt").read_text() == "pandas==2.0.0\n"
+    assert git.changed_files(FILES) == ["requirements.txt"]
+
+    git.add("setup.cfg", "requirements.txt")
+    git.commit("environmentally friendly")
+    assert git.changed_files(FILES) == []
+    assert run_git("log", "-1", "--format=%s|%an|%ae") == (
+        "environmentally friendly|Jenkins|noreply@capitalone.com"
+    )
+    assert run_git("show", "develop:requirements.txt") == "pandas==1.0.0"
+
+
+def test_clean_subdirectory(repo, monkeypatch):
+    """Test both backends only clean below the working directory."""
+    (repo / "pkg").mkdir()
+    (repo / "pkg" / "setup.cfg").write_text("[metadata]\nname = sub\n")
+    run_git("add", "pkg/setup.cfg")
+    run_git("commit", "-m", "subpackage")
+    monkeypatch.chdir(repo / "pkg")
+
+    for name in BACKEND_NAMES:
+        (repo / "keep.txt").write_text("keep me")
+        (repo / "pkg" / "remove.txt").write_text("remove me")
+        (repo / "pkg" / "untracked").mkdir()
+        (repo / "pkg" / "untracked" / "file.txt").write_text("remove me")
+        _backend(name).clean()
+        assert (
+            run_git("status", "--porcelain", "--untracked-files=all") == "?? keep.txt"
+        )
+        assert (repo / "pkg").is_dir()
+
+
+@pytest.mark.parametrize("name", BACKEND_NAMES)
+def test_branch_errors(name, repo):
+    """Test the failures are raised as ``RuntimeError``."""
+    git = _backend(name)
+    with pytest.raises(RuntimeError):
+        git.delete_branch("dep-updates")
+    with pytest.raises(RuntimeError):
+        git.checkout_branch("dep-updates", "missing")
+    with pytest.raises(RuntimeError):
+        git.add("missing.txt")
+
+    git.checkout_branch("dep-updates")
+    run_git("checkout", "develop")
+    git.delete_branch("dep-updates")
+    assert run_git("branch", "--list", "dep-updates") == ""
+
+
+def test_git_environment(repo, monkeypatch):
+    """Test configuration is passed to the commands of the context, not set in
+    ``os.environ``, and then dropped."""
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    monkeypatch.setenv("GIT_CONFIG_KEY_0", "hub.host")
+    monkeypatch.setenv("GIT_CONFIG_VALUE_0", "github.com")
+    config = [
+        ("hub.host", "mycustomgit.com"),
+        ("url.https://token@github.com/.pushInsteadOf", "https://github.com/"),
+    ]
+
+    def get_hosts(results):
+        out, _ = _run_command("git", "config", "--get-all", "hub.host")
+        return out.splitlines()
+
+    with git_environment(config, {"GIT_AUTHOR_NAME": "Jenkins"}):
+        assert "GIT_AUTHOR_NAME" not in os.environ
+        assert command_environ()["GIT_AUTHOR_NAME"] == "Jenkins"
+        steps = [Step("first", get_hosts), Step("second", get_hosts)]
+        assert run_steps(steps, max_workers=2) == {
+            "first": ["github.com", "mycustomgit.com"],
+            "second": ["github.com", "mycustomgit.com"],
+        }
+        run_git("remote", "add", "origin", "https://github.com/org/repo.git")
+        out, _ = _run_command("git", "remote", "get-url", "--push", "origin")
+        assert out.strip() == "https://token@github.com/org/repo.git"
+
+    assert os.environ["GIT_CONFIG_COUNT"] == "1"
+    assert "GIT_CONFIG_KEY_1" not in command_environ()
+    assert "GIT_AUTHOR_NAME" not in command_environ()
+    assert _run_command("git", "config", "--get-all", "hub.host")[0] == "github.com\n"
+    assert run_git("config", "--list", "--local").find("token") == -1
+
+
+def test_get_backend_fallback(repo):
+    """Test falling back to the CLI backend when ``pygit2`` can't be imported."""
+    with patch.dict("sys.modules", {"pygit2": None}):
+        git = get_backend("pygit2", _run_command)
+
+    assert type(git) is GitBackend
+
+
+def test_pygit2_push_uses_cli(repo):
+    """Test the remote operations are delegated to the command line."""
+    pytest.importorskip("pygit2")
+    with patch("edgetest_hub.backends.GitBackend._git") as mock_git:
+        git = Pygit2Backend(_run_command)
+        git.push("origin", "dep-updates")
+        git.delete_remote_branch("https://github.com/org/repo.git", "dep-updates")
+
+    mock_git.assert_any_call("push", "origin", "dep-updates")
+    mock_git.assert_any_call(
+        "push", "https://github.com/org/repo.git", "--delete", "dep-updates"
+    )
+
+
+@pytest.mark.parametrize("name", BACKEND_NAMES)
+def test_push_with_lease(name, repo, tmp_path_factory):
+    """Test the force-with-lease push only replaces the expected commit."""
+    origin = tmp_path_factory.mktemp("origin")
+    run_git("init", "--bare", str(origin))
+    git = _backend(name)
+    assert git.remote_head(str(origin), "dep-updates") is None
+
+    git.checkout_branch("dep-updates")
+    git.push(str(origin), "dep-updates", lease="")
+    first = git.remote_head(str(origin), "dep-updates")
+    assert first == run_git("rev-parse", "HEAD")
+
+    run_git("commit", "--amend", "-m", "rewritten")
+    with pytest.raises(RuntimeError):
+        git.push(str(origin), "dep-updates", lease="")
+    git.push(str(origin), "dep-updates", lease=first)
+    assert git.remote_head(str(origin), "dep-updates") == run_git("rev-parse", "HEAD")
+
+
+def test_worktree_blob_ids(repo):
+    """Test the blob IDs match ``git hash-object``."""
+    (repo / "requirements.txt").write_text("pandas==2.0.0\n")
+    blobs = worktree_blob_ids(["setup.cfg", "requirements.txt", "missing.txt"])
+
+    assert blobs == {
+        "setup.cfg": run_git("hash-object", "setup.cfg"),
+        "requirements.txt": run_git("hash-object", "requirements.txt"),
+    }
+    assert blob_id(b"") == "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"
+
+
+@pytest.mark.parametrize("name", BACKEND_NAMES)
+def test_fetch_blob_ids(name, repo, tmp_path_factory):
+    """Test reading the blob IDs of a fetched branch."""
+    origin = tmp_path_factory.mktemp("origin")
+    run_git("init", "--bare", str(origin))
+    run_git("push", str(origin), "develop:dep-updates")
+    git = _backend(name)
+    git.fetch(str(origin), "dep-updates")
+
+    assert git.blob_ids("FETCH_HEAD", ["setup.cfg", "missing.txt"]) == {
+        "setup.cfg": run_git("rev-parse", "develop:setup.cfg")
+    }
+    with pytest.raises(RuntimeError):
+        git.fetch(str(origin), "missing")
+
+
+def test_blob_ids_subdirectory(repo, monkeypatch):
+    """Test both backends read the paths relative to the working directory."""
+    (repo / "pkg").mkdir()
+    (repo / "pkg" / "setup.cfg").write_text("[metadata]\nname = sub\n")
+    run_git("add", "pkg/setup.cfg")
+    run_git("commit", "-m", "subpackage")
+    monkeypatch.chdir(repo / "pkg")
+    paths = ["setup.cfg", "../requirements.txt", "missing.txt"]
+    expected = {
+        "setup.cfg": run_git("rev-parse", "HEAD:pkg/setup.cfg"),
+        "../requirements.txt": run_git("rev-parse", "HEAD:requirements.txt"),
+    }
+
+    for name in BACKEND_NAMES:
+        git = _backend(name)
+        assert git.blob_ids("HEAD", paths) == expected
+        assert git.read_file("HEAD", "setup.cfg") == "[metadata]\nname = sub\n"
+
+
+@pytest.mark.parametrize("name", BACKEND_NAMES)
+def test_changed_files(name, repo):
+    """Test untracked files are not reported as changes."""
+    git = _backend(name)
+    (repo / "requirements.txt").unlink()
+    (repo / "other.txt").write_text("untracked")
+    run_git("rm", "--cached", "setup.cfg")
+
+    assert sorted(git.changed_files(FILES + ["other.txt", "missing.txt"])) == sorted(
+        FILES
+    )
+
+
+@pytest.mark.parametrize("name", BACKEND_NAMES)
+def test_changed_files_subdirectory(name, repo, monkeypatch):
+    """Test the changed paths are relative to the working directory."""
+    (repo / "pkg").mkdir()
+    (repo / "pkg" / "setup.cfg").write_text("[metadata]\nname = sub\n")
+    run_git("add", "pkg/setup.cfg")
+    run_git("commit", "-m", "subpackage")
+    (repo / "pkg" / "setup.cfg").write_text("[metadata]\nname = changed\n")
+    (repo / "requirements.txt").write_text("pandas==2.0.0\n")
+    monkeypatch.chdir(repo / "pkg")
+    git = _backend(name)
+
+    assert git.changed_files(FILES) == ["setup.cfg"]
+    assert git.changed_files(["../requirements.txt"]) == ["../requirements.txt"]
+
+
+def test_parse_porcelain_v2():
+    """Test parsing the NUL separated status entries."""
+    out = "\0".join(
+        [
+            "1 .M N... 100644 100644 100644 abc abc setup.cfg",
+            "2 R. N... 100644 100644 100644 abc abc R100 new name.txt",
+            "old name.txt",
+            "u UU N... 100644 100644 100644 100644 abc abc abc requirements.txt",
+            "? untracked.txt",
+            "",
+        ]
+    )
+    assert parse_porcelain_v2(out) == ["setup.cfg", "new name.txt", "requirements.txt"]
+
+
+@pytest.mark.parametrize("name", BACKEND_NAMES)
+def test_commit_files(name, repo, git_identity):
+    """Test committing files without touching the index or working tree."""
+    (repo / "docs" / "source").mkdir(parents=True)
+    (repo / "docs" / "source" / "conf.py").write_text("version = 1\n")
+    (repo / "docs" / "keep.txt").write_text("keep\n")
+    run_git("add", "docs")
+    run_git("commit", "-m", "docs")
+    base = run_git("rev-parse", "HEAD")
+
+    (repo / "setup.cfg").write_text("[metadata]\nname = updated\n")
+    (repo / "requirements.txt").unlink()
+    (repo / "docs" / "source" / "conf.py").write_text("version = 2\n")
+    (repo / "new" / "dir").mkdir(parents=True)
+    (repo / "new" / "dir" / "file.txt").write_text("new\n")
+    status = run_git("status", "--porcelain")
+
+    git = _backend(name)
+    parent = git.rev_parse("develop")
+    commit = git.commit_files(
+        "dep-updates",
+        parent,
+        [
+            "setup.cfg",
+            "requirements.txt",
+            "docs/source/conf.py",
+            "new/dir/file.txt",
+        ],
+        "environmentally friendly",
+    )
+
+    assert parent == base
+    assert run_git("rev-parse", "dep-updates") == commit
+    assert run_git("rev-parse", "HEAD") == base
+    assert run_git("status", "--porcelain") == status
+    assert run_git("rev-parse", "dep-updates^") == base
+    assert run_git("ls-tree", "-r", "--name-only", "dep-updates").splitlines() == [
+        "docs/keep.txt",
+        "docs/source/conf.py",
+        "new/dir/file.txt",
+        "setup.cfg",
+    ]
+    assert run_git("show", "dep-updates:setup.cfg") == "[metadata]\nname = updated"
+    assert run_git("show", "dep-updates:docs/source/conf.py") == "version = 2"
+    assert run_git("log", "-1", "--format=%an|%ae", "dep-updates") == (
+        "Jenkins|noreply@capitalone.com"
+    )
+
+
+@pytest.mark.parametrize("name", BACKEND_NAMES)
+def test_commit_files_same_tree(name, repo):
+    """Test the tree matches the one ``git add`` and ``git commit`` would build."""
+    (repo / "setup.cfg").write_text("[metadata]\nname = updated\n")
+    git = _backend(name)
+    commit = git.commit_files(
+        "dep-updates", git.rev_parse("HEAD"), ["setup.cfg"], "msg"
+    )
+    run_git("commit", "-am", "porcelain")
+
+    assert run_git("rev-parse", f"{commit}^{{tree}}") == run_git(
+        "rev-parse", "HEAD^{tree}"
+    )
+    with pytest.raises(RuntimeError):
+        git.rev_parse("missing")
+
+
+@pytest.mark.parametrize("name", BACKEND_NAMES)
+def test_commit_files_subdirectory(name, repo, monkeypatch):
+    """Test the paths are relative to the working directory, like ``git add``."""
+    (repo / "pkg").mkdir()
+    (repo / "pkg" / "setup.cfg").write_text("[metadata]\nname = sub\n")
+    run_git("add", "pkg/setup.cfg")
+    run_git("commit", "-m", "subpackage")
+    (repo / "pkg" / "setup.cfg").write_text("[metadata]\nname = updated\n")
+    monkeypatch.chdir(repo / "pkg")
+    git = _backend(name)
+    commit = git.commit_files(
+        "dep-updates", git.rev_parse("HEAD"), ["setup.cfg", "missing.txt"], "msg"
+    )
+    run_git("commit", "-am", "porcelain")
+
+    assert run_git("rev-parse", f"{commit}^{{tree}}") == run_git(
+        "rev-parse", "HEAD^{tree}"
+    )
+    assert run_git("ls-tree", "-r", "--full-tree", "--name-only", commit).split() == [
+        "pkg/setup.cfg",
+        "requirements.txt",
+        "setup.cfg",
+    ]
+
+
+@pytest.mark.parametrize("name", BACKEND_NAMES)
+def test_commit_contents(name, repo, git_identity):
+    """Test committing given contents, and reading files from a commit."""
+    status = run_git("status", "--porcelain")
+    git = _backend(name)
+    base = git.rev_parse("HEAD")
+    original = git.read_file(base, "setup.cfg")
+    commit = git.commit_contents(
+        "dep-updates-pandas",
+        base,
+        {"setup.cfg": "[metadata]\nname = split\n", "requirements.txt": None},
+        "environmentally friendly",
+    )
+
+    assert run_git("rev-parse", "dep-updates-pandas") == commit
+    assert run_git("rev-parse", "HEAD") == base
+    assert run_git("status", "--porcelain") == status
+    assert git.read_file(commit, "setup.cfg") == "[metadata]\nname = split\n"
+    assert git.read_file(base, "setup.cfg") == original
+    assert git.read_file(commit, "requirements.txt") is None
+
+
+def test_prepare_worktree(repo):
+    """Test the cached sparse worktree leaves the main checkout alone."""
+    (repo / "big").mkdir()
+    (repo / "big" / "file.txt").write_text("big\n")
+    run_git("add", "big")
+    run_git("commit", "-m", "big")
+    (repo / "requirements.txt").write_text("pandas==2.0.0\n")
+    (repo / "untracked.txt").write_text("keep me\n")
+    status = run_git("status", "--porcelain")
+
+    git = GitBackend(_run_command)
+    path = git.common_dir() / "edgetest-hub" / "worktree"
+    assert git.common_dir() == repo / ".git"
+    for _ in range(2):  # the second run reuses the worktree
+        git.prepare_worktree(str(path), "dep-updates", "develop", FILES)
+        assert sorted(p.name for p in path.iterdir()) == [".git"] + sorted(FILES)
+        (path / "requirements.txt").write_text("pandas==2.0.0\n")
+        worktree = git.worktree(str(path))
+        worktree.add("requirements.txt")
+        worktree.commit("environmentally friendly")
+
+    assert run_git("rev-parse", "--abbrev-ref", "HEAD") == "develop"
+    assert run_git("status", "--porcelain") == status
+    assert run_git("rev-parse", "dep-updates^") == run_git("rev-parse", "develop")
+    assert run_git("ls-tree", "-r", "--name-only", "dep-updates").splitlines() == [
+        "big/file.txt",
+        "requirements.txt",
+        "setup.cfg",
+    ]
+    assert run_git("show", "dep-updates:requirements.txt") == "pandas==2.0.0"
+
+
+def test_prepare_worktree_fallback(repo):
+    """Test the branch starts from ``HEAD`` when the start point is missing."""
+    git = GitBackend(_run_command)
+    path = repo / ".git" / "edgetest-hub" / "worktree"
+    git.prepare_worktree(str(path), "dep-updates", "missing", FILES)
+
+    assert run_git("rev-parse", "dep-updates") == run_git("rev-parse", "HEAD")
+
+
+def test_prepare_worktree_checked_out(repo, tmp_path_factory):
+    """Test a branch checked out in the main tree is committed on a detached HEAD."""
+    origin = tmp_path_factory.mktemp("origin")
+    run_git("init", "--bare", str(origin))
+    run_git("checkout", "-b", "dep-updates")
+    git = GitBackend(_run_command)
+    path = repo / ".git" / "edgetest-hub" / "worktree"
+    git.prepare_worktree(str(path), "dep-updates", "develop", FILES)
+    (path / "requirements.txt").write_text("pandas==2.0.0\n")
+    worktree = git.worktree(str(path))
+    worktree.add("requirements.txt")
+    worktree.commit("environmentally friendly")
+    worktree.push(str(origin), "dep-updates", source="HEAD")
+
+    assert run_git("rev-parse", "--abbrev-ref", "HEAD") == "dep-updates"
+    assert run_git("rev-parse", "dep-updates") == run_git("rev-parse", "develop")
+    assert run_git("--git-dir", str(origin), "rev-parse", "dep-updates^") == run_git(
+        "rev-parse", "develop"
+    )
@@ -0,0 +1,22 @@
+"""Test the benchmark suite runs end to end."""
+from benchmarks.suite import compare, run_suite
+
+
+def test_run_suite(tmp_path):
+    """Test a single small case of each scenario, against local remotes."""
+    results = run_suite(tmp_path, ["small"], commit_modes=["plumbing"], repeat=1)
+
+    assert [r["scenario"] for r in results["results"]] == [
+        "no change",
+        "change",
+        "failure",
+    ]
+    no_change, change, failure = results["results"]
+    assert (no_change["commands"], no_change["api_requests"]) == (1, 0)
+    assert change["api_requests"] == 2  # the PR, then its reviewers
+    assert "push" in change["steps"]
+    assert failure["api_requests"] == 2  # the open issues, then the new one
+    assert "git" in results["environment"]
+
+    rows = compare(results, results)
+    assert [row[3] for row in rows] == [1.0, 1.0, 1.0]
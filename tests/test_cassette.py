@@ -0,0 +1,155 @@
+"""Test recording and replaying the commands and API requests of a run."""
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+from click.testing import CliRunner
+
+from edgetest_hub.cassette import Cassette, CassetteMismatchError
+from edgetest_hub.cli import cli
+from edgetest_hub.plugin import post_run_hook
+from edgetest_hub.utils import CommandError, _run_command
+from tests.conftest import FakeTester, hub_conf
+from tests.github_server import FakeGitHub
+
+GIT_STATUS_CHANGED = "1 .M N... 100644 100644 100644 abc abc requirements.txt\0"
+
+SETUP_CFG = """
+[edgetest.hub]
+git_repo_org = test-org
+git_repo_name = test-repo
+pr_reviewers = abc123
+open_issue_on_fail = False
+github_client = rest
+api_url = {api_url}
+[edgetest.envs.core]
+upgrade =
+    pandas
+command =
+    pytest tests
+"""
+
+
+def _conf(api_url, cassette_path, mode):
+    """Build a configuration with a cassette."""
+    return hub_conf(
+        open_issue_on_fail=False,
+        github_client="rest",
+        api_url=api_url,
+        cassette_path=str(cassette_path),
+        cassette_mode=mode,
+    )
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_record_replay_commands(tmp_path):
+    """Test commands are replayed with their output, errors and stdin."""
+    path = tmp_path / "run.jsonl"
+    cwd = os.getcwd()
+    run = Cassette(path).run_command(_run_command)
+    assert run("echo", "https://abcd1234@github.com/", cwd) == (
+        f"https://abcd1234@github.com/ {cwd}\n",
+        0,
+    )
+    assert run("cat", stdin="abc") == ("abc", 0)
+    with pytest.raises(CommandError):
+        run("sh", "-c", "echo oops >&2; exit 3")
+
+    interactions = Cassette.load(path)
+    assert [i["argv"] for i in interactions] == [
+        ["echo", "https://***@github.com/", "{cwd}"],
+        ["cat"],
+        ["sh", "-c", "echo oops >&2; exit 3"],
+    ]
+    assert interactions[0]["stdout"] == "https://***@github.com/ {cwd}\n"
+    assert interactions[2]["stderr"] == "oops\n"
+    assert interactions[2]["exit_code"] == 3
+    assert all(i["seconds"] > 0 for i in interactions)
+
+    replay = Cassette(path, "replay").run_command(_run_command)
+    with patch("edgetest_hub.utils.Popen") as mock_popen:
+        with pytest.raises(CommandError) as err:
+            replay("sh", "-c", "echo oops >&2; exit 3")
+        assert (err.value.stderr, err.value.returncode) == ("oops\n", 3)
+        assert replay("cat", stdin="abc") == ("abc", 0)
+        assert replay("echo", "https://abcd1234@github.com/", cwd)[0].endswith(
+            f" {cwd}\n"
+        )
+        with pytest.raises(CassetteMismatchError):
+            replay("cat", stdin="abc")
+    mock_popen.assert_not_called()
+
+
+def test_record_old_testers(tmp_path):
+    """Test testers without ``setup_status`` nor ``lowered_packages`` are recorded."""
+    tester = type(
+        "Tester",
+        (),
+        {
+            "envname": "myenv",
+            "status": True,
+            "upgraded_packages": lambda self: [{"name": "pandas", "version": "2.0"}],
+        },
+    )()
+    path = tmp_path / "run.jsonl"
+    Cassette(path).record_testers([tester])
+
+    (replayed,) = Cassette(path, "replay").testers()
+    assert (replayed.envname, replayed.status, replayed.setup_status) == (
+        "myenv",
+        True,
+        None,
+    )
+    assert replayed.upgraded_packages() == [{"name": "pandas", "version": "2.0"}]
+    assert replayed.lowered_packages() == []
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+@patch("edgetest_hub.plugin._run_command", autospec=True)
+def test_hook_record_replay(mock_run_command, tmp_path):
+    """Test a recorded run is replayed without commands or API requests."""
+    mock_run_command.return_value = (GIT_STATUS_CHANGED, 0)
+    tester = FakeTester("core", True, {"pandas": "2.0.0"})
+    path = tmp_path / "run.jsonl"
+    with FakeGitHub() as github:
+        post_run_hook([tester], _conf(github.url, path, "record"))
+        recorded = list(github.requests)
+        api_url = github.url
+    commands = mock_run_command.call_args_list
+
+    interactions = Cassette.load(path)
+    assert interactions[0]["type"] == "testers"
+    assert [i["path"] for i in interactions if i["type"] == "http"] == [
+        request["path"] for request in recorded
+    ]
+    envs = [i["env"] for i in interactions if i["type"] == "command"]
+    assert {"GIT_AUTHOR_NAME": "Jenkins"}.items() <= envs[-1].items()
+    assert "abcd1234" not in path.read_text()
+
+    mock_run_command.reset_mock()
+    post_run_hook([tester], _conf(api_url, path, "replay"))
+    mock_run_command.assert_not_called()
+
+    result = CliRunner().invoke(
+        cli, ["replay", str(path), "--repo", str(tmp_path), "-c", "setup.cfg"]
+    )
+    assert result.exit_code == 1  # no setup.cfg in the directory
+    (tmp_path / "setup.cfg").write_text(SETUP_CFG.format(api_url=api_url))
+    result = CliRunner().invoke(
+        cli,
+        [
+            "replay",
+            str(path),
+            "--repo",
+            str(tmp_path),
+            "--trace-path",
+            str(tmp_path / "t.json"),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith(f"Replayed {path} in ")
+    mock_run_command.assert_not_called()
+    events = json.loads((tmp_path / "t.json").read_text())["traceEvents"]
+    assert len([e for e in events if e["cat"] == "command"]) == len(commands)
+    assert all(e["args"]["replayed"] for e in events if e["cat"] in ("command", "api"))
@@ -0,0 +1,248 @@
+"""Test submitting the updates of many repositories."""
+import os
+from unittest.mock import patch
+
+import pytest
+from click.testing import CliRunner
+
+from edgetest_hub.cli import cli
+from edgetest_hub.fleet import (
+    RepoResult,
+    load_config,
+    lookup_fleet,
+    run_fleet,
+    submit_repo,
+    summarize,
+)
+from edgetest_hub.github import GitHubClient
+from edgetest_hub.plugin import FINGERPRINT_MARKER
+from edgetest_hub.utils import CommandTimeoutError
+from tests.conftest import run_git
+from tests.github_server import FakeGitHub
+
+CFG = """
+[edgetest.hub]
+git_repo_org = test-org
+git_repo_name = {name}
+pr_reviewers = abc123
+open_issue_on_fail = False
+github_client = rest
+api_url = {api_url}
+[edgetest.envs.myenv]
+upgrade =
+    myupgrade
+command =
+    pytest tests
+"""
+
+
+def _clone(tmp_path, name, api_url, **options):
+    """Create a repository pushing to a local bare origin."""
+    origin = tmp_path / "origins" / f"{name}.git"
+    run_git("init", "--bare", "--initial-branch=develop", str(origin), cwd=tmp_path)
+    repo = tmp_path / name
+    run_git("clone", "--quiet", str(origin), str(repo), cwd=tmp_path)
+    run_git("config", "user.name", "Tester", cwd=repo)
+    run_git("config", "user.email", "tester@example.com", cwd=repo)
+    cfg = CFG.format(name=name, api_url=api_url)
+    for option in options.items():
+        cfg = cfg.replace("[edgetest.envs", "{} = {}\n[edgetest.envs".format(*option))
+    (repo / "setup.cfg").write_text(cfg)
+    (repo / "requirements.txt").write_text("pandas==1.0.0\n")
+    run_git("add", ".", cwd=repo)
+    run_git("commit", "-m", "initial", cwd=repo)
+    run_git("push", "--quiet", "origin", "develop", cwd=repo)
+    return repo
+
+
+@pytest.fixture
+def fleet(tmp_path, monkeypatch):
+    """Create repositories pushing to local bare origins, and a fake GitHub."""
+    with FakeGitHub() as github:
+        # redirect the authenticated push URL to the local origins
+        monkeypatch.setenv("GITHUB_TOKEN", "abcd1234")
+        monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+        monkeypatch.setenv(
+            "GIT_CONFIG_KEY_0", f"url.{(tmp_path / 'origins').as_uri()}/.insteadOf"
+        )
+        monkeypatch.setenv(
+            "GIT_CONFIG_VALUE_0", "https://abcd1234@github.com/test-org/"
+        )
+        repos = [
+            _clone(tmp_path, name, github.url) for name in ("changed", "unchanged")
+        ]
+        (repos[0] / "requirements.txt").write_text("pandas==2.0.0\n")
+        yield github, tmp_path, repos
+
+
+def test_run_fleet(fleet):
+    """Test each repository is submitted in its own process."""
+    github, tmp_path, repos = fleet
+    cwd = os.getcwd()
+    results = run_fleet(
+        [str(repo) for repo in repos] + [str(tmp_path / "missing")], processes=2
+    )
+
+    assert os.getcwd() == cwd
+    assert [(r.repo, r.status) for r in results] == [
+        (str(repos[0]), "submitted"),
+        (str(repos[1]), "no changes"),
+        (str(tmp_path / "missing"), "failed"),
+    ]
+    assert results[0].detail == "https://github.com/test-org/changed/pull/1"
+    assert (
+        run_git(
+            "show",
+            "dep-updates:requirements.txt",
+            cwd=tmp_path / "origins" / "changed.git",
+        )
+        == "pandas==2.0.0"
+    )
+    assert [pull["head"] for pull in github.pulls] == ["dep-updates"]
+
+
+def test_run_fleet_rate(fleet):
+    """Test the processes share ``api_rate``, across their repositories."""
+    github, tmp_path, _ = fleet
+    repos = [_clone(tmp_path, f"repo{i}", github.url, api_rate=4) for i in range(4)]
+    for repo in repos:
+        (repo / "requirements.txt").write_text("pandas==2.0.0\n")
+    results = run_fleet([str(repo) for repo in repos], processes=2)
+
+    assert [r.status for r in results] == ["submitted"] * 4
+    times = sorted(request["time"] for request in github.requests)
+    assert len(times) == 8
+    # beyond a burst of 2 requests in each process, at most 4 requests per second
+    assert len(times) - 2 * 2 <= 4 * (times[-1] - times[0]) + 0.5
+
+
+def test_submit_repo(fleet, monkeypatch):
+    """Test the outcome of each repository, in this process."""
+    github, tmp_path, repos = fleet
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "nohub").mkdir()
+    (tmp_path / "nohub" / "setup.cfg").write_text(
+        "[edgetest.envs.myenv]\nupgrade =\n    pandas\n"
+    )
+    (tmp_path / "invalid").mkdir()
+    (tmp_path / "invalid" / "setup.cfg").write_text(
+        "[edgetest.hub]\nconcurrency = many\n[edgetest.envs.myenv]\nupgrade =\n"
+        "    pandas\n"
+    )
+
+    submitted = submit_repo(str(repos[0]))
+    assert (submitted.status, submitted.detail) == (
+        "submitted",
+        "https://github.com/test-org/changed/pull/1",
+    )
+    assert submit_repo(str(repos[1])).status == "no changes"
+    assert submit_repo(str(tmp_path / "nohub")).status == "skipped"
+    failed = submit_repo(str(tmp_path / "invalid"))
+    assert failed.status == "failed"
+    assert failed.detail.startswith("Unable to validate configuration file")
+
+    with patch(
+        "edgetest_hub.fleet._submit",
+        side_effect=CommandTimeoutError("git push", 600),
+    ):
+        timed_out = submit_repo(str(repos[0]))
+    assert timed_out.status == "timed out"
+    assert "git push" in timed_out.detail
+
+
+def test_submit_repo_outcome(fleet, monkeypatch):
+    """Test a run that submits nothing reports why."""
+    _, tmp_path, repos = fleet
+    monkeypatch.chdir(tmp_path)
+    with patch("edgetest_hub.fleet._submit", return_value=("leased", None)):
+        result = submit_repo(str(repos[0]))
+    assert (result.status, result.detail) == ("leased", "")
+
+
+def test_load_config_toml(tmp_path):
+    """Test a TOML configuration is validated with the plugin options."""
+    (tmp_path / "edgetest.toml").write_text(
+        '[edgetest.hub]\ngit_repo_org = "test-org"\ngit_repo_name = "repo"\n'
+        'pr_reviewers = "abc123"\nopen_issue_on_fail = false\n'
+        '[edgetest.envs.myenv]\nupgrade = ["pandas"]\n'
+    )
+
+    conf = load_config(tmp_path / "edgetest.toml")
+    assert conf["hub"]["git_repo_name"] == "repo"
+    assert conf["hub"]["updater_branch"] == "dep-updates"
+
+
+def test_summarize():
+    """Test the summary table and totals."""
+    summary = summarize(
+        [
+            RepoResult("a", "submitted", 1.0, "https://github.com/org/a/pull/1", 2.5),
+            RepoResult("b", "failed", 2.0, "boom"),
+            RepoResult("c", "submitted", 3.0, "https://github.com/org/c/pull/1"),
+        ]
+    )
+
+    assert "https://github.com/org/a/pull/1" in summary
+    assert "3 repositories: 1 failed, 2 submitted" in summary
+    assert summary.endswith("Waited 2.5s in total for the GitHub API rate limits.")
+
+
+def test_cli_submit(tmp_path, monkeypatch):
+    """Test the command exits with an error if a repository failed."""
+    monkeypatch.setenv("GITHUB_TOKEN", "abcd1234")
+    result_ok = [RepoResult(str(tmp_path), "no changes", 0.1)]
+    result_failed = [RepoResult(str(tmp_path), "failed", 0.1, "boom")]
+    runner = CliRunner()
+    with patch("edgetest_hub.cli.run_fleet", return_value=result_ok) as run:
+        result = runner.invoke(cli, ["submit", str(tmp_path), "-p", "4"])
+    assert result.exit_code == 0
+    assert "1 repositories: 1 no changes" in result.output
+    run.assert_called_once_with((str(tmp_path),), "setup.cfg", 4)
+
+    with patch("edgetest_hub.cli.run_fleet", return_value=result_failed):
+        result = runner.invoke(cli, ["submit", str(tmp_path)])
+    assert result.exit_code == 1
+
+    monkeypatch.delenv("GITHUB_TOKEN")
+    result = runner.invoke(cli, ["submit", str(tmp_path)])
+    assert result.exit_code == 1
+    assert "GITHUB_TOKEN not found" in result.output
+
+
+def test_lookup_fleet(fleet):
+    """Test the PRs and issues of the repositories are found in one query."""
+    github, tmp_path, repos = fleet
+    client = GitHubClient(github.url, "abcd1234")
+    pull = client.create_pull_request(
+        "test-org/changed", "dep-updates", "develop", "title", ""
+    )
+    issue = client.create_issue(
+        "test-org/unchanged", "title", "failed", FINGERPRINT_MARKER.format("abc")
+    )
+    client.close()
+    github.requests.clear()
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "setup.cfg").write_text(
+        "[edgetest.envs.myenv]\nupgrade =\n    pandas\n"
+    )
+
+    found = lookup_fleet([str(repo) for repo in repos] + [str(tmp_path / "other")])
+    assert found == [
+        {
+            "repo": str(repos[0]),
+            "name": "test-org/changed",
+            "pull_request": pull,
+            "issue": None,
+        },
+        {
+            "repo": str(repos[1]),
+            "name": "test-org/unchanged",
+            "pull_request": None,
+            "issue": issue,
+        },
+    ]
+    assert [(r["method"], r["path"]) for r in github.requests] == [("POST", "/graphql")]
+
+    result = CliRunner().invoke(cli, ["lookup"] + [str(repo) for repo in repos])
+    assert result.exit_code == 0
+    assert pull in result.output and issue in result.output
@@ -0,0 +1,601 @@
+"""Test the GitHub clients."""
+import os
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from edgetest_hub.backends import GitBackend
+from edgetest_hub.github import (
+    HUB_MESSAGE_LIMIT,
+    GitHubAPIError,
+    GitHubClient,
+    GraphQLClient,
+    HubClient,
+    RateLimiter,
+    api_url_for,
+)
+from edgetest_hub.plugin import (
+    FINGERPRINT_MARKER,
+    create_issue,
+    failure_fingerprint,
+    push_branch,
+    submit_update,
+)
+from edgetest_hub.report import build_report
+from tests.conftest import FakeTester, hub_conf
+from tests.github_server import FakeGitHub
+
+CONF = hub_conf(pr_reviewers="abc123,efg456", github_client="rest")
+
+
+@pytest.fixture
+def github():
+    """Start a local stand-in for the GitHub API."""
+    with FakeGitHub() as server:
+        yield server
+
+
+@pytest.mark.parametrize(
+    "git_url, expected",
+    [
+        ("github.com", "https://api.github.com"),
+        ("mycustomgit.com", "https://mycustomgit.com/api/v3"),
+    ],
+)
+def test_api_url_for(git_url, expected):
+    """Test mapping the git host to the API URL."""
+    assert api_url_for(git_url) == expected
+
+
+def test_rest_client_keepalive(github):
+    """Test a pull request, reviewers and an issue reuse one connection."""
+    client = GitHubClient(github.url, "abcd1234")
+    url = client.create_pull_request(
+        "test-org/test-repo", "dep-updates", "develop", "title", "abc123, efg456"
+    )
+    client.create_issue("test-org/test-repo", "title", "first", "second")
+    client.close()
+
+    assert url == "https://github.com/test-org/test-repo/pull/1"
+    assert github.connections == 1
+    assert [(r["method"], r["path"]) for r in github.requests] == [
+        ("POST", "/repos/test-org/test-repo/pulls"),
+        ("POST", "/repos/test-org/test-repo/pulls/1/requested_reviewers"),
+        ("POST", "/repos/test-org/test-repo/issues"),
+    ]
+    assert github.pulls[0]["reviewers"] == ["abc123", "efg456"]
+    assert github.issues[0]["body"] == "first\n\nsecond"
+
+
+def test_rest_client_error(github):
+    """Test error responses raise a ``RuntimeError``."""
+    client = GitHubClient(github.url, "abcd1234")
+    with pytest.raises(GitHubAPIError) as err:
+        client.request("GET", "/missing")
+
+    assert err.value.status == 404
+    assert isinstance(err.value, RuntimeError)
+
+
+def test_rest_client_reconnects(github):
+    """Test a stale keep-alive connection is replaced."""
+    client = GitHubClient(github.url, "abcd1234")
+    client.create_issue("test-org/test-repo", "title", "body")
+    stale, _ = client._acquire()
+    stale.sock.close()
+    client._idle.put(stale)
+    client.create_issue("test-org/test-repo", "title", "body")
+
+    assert len(github.issues) == 2
+
+
+def test_rate_limiter_pacing():
+    """Test the token bucket spaces out requests after the burst."""
+    limiter = RateLimiter(rate=20)
+    start = time.monotonic()
+    for _ in range(30):
+        limiter.acquire("GET /")
+
+    assert 0.4 < time.monotonic() - start < 1.5
+    assert limiter.requests == 30
+    assert 0.4 < limiter.waited < 1.5
+
+
+def test_rate_limiter_retry(github):
+    """Test rate limited and server error responses are retried."""
+    github.errors = [
+        (403, {"Retry-After": "1"}, {"message": "secondary rate limit"}),
+        (502, {}, {"message": "Bad Gateway"}),
+    ]
+    client = GitHubClient(github.url, "abcd1234", limiter=RateLimiter(backoff=0.01))
+    start = time.monotonic()
+    assert (
+        client.find_pull_request("test-org/test-repo", "dep-updates", "develop") is None
+    )
+
+    assert 1 <= time.monotonic() - start < 3
+    assert len(github.requests) == 3
+    assert client.limiter.waited >= 1
+
+
+@pytest.mark.parametrize(
+    "status, headers, body, retry",
+    [
+        (429, {}, "", True),
+        (403, {"X-RateLimit-Remaining": "0"}, "", True),
+        (403, {}, "You have exceeded a secondary rate limit", True),
+        (403, {}, "Resource not accessible by integration", False),
+        (502, {}, "", False),
+        (422, {}, "", False),
+    ],
+)
+def test_rate_limiter_should_retry(status, headers, body, retry):
+    """Test a POST is only retried when it was not processed."""
+    assert RateLimiter().should_retry("POST", status, headers, body) is retry
+
+
+def test_rate_limiter_gives_up(github):
+    """Test the error is raised once the retries are used up."""
+    github.errors = [(503, {}, {"message": "Unavailable"})] * 3
+    client = GitHubClient(
+        github.url, "abcd1234", limiter=RateLimiter(retries=2, backoff=0.01)
+    )
+    with pytest.raises(GitHubAPIError) as err:
+        client.request("GET", "/repos/test-org/test-repo/pulls")
+
+    assert err.value.status == 503
+    assert len(github.requests) == 3
+
+
+def test_rate_limiter_reset(github):
+    """Test an exhausted limit pauses the next request until the reset."""
+    github.errors = [
+        (200, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1"}, []),
+    ]
+    client = GitHubClient(github.url, "abcd1234")
+    with patch("edgetest_hub.github.time.time", return_value=0.0):
+        client.request("GET", "/repos/test-org/test-repo/pulls")
+    with patch.object(RateLimiter, "_sleep", autospec=True) as sleep:
+        client.request("GET", "/repos/test-org/test-repo/pulls")
+
+    assert 0.5 < sleep.call_args.args[1] <= 1
+
+
+def test_hub_client():
+    """Test the ``hub`` client builds the commands."""
+    run_command = Mock(return_value=("https://github.com/org/repo/pull/1", 0))
+    client = HubClient(run_command)
+    client.create_pull_request("org/repo", "dep-updates", "develop", "title", "a,b")
+    client.create_issue("org/repo", "title", "first", "second")
+    client.create_pull_request(
+        "org/repo", "dep-updates", "develop", "title", "a", False, "x,y", "b", True
+    )
+
+    assert run_command.call_args_list[0].args == (
+        "hub",
+        "pull-request",
+        "-b",
+        "develop",
+        "-m",
+        "title",
+        "-r",
+        "a,b",
+        "--push",
+    )
+    assert run_command.call_args_list[1].args == (
+        "hub",
+        "issue",
+        "create",
+        "--message",
+        "title",
+        "--message",
+        "first",
+        "--message",
+        "second",
+    )
+    assert run_command.call_args_list[2].args == (
+        "hub",
+        "pull-request",
+        "-b",
+        "develop",
+        "-h",
+        "dep-updates",
+        "-m",
+        "title",
+        "-r",
+        "a",
+        "-l",
+        "x,y",
+        "-a",
+        "b",
+        "--draft",
+    )
+
+
+def test_is_open(github):
+    """Test looking up the state of an issue or pull request."""
+    client = GitHubClient(github.url, "abcd1234")
+    pull = client.create_pull_request(
+        "test-org/test-repo", "dep-updates", "develop", "title", ""
+    )
+    issue = client.create_issue("test-org/test-repo", "title", "failed")
+    assert client.is_open("test-org/test-repo", pull)
+    assert client.is_open("test-org/test-repo", issue)
+
+    github.issues[0]["state"] = "closed"
+    assert not client.is_open("test-org/test-repo", issue)
+    with pytest.raises(RuntimeError):
+        client.is_open("test-org/test-repo", "https://github.com/o/r/issues/9")
+    client.close()
+
+    run_command = Mock(return_value=('{"state": "closed"}', 0))
+    assert not HubClient(run_command).is_open("org/repo", pull)
+    assert run_command.call_args.args == ("hub", "api", "repos/org/repo/pulls/1")
+
+
+def test_hub_client_large_body():
+    """Test ``hub`` reads a large issue or comment body from stdin."""
+    run_command = Mock(return_value=("https://github.com/org/repo/issues/1", 0))
+    client = HubClient(run_command)
+    body = "x" * (HUB_MESSAGE_LIMIT + 1)
+    client.create_issue("org/repo", "title", "first", body)
+    client.comment_issue("org/repo", "https://github.com/org/repo/issues/1", body)
+
+    assert run_command.call_args_list[0].args == (
+        "hub",
+        "issue",
+        "create",
+        "--file",
+        "-",
+    )
+    assert run_command.call_args_list[0].kwargs == {
+        "stdin": f"title\n\nfirst\n\n{body}"
+    }
+    assert run_command.call_args_list[1].args == (
+        "hub",
+        "api",
+        "repos/org/repo/issues/1/comments",
+        "--input",
+        "-",
+    )
+    assert run_command.call_args_list[1].kwargs == {"stdin": f'{{"body": "{body}"}}'}
+
+
+def test_rest_client_labels(github):
+    """Test the labels and assignees are added with one request."""
+    client = GitHubClient(github.url, "abcd1234")
+    client.create_pull_request(
+        "test-org/test-repo",
+        "dep-updates",
+        "develop",
+        "title",
+        "",
+        labels="dependencies",
+        assignees="abc123, efg456",
+        draft=True,
+    )
+    client.close()
+
+    assert [(r["method"], r["path"]) for r in github.requests] == [
+        ("POST", "/repos/test-org/test-repo/pulls"),
+        ("PATCH", "/repos/test-org/test-repo/issues/1"),
+    ]
+    assert github.pulls[0]["draft"] is True
+    assert github.pulls[0]["labels"] == ["dependencies"]
+    assert github.pulls[0]["assignees"] == ["abc123", "efg456"]
+
+
+def test_graphql_client(github):
+    """Test a PR is opened with its reviewers, labels and assignees in 3 requests,
+    the first time."""
+    client = GraphQLClient(github.url, "abcd1234")
+    assert client.can_push("test-org/test-repo")
+    github.requests.clear()
+    url = client.create_pull_request(
+        "test-org/test-repo",
+        "dep-updates",
+        "develop",
+        "title",
+        "abc123,test-org/maintainers,ghost",
+        labels="dependencies,missing",
+        assignees="efg456",
+        draft=True,
+    )
+    assert client.find_pull_request("test-org/test-repo", "dep-updates", "develop") == (
+        url
+    )
+    client.close()
+
+    assert url == "https://github.com/test-org/test-repo/pull/1"
+    assert github.connections == 1
+    assert [(r["method"], r["path"]) for r in github.requests] == [
+        ("POST", "/graphql")
+    ] * 4
+    assert github.pulls[0]["draft"] is True
+    assert github.pulls[0]["reviewers"] == ["abc123"]
+    assert github.pulls[0]["team_reviewers"] == ["test-org/maintainers"]
+    assert github.pulls[0]["labels"] == ["dependencies"]
+    assert github.pulls[0]["assignees"] == ["efg456"]
+
+    variables = {"o0": "ghost", "n0": "repo", "h0": "dep-updates", "b0": "develop"}
+    with pytest.raises(GitHubAPIError):
+        client.graphql("query FindMany { r0 }", variables)
+    assert client.graphql("query FindMany { r0 }", variables, True) == {"r0": None}
+    assert (
+        GraphQLClient("https://ghe.example.com/api/v3", "abc")._url_path("/graphql")
+        == "/api/graphql"
+    )
+    assert GraphQLClient(github.url, "abc")._url_path("/repos/a/b") == "/repos/a/b"
+
+
+def test_graphql_client_round_trips(github):
+    """Test the IDs are looked up once per client, and the mutations only sent
+    when needed."""
+    client = GraphQLClient(github.url, "abcd1234")
+    lookup = client.lookup("test-org/test-repo", "dep-updates", "develop", "abc123")
+    github.requests.clear()
+    client.create_pull_request(
+        "test-org/test-repo", "dep-updates", "develop", "title", "abc123"
+    )
+    assert len(github.requests) == 2
+    client.create_pull_request(
+        "test-org/test-repo", "dep-updates-numpy", "develop", "title", "abc123"
+    )
+    assert len(github.requests) == 4
+    client.create_pull_request(
+        "test-org/test-repo", "dep-updates-scipy", "develop", "title", "", lookup=lookup
+    )
+    assert len(github.requests) == 5
+    client.close()
+
+    assert [pull.get("reviewers") for pull in github.pulls] == [["abc123"]] * 2 + [None]
+
+
+def test_graphql_find_many(github):
+    """Test the PRs and issues of many repositories are found in one query."""
+    client = GraphQLClient(github.url, "abcd1234")
+    pull = client.create_pull_request("org/a", "dep-updates", "develop", "title", "")
+    client.create_issue("org/b", "title", "failed", FINGERPRINT_MARKER.format("abc"))
+    client.create_issue("org/b", "title", "unrelated")
+    github.requests.clear()
+    found = client.find_many(
+        [
+            ("org/a", "dep-updates", "develop"),
+            ("org/b", "dep-updates", "develop"),
+            ("ghost/c", "dep-updates", "develop"),
+        ],
+        FINGERPRINT_MARKER.format("abc"),
+    )
+    client.close()
+
+    assert found == {
+        "org/a": {"pull_request": pull, "issue": None},
+        "org/b": {
+            "pull_request": None,
+            "issue": "https://github.com/org/b/issues/1",
+        },
+    }
+    assert len(github.requests) == 1
+    assert client.find_many([]) == {}
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_push_branch_rest(github):
+    """Test submitting the PR through the REST API."""
+    git = Mock(spec=GitBackend)
+    git.changed_files.return_value = ["setup.cfg", "requirements.txt"]
+    conf = {"hub": dict(CONF["hub"], api_url=github.url)}
+    push_branch(conf, git)
+
+    git.push.assert_called_once_with(
+        "https://abcd1234@github.com/test-org/test-repo.git", "dep-updates"
+    )
+    assert github.pulls[0]["head"] == "dep-updates"
+    assert github.pulls[0]["base"] == "develop"
+    assert github.pulls[0]["title"] == (
+        "[EDGETEST] Updating test-repo dependency versions"
+    )
+    assert github.pulls[0]["reviewers"] == ["abc123", "efg456"]
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_create_issue_rest(github):
+    """Test opening the issue through the REST API."""
+    conf = {"hub": dict(CONF["hub"], api_url=github.url)}
+    create_issue("the report", conf)
+
+    assert github.issues[0]["title"] == "[EDGETEST] Issue updating dependencies"
+    assert github.issues[0]["body"].endswith("\n\nthe report")
+
+
+@pytest.mark.parametrize("mode", ["file", "comments"])
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_create_issue_artifact(github, tmp_path, mode):
+    """Test the issue points to the full report, or holds it in comments."""
+    conf = {
+        "hub": dict(
+            CONF["hub"], api_url=github.url, report_bytes=2048, report_artifact=mode
+        )
+    }
+    testers = [FakeTester(f"env{i}", False, {"pandas": "2.0.0"}) for i in range(500)]
+    report = build_report(testers, 2048, artifact_dir=tmp_path, name="abc")
+    create_issue(report.summary, conf, fingerprint="abc", artifact=report.artifact)
+
+    body = github.issues[0]["body"]
+    comments = github.issues[0].get("comments", [])
+    assert len(body) < 2048 + 512
+    if mode == "file":
+        assert f"The full report and logs are in `{report.artifact}`" in body
+        assert comments == []
+    else:
+        assert "The full report and logs follow in the comments." in body
+        assert len(comments) == 10
+        assert comments[0].startswith("Full report, part 1:\n\n````\n")
+        assert "| env0 | True | False | pandas |  | 2.0.0 |" in comments[0]
+        assert all(len(comment) <= 2048 for comment in comments)
+
+
+def _tester(envname, status, packages, setup_status=True):
+    """Build a stand-in for an edgetest tester."""
+    tester = Mock(envname=envname, status=status, setup_status=setup_status)
+    tester.upgraded_packages.return_value = [
+        {"name": name, "version": version} for name, version in packages
+    ]
+    return tester
+
+
+def test_failure_fingerprint():
+    """Test the fingerprint only depends on the failing environments and versions."""
+    first = failure_fingerprint(
+        [
+            _tester("a", False, [("pandas", "2.0.0"), ("numpy", "1.0")]),
+            _tester("b", True, []),
+        ]
+    )
+    same = failure_fingerprint(
+        [
+            _tester("b", True, [("scipy", "1.0")]),
+            _tester("a", False, [("numpy", "1.0"), ("pandas", "2.0.0")]),
+        ]
+    )
+    newer = failure_fingerprint(
+        [_tester("a", False, [("pandas", "2.0.1"), ("numpy", "1.0")])]
+    )
+    broken = _tester("a", False, [], setup_status=False)
+    broken.upgraded_packages.side_effect = RuntimeError("no environment")
+    broken.upgrade = ["pandas"]
+
+    assert first == same
+    assert first != newer
+    assert len({first, failure_fingerprint([broken])}) == 2
+
+
+def test_failure_fingerprint_old_tester():
+    """Test a tester without ``setup_status``, as in older edgetest releases."""
+    tester = Mock(spec=["envname", "status", "upgraded_packages"])
+    tester.envname, tester.status = "a", False
+    tester.upgraded_packages.return_value = [{"name": "pandas", "version": "2.0.0"}]
+
+    assert failure_fingerprint([tester]) != failure_fingerprint(
+        [_tester("a", False, [("pandas", "2.0.0")])]
+    )
+
+
+@pytest.mark.parametrize(
+    "dedupe, issues, comments", [("skip", 1, 0), ("comment", 1, 1), ("off", 2, 0)]
+)
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_create_issue_dedupe(github, dedupe, issues, comments):
+    """Test an open issue with the same fingerprint is reused."""
+    conf = {"hub": dict(CONF["hub"], api_url=github.url, issue_dedupe=dedupe)}
+    create_issue("the report", conf, fingerprint="abc")
+    create_issue("the report", conf, fingerprint="abc")
+    create_issue("other report", conf, fingerprint="def")
+
+    assert len(github.issues) == issues + 1
+    assert github.issues[0]["body"].endswith(FINGERPRINT_MARKER.format("abc"))
+    assert len(github.issues[0].get("comments", [])) == comments
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_push_branch_update_existing(github):
+    """Test an existing PR is updated in place with a force-with-lease push."""
+    github.pulls.append(
+        {
+            "number": 1,
+            "state": "open",
+            "head": "dep-updates",
+            "base": "develop",
+            "html_url": "https://github.com/test-org/test-repo/pull/1",
+        }
+    )
+    git = Mock(spec=GitBackend)
+    git.changed_files.return_value = ["setup.cfg", "requirements.txt"]
+    git.remote_head.return_value = "abc123"
+    conf = {"hub": dict(CONF["hub"], api_url=github.url, update_strategy="update")}
+    push_branch(conf, git)
+
+    git.push.assert_called_once_with(
+        "https://abcd1234@github.com/test-org/test-repo.git",
+        "dep-updates",
+        lease="abc123",
+    )
+    assert len(github.pulls) == 1
+    assert [r["method"] for r in github.requests] == ["GET"]
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_push_branch_update_new(github):
+    """Test a PR is opened if there is no existing one to update."""
+    git = Mock(spec=GitBackend)
+    git.changed_files.return_value = ["setup.cfg", "requirements.txt"]
+    git.remote_head.return_value = None
+    conf = {"hub": dict(CONF["hub"], api_url=github.url, update_strategy="update")}
+    push_branch(conf, git)
+
+    git.push.assert_called_once_with(
+        "https://abcd1234@github.com/test-org/test-repo.git", "dep-updates", lease=""
+    )
+    assert len(github.pulls) == 1
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_submit_update_concurrent(github):
+    """Test the remote branch deletion overlaps with the local branch setup."""
+    git = Mock(spec=GitBackend)
+    git.changed_files.return_value = ["setup.cfg"]
+    git.delete_remote_branch.side_effect = lambda *args: time.sleep(0.3)
+    git.checkout_branch.side_effect = lambda *args: time.sleep(0.3)
+    conf = {
+        "hub": dict(
+            CONF["hub"],
+            api_url=github.url,
+            git_username="Jenkins",
+            git_useremail="noreply@capitalone.com",
+            concurrency=2,
+        )
+    }
+    start = time.monotonic()
+    with patch("edgetest_hub.plugin._get_git_backend", return_value=git):
+        submit_update(conf)
+
+    assert time.monotonic() - start < 0.55
+    git.push.assert_called_once_with(
+        "https://abcd1234@github.com/test-org/test-repo.git", "dep-updates"
+    )
+    assert [(r["method"], r["path"]) for r in github.requests] == [
+        ("POST", "/repos/test-org/test-repo/pulls"),
+        ("POST", "/repos/test-org/test-repo/pulls/1/requested_reviewers"),
+    ]
+
+
+@pytest.mark.parametrize("update", [False, True])
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_push_branch_graphql(github, update):
+    """Test the GraphQL client opens the PR with 3 requests, and finds it with 1."""
+    git = Mock(spec=GitBackend)
+    git.changed_files.return_value = ["setup.cfg"]
+    git.remote_head.return_value = None
+    conf = {
+        "hub": dict(
+            CONF["hub"],
+            api_url=github.url,
+            github_client="graphql",
+            update_strategy="update" if update else "recreate",
+            pr_labels="dependencies",
+            pr_assignees="abc123",
+            pr_draft=True,
+            concurrency=4,
+        )
+    }
+    push_branch(conf, git)
+    assert len(github.requests) == 3
+    assert github.pulls[0]["reviewers"] == ["abc123", "efg456"]
+    assert github.pulls[0]["labels"] == ["dependencies"]
+    assert github.pulls[0]["draft"] is True
+
+    github.requests.clear()
+    push_branch(conf, git)
+    assert len(github.pulls) == 1 if update else 2
+    assert len(github.requests) == 1 if update else 3
@@ -1,6 +1,8 @@
 """Test the hub hook."""
 import logging
 import os
+import time
+from concurrent.futures import Future
 from pathlib import Path
 from unittest.mock import PropertyMock, call, patch
 
@@ -10,7 +12,21 @@ from edgetest.interface import cli
 from edgetest.schema import EdgetestValidator, Schema
 from edgetest.utils import parse_cfg
 
-from edgetest_hub.plugin import addoption, create_issue
+from edgetest_hub.backends import GitBackend, blob_id
+from edgetest_hub.lease import Lease
+from edgetest_hub.plugin import (
+    _PREFETCH,
+    _collect_prefetch,
+    addoption,
+    apply_packages,
+    create_issue,
+    post_run_hook,
+    pre_run_hook,
+    split_groups,
+)
+from edgetest_hub.utils import CommandTimeoutError, _run_command, command_timeouts
+from tests.conftest import FakeTester, hub_conf, run_git
+from tests.github_server import FakeGitHub
 
 CFG = """
 [edgetest.envs.myenv]
@@ -60,6 +76,100 @@ command =
     pytest tests -m 'not integration'
 """
 
+CFG_HUB_UPDATE = """
+[edgetest.hub]
+git_repo_org = test-org
+git_repo_name = test-repo
+pr_reviewers = abc123,efg456
+open_issue_on_fail = True
+update_strategy = update
+[edgetest.envs.myenv]
+upgrade =
+    myupgrade
+command =
+    pytest tests -m 'not integration'
+"""
+
+CFG_HUB_SKIP = """
+[edgetest.hub]
+git_repo_org = test-org
+git_repo_name = test-repo
+pr_reviewers = abc123,efg456
+open_issue_on_fail = True
+skip_unchanged = True
+[edgetest.envs.myenv]
+upgrade =
+    myupgrade
+command =
+    pytest tests -m 'not integration'
+"""
+
+CFG_HUB_PLUMBING = """
+[edgetest.hub]
+git_repo_org = test-org
+git_repo_name = test-repo
+pr_reviewers = abc123,efg456
+open_issue_on_fail = True
+commit_mode = plumbing
+[edgetest.envs.myenv]
+upgrade =
+    myupgrade
+command =
+    pytest tests -m 'not integration'
+"""
+
+CFG_HUB_OPTIONS = """
+[edgetest.hub]
+git_repo_org = test-org
+git_repo_name = test-repo
+pr_reviewers = abc123,efg456
+open_issue_on_fail = True
+git_backend = pygit2
+github_client = rest
+api_url = http://127.0.0.1:8080
+pr_labels = dependencies
+pr_assignees = abc123
+pr_draft = True
+concurrency = 4
+command_timeout = 120
+api_rate = 0.5
+api_retries = 3
+issue_dedupe = comment
+report_bytes = 30000
+report_logs = .edgetest/{env}.log
+report_dir = .edgetest/reports
+report_artifact = comments
+state_path = ~/.cache/edgetest-hub/state.sqlite
+state_retention_days = 7
+deadline = 900
+prefetch = True
+trace_path = edgetest-hub-trace.json
+metrics_dir = /var/lib/node_exporter/textfile_collector
+spool_dir = ~/.cache/edgetest-hub/spool
+spool_retries = 3
+cassette_path = edgetest-hub-cassette.jsonl
+cassette_mode = replay
+split_prs = package
+split_concurrency = 2
+lease = True
+lease_wait = 300
+lease_ttl = 1800
+lease_dir = ~/.cache/edgetest-hub/locks
+[edgetest.envs.myenv]
+upgrade =
+    myupgrade
+command =
+    pytest tests -m 'not integration'
+"""
+
+# fingerprint of ``myenv`` failing with ``myupgrade==0.2.0``
+FINGERPRINT = "148668ff9498ea84"
+
+GIT_STATUS_CHANGED = (
+    "1 .M N... 100644 100644 100644 abc abc setup.cfg\0"
+    "1 .M N... 100644 100644 100644 abc abc requirements.txt\0"
+)
+
 PIP_LIST = """
 [{"name": "myupgrade", "version": "0.2.0"}]
 """
@@ -75,7 +185,7 @@ myenv          True                True             myupgrade
 """
 
 
-@pytest.mark.parametrize("config", [CFG, CFG_HUB_ISSUE_TRUE])
+@pytest.mark.parametrize("config", [CFG, CFG_HUB_ISSUE_TRUE, CFG_HUB_OPTIONS])
 def test_addoption(config, tmpdir):
     """Test the addoption hook."""
     location = tmpdir.mkdir("mylocation")
@@ -105,7 +215,7 @@ def test_hub_notoken(mock_popen, mock_cpopen, mock_builder, mock_run_command):
 
     runner = CliRunner()
 
-    with runner.isolated_filesystem() as loc:
+    with runner.isolated_filesystem():
         with open("setup.cfg", "w") as outfile:
             outfile.write(CFG_HUB_ISSUE_TRUE)
 
@@ -127,26 +237,61 @@ def test_hub_withtoken_nopr(mock_popen, mock_cpopen, mock_builder, mock_run_comm
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
-    mock_run_command.side_effect = [(None, None)] * 10  # 10 calls
+    mock_run_command.side_effect = [("", 0)]
     expected_calls_no_pr = [
-        call("git", "config", "user.name", "Jenkins"),
-        call("git", "config", "user.email", "noreply@capitalone.com"),
         call(
             "git",
-            "remote",
-            "set-url",
-            "origin",
-            "https://abcd1234@github.com/test-org/test-repo.git",
+            "status",
+            "--porcelain=v2",
+            "-z",
+            "--untracked-files=no",
+            "--",
+            "setup.cfg",
+            "requirements.txt",
         ),
-        call("git", "config", "--global", "hub.protocol", "https"),
+    ]
+
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        with open("setup.cfg", "w") as outfile:
+            outfile.write(CFG_HUB_ISSUE_TRUE)
+
+        runner.invoke(cli, ["--config=setup.cfg"])
+
+    assert mock_run_command.called is True
+    assert mock_run_command.mock_calls == expected_calls_no_pr
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+@patch("edgetest_hub.plugin._run_command", autospec=True)
+@patch("edgetest.lib.EnvBuilder", autospec=True)
+@patch("edgetest.core.Popen", autospec=True)
+@patch("edgetest.utils.Popen", autospec=True)
+def test_hub_withtoken_withpr(mock_popen, mock_cpopen, mock_builder, mock_run_command):
+    """Test hub and git in setting up PR of changes."""
+    mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
+    mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
+
+    mock_run_command.side_effect = [
+        (GIT_STATUS_CHANGED, 0),
+        ("", 0),
+        *[(None, None)] * 8,
+    ]
+    expected_calls_with_pr = [
         call(
             "git",
-            "config",
-            "--global",
-            "--add",
-            "hub.host",
-            "github.com",
+            "status",
+            "--porcelain=v2",
+            "-z",
+            "--untracked-files=no",
+            "--",
+            "setup.cfg",
+            "requirements.txt",
         ),
+        call("git", "rev-parse", "--show-prefix"),
         call(
             "git",
             "push",
@@ -157,19 +302,37 @@ def test_hub_withtoken_nopr(mock_popen, mock_cpopen, mock_builder, mock_run_comm
         call("git", "branch", "-D", "dep-updates"),
         call("git", "clean", "-fd"),
         call("git", "checkout", "-b", "dep-updates", "develop"),
-        call("git", "diff-index", "--quiet", "HEAD"),
+        call("git", "add", "setup.cfg", "requirements.txt"),
+        call("git", "commit", "-m", "environmentally friendly"),
+        call(
+            "git",
+            "push",
+            "https://abcd1234@github.com/test-org/test-repo.git",
+            "dep-updates",
+        ),
+        call(
+            "hub",
+            "pull-request",
+            "-b",
+            "develop",
+            "-m",
+            "[EDGETEST] Updating test-repo dependency versions",
+            "-r",
+            "abc123,efg456",
+            "--push",
+        ),
     ]
 
     runner = CliRunner()
 
-    with runner.isolated_filesystem() as loc:
+    with runner.isolated_filesystem():
         with open("setup.cfg", "w") as outfile:
             outfile.write(CFG_HUB_ISSUE_TRUE)
 
-        result = runner.invoke(cli, ["--config=setup.cfg"])
+        runner.invoke(cli, ["--config=setup.cfg"])
 
     assert mock_run_command.called is True
-    assert mock_run_command.mock_calls == expected_calls_no_pr
+    assert mock_run_command.mock_calls == expected_calls_with_pr
 
 
 @patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
@@ -177,35 +340,164 @@ def test_hub_withtoken_nopr(mock_popen, mock_cpopen, mock_builder, mock_run_comm
 @patch("edgetest.lib.EnvBuilder", autospec=True)
 @patch("edgetest.core.Popen", autospec=True)
 @patch("edgetest.utils.Popen", autospec=True)
-def test_hub_withtoken_withpr(mock_popen, mock_cpopen, mock_builder, mock_run_command):
-    """Test hub and git in setting up PR of changes."""
+def test_hub_withtoken_update(mock_popen, mock_cpopen, mock_builder, mock_run_command):
+    """Test updating the existing branch and PR in place."""
     mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
     mock_run_command.side_effect = (
-        [(None, None)] * 9 + [RuntimeError()] + [(None, None)] * 4
-    )  # 14 calls
-    expected_calls_with_pr = [
-        call("git", "config", "user.name", "Jenkins"),
-        call("git", "config", "user.email", "noreply@capitalone.com"),
+        [(GIT_STATUS_CHANGED, 0), ("", 0)]
+        + [(None, None)] * 5
+        + [("abc123\trefs/heads/dep-updates\n", 0)]
+        + [(None, None)]
+        + [("https://github.com/test-org/test-repo/pull/1\n", 0)]
+    )  # 9 calls
+    expected_calls_update = [
         call(
             "git",
-            "remote",
-            "set-url",
-            "origin",
+            "status",
+            "--porcelain=v2",
+            "-z",
+            "--untracked-files=no",
+            "--",
+            "setup.cfg",
+            "requirements.txt",
+        ),
+        call("git", "rev-parse", "--show-prefix"),
+        call("git", "branch", "-D", "dep-updates"),
+        call("git", "clean", "-fd"),
+        call("git", "checkout", "-b", "dep-updates", "develop"),
+        call("git", "add", "setup.cfg", "requirements.txt"),
+        call("git", "commit", "-m", "environmentally friendly"),
+        call(
+            "git",
+            "ls-remote",
             "https://abcd1234@github.com/test-org/test-repo.git",
+            "refs/heads/dep-updates",
         ),
-        call("git", "config", "--global", "hub.protocol", "https"),
         call(
             "git",
-            "config",
-            "--global",
-            "--add",
-            "hub.host",
-            "github.com",
+            "push",
+            "--force-with-lease=refs/heads/dep-updates:abc123",
+            "https://abcd1234@github.com/test-org/test-repo.git",
+            "dep-updates",
         ),
+        call("hub", "pr", "list", "-h", "dep-updates", "-b", "develop", "-f", "%U%n"),
+    ]
+
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        with open("setup.cfg", "w") as outfile:
+            outfile.write(CFG_HUB_UPDATE)
+
+        runner.invoke(cli, ["--config=setup.cfg"])
+
+    assert mock_run_command.mock_calls == expected_calls_update
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+@patch("edgetest_hub.plugin._run_command", autospec=True)
+@patch("edgetest.lib.EnvBuilder", autospec=True)
+@patch("edgetest.core.Popen", autospec=True)
+@patch("edgetest.utils.Popen", autospec=True)
+def test_hub_withtoken_unchanged(
+    mock_popen, mock_cpopen, mock_builder, mock_run_command
+):
+    """Test skipping the run when the remote branch has the same files."""
+    mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
+    mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
+
+    ls_tree = f"100644 blob {blob_id(CFG_HUB_SKIP.encode())}\tsetup.cfg\n"
+    mock_run_command.side_effect = [
+        (GIT_STATUS_CHANGED, 0),
+        ("", 0),
+        (None, None),
+        (ls_tree, 0),
+    ]
+    expected_calls_unchanged = [
+        call(
+            "git",
+            "status",
+            "--porcelain=v2",
+            "-z",
+            "--untracked-files=no",
+            "--",
+            "setup.cfg",
+            "requirements.txt",
+        ),
+        call("git", "rev-parse", "--show-prefix"),
+        call(
+            "git",
+            "fetch",
+            "--no-tags",
+            "https://abcd1234@github.com/test-org/test-repo.git",
+            "refs/heads/dep-updates",
+        ),
+        call(
+            "git",
+            "ls-tree",
+            "--full-tree",
+            "FETCH_HEAD",
+            "--",
+            "setup.cfg",
+            "requirements.txt",
+        ),
+    ]
+
+    runner = CliRunner()
+
+    with runner.isolated_filesystem():
+        with open("setup.cfg", "w", newline="") as outfile:
+            outfile.write(CFG_HUB_SKIP)
+
+        result = runner.invoke(cli, ["--config=setup.cfg"])
+
+    assert result.exit_code == 0
+    assert mock_run_command.mock_calls == expected_calls_unchanged
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+@patch("edgetest_hub.plugin._run_command", autospec=True)
+@patch("edgetest.lib.EnvBuilder", autospec=True)
+@patch("edgetest.core.Popen", autospec=True)
+@patch("edgetest.utils.Popen", autospec=True)
+def test_hub_withtoken_plumbing(
+    mock_popen, mock_cpopen, mock_builder, mock_run_command
+):
+    """Test committing through git plumbing without a checkout."""
+    mock_popen.return_value.communicate.return_value = (PIP_LIST, "error")
+    type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
+    mock_cpopen.return_value.communicate.return_value = ("output", "error")
+    type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
+
+    mock_run_command.side_effect = [
+        ("1 .M N... 100644 100644 100644 abc abc setup.cfg\0", 0),
+        ("", 0),
+        *[(None, None)] * 1,
+        ("base\n", 0),
+        ("blob\n", 0),
+        ("100644 blob old\tsetup.cfg\x00040000 tree docs\tdocs\x00", 0),
+        ("tree\n", 0),
+        ("commit\n", 0),
+        *[(None, None)] * 3,
+    ]
+    expected_calls_plumbing = [
+        call(
+            "git",
+            "status",
+            "--porcelain=v2",
+            "-z",
+            "--untracked-files=no",
+            "--",
+            "setup.cfg",
+            "requirements.txt",
+        ),
+        call("git", "rev-parse", "--show-prefix"),
         call(
             "git",
             "push",
@@ -213,36 +505,48 @@ def test_hub_withtoken_withpr(mock_popen, mock_cpopen, mock_builder, mock_run_co
             "--delete",
             "dep-updates",
         ),
-        call("git", "branch", "-D", "dep-updates"),
-        call("git", "clean", "-fd"),
-        call("git", "checkout", "-b", "dep-updates", "develop"),
-        call("git", "diff-index", "--quiet", "HEAD"),
-        call("git", "add", "setup.cfg", "requirements.txt"),
-        call("git", "commit", "-m", "environmentally friendly"),
-        call("git", "push", "origin", "dep-updates"),
+        call("git", "rev-parse", "--verify", "develop^{commit}"),
+        call("git", "hash-object", "-w", "--", "setup.cfg"),
+        call("git", "ls-tree", "--full-tree", "-z", "base"),
+        call(
+            "git",
+            "mktree",
+            "-z",
+            stdin="100644 blob blob\tsetup.cfg\x00040000 tree docs\tdocs\x00",
+        ),
+        call(
+            "git", "commit-tree", "tree", "-p", "base", "-m", "environmentally friendly"
+        ),
+        call("git", "update-ref", "refs/heads/dep-updates", "commit"),
+        call(
+            "git",
+            "push",
+            "https://abcd1234@github.com/test-org/test-repo.git",
+            "dep-updates",
+        ),
         call(
             "hub",
             "pull-request",
             "-b",
             "develop",
+            "-h",
+            "dep-updates",
             "-m",
             "[EDGETEST] Updating test-repo dependency versions",
             "-r",
             "abc123,efg456",
-            "--push",
         ),
     ]
 
     runner = CliRunner()
 
-    with runner.isolated_filesystem() as loc:
+    with runner.isolated_filesystem():
         with open("setup.cfg", "w") as outfile:
-            outfile.write(CFG_HUB_ISSUE_TRUE)
+            outfile.write(CFG_HUB_PLUMBING)
 
-        result = runner.invoke(cli, ["--config=setup.cfg"])
+        runner.invoke(cli, ["--config=setup.cfg"])
 
-    assert mock_run_command.called is True
-    assert mock_run_command.mock_calls == expected_calls_with_pr
+    assert mock_run_command.mock_calls == expected_calls_plumbing
 
 
 @patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
@@ -257,26 +561,23 @@ def test_hub_custom_url(mock_popen, mock_cpopen, mock_builder, mock_run_command)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
 
-    mock_run_command.side_effect = [(None, None)] * 10  # 10 calls
-    expected_calls_no_pr = [
-        call("git", "config", "user.name", "Jenkins"),
-        call("git", "config", "user.email", "noreply@capitalone.com"),
-        call(
-            "git",
-            "remote",
-            "set-url",
-            "origin",
-            "https://abcd1234@mycustomgit.com/test-org/test-repo.git",
-        ),
-        call("git", "config", "--global", "hub.protocol", "https"),
+    mock_run_command.side_effect = [
+        (GIT_STATUS_CHANGED, 0),
+        ("", 0),
+        *[(None, None)] * 8,
+    ]
+    expected_calls_with_pr = [
         call(
             "git",
-            "config",
-            "--global",
-            "--add",
-            "hub.host",
-            "mycustomgit.com",
+            "status",
+            "--porcelain=v2",
+            "-z",
+            "--untracked-files=no",
+            "--",
+            "setup.cfg",
+            "requirements.txt",
         ),
+        call("git", "rev-parse", "--show-prefix"),
         call(
             "git",
             "push",
@@ -287,19 +588,37 @@ def test_hub_custom_url(mock_popen, mock_cpopen, mock_builder, mock_run_command)
         call("git", "branch", "-D", "dep-updates"),
         call("git", "clean", "-fd"),
         call("git", "checkout", "-b", "dep-updates", "develop"),
-        call("git", "diff-index", "--quiet", "HEAD"),
+        call("git", "add", "setup.cfg", "requirements.txt"),
+        call("git", "commit", "-m", "environmentally friendly"),
+        call(
+            "git",
+            "push",
+            "https://abcd1234@mycustomgit.com/test-org/test-repo.git",
+            "dep-updates",
+        ),
+        call(
+            "hub",
+            "pull-request",
+            "-b",
+            "develop",
+            "-m",
+            "[EDGETEST] Updating test-repo dependency versions",
+            "-r",
+            "abc123,efg456",
+            "--push",
+        ),
     ]
 
     runner = CliRunner()
 
-    with runner.isolated_filesystem() as loc:
+    with runner.isolated_filesystem():
         with open("setup.cfg", "w") as outfile:
             outfile.write(CFG_HUB_URL)
 
-        result = runner.invoke(cli, ["--config=setup.cfg"])
+        runner.invoke(cli, ["--config=setup.cfg"])
 
     assert mock_run_command.called is True
-    assert mock_run_command.mock_calls == expected_calls_no_pr
+    assert mock_run_command.mock_calls == expected_calls_with_pr
 
 
 @patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
@@ -313,16 +632,18 @@ def test_hub_issue(mock_popen, mock_cpopen, mock_builder, mock_run_command):
     type(mock_popen.return_value).returncode = PropertyMock(return_value=0)
     mock_cpopen.return_value.communicate.return_value = ("output", "error")
     type(mock_cpopen.return_value).returncode = PropertyMock(return_value=0)
+    mock_run_command.return_value = ("[]", 0)
 
     runner = CliRunner()
 
-    with runner.isolated_filesystem() as loc:
+    with runner.isolated_filesystem():
         with open("setup.cfg", "w") as outfile:
             outfile.write(CFG_HUB_ISSUE_TRUE)
 
-        result = runner.invoke(cli, ["--config=setup.cfg", "--notest"])
+        runner.invoke(cli, ["--config=setup.cfg", "--notest"])
 
     expected_call = [
+        call("hub", "api", "repos/test-org/test-repo/issues?state=open&per_page=100"),
         call(
             "hub",
             "issue",
@@ -333,9 +654,11 @@ def test_hub_issue(mock_popen, mock_cpopen, mock_builder, mock_run_command):
             "Edgetest ran, but there were some issues with the tests passing. Edgetest created an issue to let you know.",
             "--message",
             "| Environment   | Setup successful   | Passing tests   | Upgraded packages   | Lowered packages   | Package version   |\n|---------------|--------------------|-----------------|---------------------|--------------------|-------------------|\n| myenv         | True               | False           | myupgrade           |                    | 0.2.0             |",
-        )
+            "--message",
+            f"<!-- edgetest-hub fingerprint: {FINGERPRINT} -->",
+        ),
     ]
-    mock_run_command.assert_has_calls(expected_call)
+    assert mock_run_command.mock_calls == expected_call
 
 
 @patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
@@ -352,11 +675,11 @@ def test_hub_issue_false(mock_popen, mock_cpopen, mock_builder, mock_run_command
 
     runner = CliRunner()
 
-    with runner.isolated_filesystem() as loc:
+    with runner.isolated_filesystem():
         with open("setup.cfg", "w") as outfile:
             outfile.write(CFG_HUB_ISSUE_FALSE)
 
-        result = runner.invoke(cli, ["--config=setup.cfg", "--notest"])
+        runner.invoke(cli, ["--config=setup.cfg", "--notest"])
 
     mock_run_command.assert_not_called()
 
@@ -375,3 +698,278 @@ def test_hub_issue_logging_and_exception(mock_run_command, caplog):
         create_issue("test")
     assert mock_run_command.called
     assert "There was a problem creating an Issue." in caplog.text
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+@patch("edgetest_hub.plugin._run_command", autospec=True)
+def test_hub_timeout(mock_run_command, caplog):
+    """Test a timed out command stops the plugin with a log line."""
+    mock_run_command.side_effect = [
+        (GIT_STATUS_CHANGED, 0),
+        ("", 0),
+        CommandTimeoutError("git push", 600),
+    ]
+    tester = type("Tester", (), {"status": True})()
+    conf = hub_conf(command_timeout=600)
+    with caplog.at_level(logging.INFO):
+        post_run_hook([tester], conf)
+
+    assert mock_run_command.call_count == 3
+    assert "timed out after 600.0s running git push" in caplog.text
+    assert "Stopping the Hub plugin." in caplog.text
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+@patch("edgetest_hub.plugin._run_command", autospec=True)
+def test_hub_prefetch(mock_run_command):
+    """Test the remote lookups started before the tests are not run again."""
+
+    def run_command(*args, stdin=None):
+        if args[1] == "status":
+            return GIT_STATUS_CHANGED, 0
+        if args[1] == "ls-remote":
+            return "abc123\trefs/heads/dep-updates\n", 0
+        return "", 0
+
+    mock_run_command.side_effect = run_command
+    tester = type("Tester", (), {"status": True})()
+    with FakeGitHub() as github:
+        conf = hub_conf(
+            open_issue_on_fail=True,
+            github_client="rest",
+            api_url=github.url,
+            update_strategy="update",
+            prefetch=True,
+        )
+        pre_run_hook(conf)
+        post_run_hook([tester], conf)
+
+    ls_remote = call(
+        "git",
+        "ls-remote",
+        "https://abcd1234@github.com/test-org/test-repo.git",
+        "refs/heads/dep-updates",
+    )
+    assert mock_run_command.mock_calls.count(ls_remote) == 1
+    assert mock_run_command.mock_calls.index(ls_remote) < [
+        c.args[1] for c in mock_run_command.mock_calls
+    ].index("push")
+    assert [(r["method"], r["path"].split("?")[0]) for r in github.requests] == [
+        ("GET", "/repos/test-org/test-repo"),
+        ("GET", "/repos/test-org/test-repo/pulls"),
+        ("POST", "/repos/test-org/test-repo/pulls"),
+        ("POST", "/repos/test-org/test-repo/pulls/1/requested_reviewers"),
+    ]
+
+
+def test_collect_prefetch_deadline(caplog):
+    """Test the lookups ahead of time are not waited for past the deadline."""
+    conf = {"hub": {}}
+    _PREFETCH[id(conf)] = Future()
+    start = time.monotonic()
+    with caplog.at_level(logging.INFO), command_timeouts(budget=0.2):
+        assert _collect_prefetch(conf) == {}
+    assert time.monotonic() - start < 5
+    assert "still running" in caplog.text
+    assert id(conf) not in _PREFETCH
+
+    _PREFETCH[id(conf)] = Future()
+    _PREFETCH[id(conf)].set_result({"remote_head": None})
+    assert _collect_prefetch(conf) == {"remote_head": None}
+
+
+def test_split_groups():
+    """Test the packages are grouped by package or by passing environment."""
+    testers = [
+        FakeTester("core", True, {"pandas": "2.0.0"}),
+        FakeTester("broken", False, {"numpy": "2.0.0"}),
+        FakeTester("all", True, {"pandas": "2.0.0", "Scikit_Learn": "1.5.0"}),
+    ]
+    assert split_groups(testers, "package") == {
+        "pandas": {"pandas": "2.0.0"},
+        "Scikit_Learn": {"Scikit_Learn": "1.5.0"},
+    }
+    assert split_groups(testers, "environment") == {
+        "core": {"pandas": "2.0.0"},
+        "all": {"pandas": "2.0.0", "Scikit_Learn": "1.5.0"},
+    }
+
+    base = (
+        "[options]\ninstall_requires =\n    pandas==1.0.0\n    scikit-learn<=1.0\n"
+        "    numpy\npython_requires = >=3.8\n"
+    )
+    updated = (
+        "[options]\ninstall_requires =\n    pandas<=2.0.0,>=1.0.0\n"
+        "    scikit-learn<=1.5.0\n    numpy<=2.0.0\npython_requires = >=3.8\n"
+    )
+    assert apply_packages(base, updated, ["scikit_learn"]) == base.replace(
+        "scikit-learn<=1.0", "scikit-learn<=1.5.0"
+    )
+    assert apply_packages(base, updated, ["pandas", "numpy"]) == (
+        "[options]\ninstall_requires =\n    pandas<=2.0.0,>=1.0.0\n"
+        "    scikit-learn<=1.0\n    numpy<=2.0.0\npython_requires = >=3.8\n"
+    )
+    assert apply_packages(base, updated, ["missing"]) == base
+
+
+@pytest.fixture
+def hub_origin(tmp_path, monkeypatch):
+    """Clone a bare ``test-org/test-repo``, change its requirements and chdir into it.
+
+    Pushes to ``https://github.com/test-org/`` go to the bare repository.
+    """
+    origin, repo = tmp_path / "origins" / "test-repo.git", tmp_path / "repo"
+    run_git("init", "--bare", "--initial-branch=develop", str(origin), cwd=tmp_path)
+    run_git("clone", "--quiet", str(origin), str(repo), cwd=tmp_path)
+    (repo / "requirements.txt").write_text("pandas==1.0.0\nnumpy==1.0.0\nscipy\n")
+    run_git("add", ".", cwd=repo)
+    run_git(
+        "-c", "user.name=T", "-c", "user.email=t@t", "commit", "-m", "init", cwd=repo
+    )
+    run_git("push", "--quiet", "origin", "develop", cwd=repo)
+    (repo / "requirements.txt").write_text(
+        "pandas<=2.0.0,>=1.0.0\nnumpy<=2.0.0,>=1.0.0\nscipy\n"
+    )
+
+    monkeypatch.setenv("GITHUB_TOKEN", "abcd1234")
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    monkeypatch.setenv(
+        "GIT_CONFIG_KEY_0", f"url.{(tmp_path / 'origins').as_uri()}/.insteadOf"
+    )
+    monkeypatch.setenv("GIT_CONFIG_VALUE_0", "https://abcd1234@github.com/test-org/")
+    monkeypatch.chdir(repo)
+    return origin, repo
+
+
+def _split_conf(api_url, **options):
+    """Build a configuration submitting one PR per package to the fake GitHub."""
+    return hub_conf(
+        **{
+            "open_issue_on_fail": False,
+            "github_client": "rest",
+            "api_url": api_url,
+            "split_prs": "package",
+            "split_concurrency": 2,
+            **options,
+        }
+    )
+
+
+def test_hub_split(hub_origin):
+    """Test a branch and PR is submitted for each upgraded package."""
+    origin, repo = hub_origin
+    tester = FakeTester("all", True, {"pandas": "2.0.0", "numpy": "2.0.0"})
+    with FakeGitHub() as github:
+        post_run_hook([tester], _split_conf(github.url))
+
+    assert sorted((pull["head"], pull["title"]) for pull in github.pulls) == [
+        ("dep-updates-numpy", "[EDGETEST] Updating numpy to 2.0.0"),
+        ("dep-updates-pandas", "[EDGETEST] Updating pandas to 2.0.0"),
+    ]
+    assert run_git("show", "dep-updates-pandas:requirements.txt", cwd=origin) == (
+        "pandas<=2.0.0,>=1.0.0\nnumpy==1.0.0\nscipy"
+    )
+    assert run_git("show", "dep-updates-numpy:requirements.txt", cwd=origin) == (
+        "pandas==1.0.0\nnumpy<=2.0.0,>=1.0.0\nscipy"
+    )
+    assert run_git(
+        "log", "-1", "--format=%P", "dep-updates-numpy", cwd=origin
+    ) == run_git("rev-parse", "develop", cwd=origin)
+    assert run_git("status", "--porcelain", cwd=repo) == "M requirements.txt"
+    assert run_git("branch", "--show-current", cwd=repo) == "develop"
+
+
+@pytest.fixture
+def hub_subdirectory(hub_origin, monkeypatch):
+    """Add a package in ``pkg/`` to the ``hub_origin`` repository and chdir into it."""
+    origin, repo = hub_origin
+    (repo / "pkg").mkdir()
+    (repo / "pkg" / "requirements.txt").write_text("pandas==1.0.0\nnumpy==1.0.0\n")
+    run_git("add", "pkg", cwd=repo)
+    run_git(
+        "-c", "user.name=T", "-c", "user.email=t@t", "commit", "-m", "pkg", cwd=repo
+    )
+    run_git("push", "--quiet", "origin", "develop", cwd=repo)
+    (repo / "pkg" / "requirements.txt").write_text(
+        "pandas<=2.0.0,>=1.0.0\nnumpy<=2.0.0,>=1.0.0\n"
+    )
+    monkeypatch.chdir(repo / "pkg")
+    return origin, repo
+
+
+@pytest.mark.parametrize("commit_mode", ["checkout", "worktree", "plumbing"])
+def test_hub_subdirectory(commit_mode, hub_subdirectory):
+    """Test only the files of the working directory are committed."""
+    origin, _ = hub_subdirectory
+    tester = FakeTester("all", True, {"pandas": "2.0.0", "numpy": "2.0.0"})
+    with FakeGitHub() as github:
+        post_run_hook(
+            [tester], _split_conf(github.url, split_prs="off", commit_mode=commit_mode)
+        )
+
+    assert [pull["head"] for pull in github.pulls] == ["dep-updates"]
+    assert run_git("ls-tree", "-r", "--name-only", "dep-updates", cwd=origin) == (
+        "pkg/requirements.txt\nrequirements.txt"
+    )
+    assert run_git("show", "dep-updates:pkg/requirements.txt", cwd=origin) == (
+        "pandas<=2.0.0,>=1.0.0\nnumpy<=2.0.0,>=1.0.0"
+    )
+    assert run_git("show", "dep-updates:requirements.txt", cwd=origin) == (
+        "pandas==1.0.0\nnumpy==1.0.0\nscipy"
+    )
+
+
+def test_hub_split_subdirectory(hub_subdirectory):
+    """Test the split branches only change the files of the working directory."""
+    origin, _ = hub_subdirectory
+    tester = FakeTester("all", True, {"pandas": "2.0.0", "numpy": "2.0.0"})
+    with FakeGitHub() as github:
+        post_run_hook([tester], _split_conf(github.url))
+
+    assert sorted(pull["head"] for pull in github.pulls) == [
+        "dep-updates-numpy",
+        "dep-updates-pandas",
+    ]
+    for package, expected in [
+        ("pandas", "pandas<=2.0.0,>=1.0.0\nnumpy==1.0.0"),
+        ("numpy", "pandas==1.0.0\nnumpy<=2.0.0,>=1.0.0"),
+    ]:
+        branch = f"dep-updates-{package}"
+        assert run_git("ls-tree", "-r", "--name-only", branch, cwd=origin) == (
+            "pkg/requirements.txt\nrequirements.txt"
+        )
+        assert run_git("show", f"{branch}:pkg/requirements.txt", cwd=origin) == expected
+        assert run_git("show", f"{branch}:requirements.txt", cwd=origin) == (
+            "pandas==1.0.0\nnumpy==1.0.0\nscipy"
+        )
+
+
+@pytest.mark.parametrize("split", ["off", "package"])
+def test_hub_lease(split, hub_origin, tmp_path, git_identity):
+    """Test no PR is submitted while another run holds the lease of the branch."""
+    origin, _ = hub_origin
+    other = Lease(
+        GitBackend(_run_command),
+        "https://abcd1234@github.com/test-org/test-repo.git",
+        "dep-updates",
+        "github.com/test-org/test-repo",
+        lock_dir=tmp_path / "other-machine",
+    )
+    other.acquire()
+    tester = FakeTester("all", True, {"pandas": "2.0.0", "numpy": "2.0.0"})
+    with FakeGitHub() as github:
+        conf = _split_conf(
+            github.url,
+            split_prs=split,
+            lease=True,
+            lease_wait=0,
+            lease_dir=str(tmp_path / "locks"),
+            commit_mode="plumbing",
+        )
+        post_run_hook([tester], conf)
+        assert github.pulls == []
+
+        other.release()
+        post_run_hook([tester], conf)
+        assert len(github.pulls) == (1 if split == "off" else 2)
+    assert run_git("for-each-ref", "refs/edgetest", cwd=origin) == ""
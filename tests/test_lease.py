@@ -0,0 +1,79 @@
+"""Test the lease on the updater branch."""
+import time
+
+import pytest
+
+from edgetest_hub.backends import GitBackend
+from edgetest_hub.lease import Lease, LeaseHeldError, lease_owner
+from edgetest_hub.utils import CommandTimeoutError, _run_command, command_timeouts
+from tests.conftest import run_git
+
+REF = "refs/edgetest/locks/dep-updates"
+
+
+@pytest.fixture
+def origin(tmp_path, monkeypatch, git_identity):
+    """Create an empty repository, chdir into it, and return a bare remote."""
+    monkeypatch.chdir(tmp_path)
+    run_git("init", "--bare", "origin.git")
+    run_git("init", "repo")
+    monkeypatch.chdir(tmp_path / "repo")
+    yield str(tmp_path / "origin.git")
+
+
+def _lease(origin, lock_dir, ttl=3600):
+    """Build a lease on ``dep-updates``."""
+    return Lease(
+        GitBackend(_run_command),
+        origin,
+        "dep-updates",
+        "github.com/org/repo",
+        ttl=ttl,
+        lock_dir=lock_dir,
+    )
+
+
+def test_lease(origin, tmp_path):
+    """Test a single run holds the lease, on the same machine or another one."""
+    first = _lease(origin, tmp_path / "locks")
+    assert first.holder() is None
+    assert first.acquire() == 0
+    holder = first.holder()
+    assert holder["owner"] == lease_owner()
+    assert holder["expires"] > time.time() + 3500
+    assert run_git("ls-remote", origin, REF).split()[0] == first.sha
+
+    assert _lease(origin, tmp_path / "locks").try_acquire() == (
+        "another run on this machine"
+    )
+    other = _lease(origin, tmp_path / "other")
+    assert other.try_acquire() == lease_owner()
+    with pytest.raises(LeaseHeldError) as err:
+        other.acquire(wait=0.2, interval=0.1)
+    assert err.value.branch == "dep-updates"
+    start = time.monotonic()
+    with command_timeouts(budget=0.3), pytest.raises(CommandTimeoutError):
+        other.acquire(wait=60, interval=0.1)
+    assert time.monotonic() - start < 30
+
+    first.release()
+    assert run_git("ls-remote", origin, REF) == ""
+    assert other.acquire() == 0
+    other.release()
+
+
+def test_expired_lease(origin, tmp_path):
+    """Test a lease left behind by a crashed run is taken over once it expires."""
+    crashed = _lease(origin, tmp_path / "crashed", ttl=0.5)
+    crashed.acquire()
+    crashed._unlock()
+
+    other = _lease(origin, tmp_path / "other")
+    assert other.try_acquire() == lease_owner()
+    assert other.acquire(wait=5, interval=0.2) > 0
+    assert run_git("ls-remote", origin, REF).split()[0] == other.sha
+
+    crashed.release()  # the lease is no longer its own
+    assert run_git("ls-remote", origin, REF).split()[0] == other.sha
+    other.release()
+    assert run_git("ls-remote", origin, REF) == ""
@@ -0,0 +1,121 @@
+"""Test the metrics of the plugin runs."""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from unittest.mock import patch
+
+from edgetest_hub.metrics import run_summary, write_metrics
+from edgetest_hub.plugin import post_run_hook
+from tests.conftest import hub_conf
+from tests.github_server import FakeGitHub
+
+GIT_STATUS_CHANGED = "1 .M N... 100644 100644 100644 abc abc requirements.txt\0"
+
+
+def _conf(api_url, metrics_dir):
+    """Build a configuration writing metrics."""
+    return hub_conf(
+        open_issue_on_fail=False,
+        github_client="rest",
+        api_url=api_url,
+        metrics_dir=str(metrics_dir),
+    )
+
+
+def test_write_metrics(tmp_path):
+    """Test each run adds to the counters and histograms of the previous ones."""
+    spans = [
+        {
+            "name": "post_run_hook",
+            "category": "phase",
+            "start": 1.0,
+            "duration": 3.0,
+            "parent": None,
+            "attributes": {},
+        },
+        {
+            "name": "submit_update",
+            "category": "phase",
+            "start": 1.1,
+            "duration": 2.0,
+            "parent": 1,
+            "attributes": {"outcome": "no changes"},
+        },
+        {
+            "name": "push",
+            "category": "step",
+            "start": 1.2,
+            "duration": 0.2,
+            "parent": 2,
+            "attributes": {},
+        },
+        {
+            "name": "git push",
+            "category": "command",
+            "start": 1.2,
+            "duration": 0.2,
+            "parent": 3,
+            "attributes": {},
+        },
+    ]
+    summary = run_summary(spans, "post_run_hook")
+    assert summary["outcome"] == "no_changes"
+    assert summary["seconds"] == 3.0
+    assert summary["steps"] == {"push": 0.2}
+    assert summary["commands"] == {"command": 1}
+
+    write_metrics(tmp_path, "github.com/org/repo", summary)
+    prom, summary_path = write_metrics(
+        tmp_path, "github.com/org/repo", dict(summary, seconds=0.05)
+    )
+
+    assert prom.name == "edgetest_hub_github.com_org_repo.prom"
+    lines = prom.read_text().splitlines()
+    labels = 'outcome="no_changes",repo="github.com/org/repo"'
+    assert "# TYPE edgetest_hub_runs_total counter" in lines
+    assert f"edgetest_hub_runs_total{{{labels}}} 2" in lines
+    assert f'edgetest_hub_run_seconds_bucket{{{labels},le="0.1"}} 1' in lines
+    assert f'edgetest_hub_run_seconds_bucket{{{labels},le="5"}} 2' in lines
+    assert f'edgetest_hub_run_seconds_bucket{{{labels},le="+Inf"}} 2' in lines
+    assert f"edgetest_hub_run_seconds_sum{{{labels}}} 3.05" in lines
+    assert 'edgetest_hub_last_run_seconds{repo="github.com/org/repo"} 0.05' in lines
+    assert json.loads(summary_path.read_text())["last_run"]["seconds"] == 0.05
+    assert not [path for path in os.listdir(tmp_path) if path.endswith(".tmp")]
+
+
+def test_write_metrics_concurrent(tmp_path):
+    """Test runs writing the metrics at the same time all add to the totals."""
+    summary = {
+        "outcome": "submitted",
+        "seconds": 1.0,
+        "finished": 1.0,
+        "steps": {},
+        "commands": {},
+    }
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        for _ in range(16):
+            pool.submit(write_metrics, tmp_path, "org/repo", summary)
+    prom = tmp_path / "edgetest_hub_org_repo.prom"
+    labels = 'outcome="submitted",repo="org/repo"'
+    assert f"edgetest_hub_runs_total{{{labels}}} 16" in prom.read_text().splitlines()
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+@patch("edgetest_hub.plugin._run_command", autospec=True)
+def test_hook_metrics(mock_run_command, tmp_path):
+    """Test the hook writes the outcome and step latencies of each run."""
+    mock_run_command.return_value = (GIT_STATUS_CHANGED, 0)
+    passed = type("Tester", (), {"status": True})()
+    failed = type("Tester", (), {"status": False})()
+    with FakeGitHub() as github:
+        conf = _conf(github.url, tmp_path)
+        post_run_hook([passed], conf)
+        post_run_hook([failed], conf)
+
+    repo = 'repo="github.com/test-org/test-repo"'
+    lines = (tmp_path / "edgetest_hub_github.com_test-org_test-repo.prom").read_text()
+    lines = lines.splitlines()
+    assert f'edgetest_hub_runs_total{{outcome="submitted",{repo}}} 1' in lines
+    assert f'edgetest_hub_runs_total{{outcome="skipped",{repo}}} 1' in lines
+    assert f'edgetest_hub_step_seconds_count{{{repo},step="push"}} 1' in lines
+    assert f'edgetest_hub_commands_total{{kind="api",{repo}}} 2' in lines
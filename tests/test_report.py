@@ -0,0 +1,114 @@
+"""Test the size-bounded failure report."""
+import gzip
+import tracemalloc
+
+from edgetest.report import gen_report
+
+from edgetest_hub.report import artifact_chunks, build_report, log_tail, report_rows
+from tests.conftest import FakeTester
+
+
+def test_report_fits(tmp_path):
+    """Test a report within the budget is the edgetest table, with no artifact."""
+    testers = [
+        FakeTester("core", True, {"pandas": "2.0.0"}),
+        FakeTester("broken", False, {"numpy": "2.0.0", "scipy": "1.11.0"}),
+    ]
+    report = build_report(testers, artifact_dir=tmp_path, name="abc")
+
+    assert report.summary == gen_report(testers, output_type="github")
+    assert report.artifact is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_report_rows_old_tester():
+    """Test the rows of testers without ``setup_status`` nor ``lowered_packages``."""
+    tester = type(
+        "Tester",
+        (),
+        {
+            "envname": "core",
+            "status": True,
+            "upgraded_packages": lambda self: [{"name": "pandas", "version": "2.0"}],
+        },
+    )()
+    assert list(report_rows([tester])) == [["core", None, True, "pandas", "", "2.0"]]
+
+
+def test_report_budget(tmp_path):
+    """Test the rows past the budget are only in the artifact."""
+    testers = [
+        FakeTester(f"env{i}", False, {f"package-{i}": "1.0.0"}) for i in range(2000)
+    ]
+    report = build_report(testers, budget=4096, artifact_dir=tmp_path, name="abc")
+
+    assert len(report.summary.encode("utf-8")) <= 4096
+    assert report.omitted > 1900
+    assert report.summary.endswith(
+        f"{report.omitted} more rows are in the full report."
+    )
+    assert report.artifact == str(tmp_path / "edgetest-hub-report-abc.md.gz")
+    with gzip.open(report.artifact, "rt") as artifact:
+        lines = artifact.read().splitlines()
+    assert lines[2].startswith("| Environment |")
+    assert lines[-1] == "| env1999 | True | False | package-1999 |  | 1.0.0 |"
+
+
+def test_report_logs(tmp_path):
+    """Test the end of the failing logs is in the summary, and all of them in the
+    artifact, with the memory used independent of their size."""
+    logs = tmp_path / "logs"
+    logs.mkdir()
+    with open(logs / "broken.log", "w") as log:
+        for i in range(200000):
+            log.write(f"line {i} of the ``pytest`` output\n")
+    (logs / "core.log").write_text("passing log\n")
+    testers = [
+        FakeTester("core", True, {"pandas": "2.0.0"}),
+        FakeTester("broken", False, {"numpy": "2.0.0"}),
+        FakeTester("nolog", False, {"scipy": "1.11.0"}),
+    ]
+
+    tracemalloc.start()
+    report = build_report(
+        testers,
+        budget=8192,
+        logs=str(logs / "{env}.log"),
+        artifact_dir=tmp_path / "out",
+        name="abc",
+    )
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert peak < 1024 * 1024
+    assert len(report.summary.encode("utf-8")) <= 8192
+    assert report.omitted == 0
+    assert "<summary>End of the log of broken</summary>" in report.summary
+    assert "line 199999 of the ``pytest`` output\n```" in report.summary
+    assert "line 0 " not in report.summary
+    assert "passing log" not in report.summary
+    with gzip.open(report.artifact, "rt") as artifact:
+        text = artifact.read()
+    assert "## Log of broken" in text and "line 0 of" in text
+    assert "## Log of core" not in text
+
+
+def test_log_tail(tmp_path):
+    """Test the tail starts at a full line."""
+    path = tmp_path / "env.log"
+    path.write_text("first line\nsecond line\nthird line\n")
+    assert log_tail(path, 20) == "third line\n"
+    assert log_tail(path, 1000) == "first line\nsecond line\nthird line\n"
+
+
+def test_artifact_chunks(tmp_path):
+    """Test the artifact is split in chunks within the size, at line ends."""
+    path = tmp_path / "report.md.gz"
+    text = "".join(f"row {i} é\n" for i in range(100)) + "x" * 250 + "\n"
+    with gzip.open(path, "wt", encoding="utf-8") as artifact:
+        artifact.write(text)
+
+    chunks = list(artifact_chunks(path, 100))
+    assert "".join(chunks) == text
+    assert all(len(chunk.encode("utf-8")) <= 100 for chunk in chunks)
+    assert chunks[0].endswith("\n")
@@ -0,0 +1,130 @@
+"""Test the step scheduler."""
+import contextvars
+import threading
+import time
+
+import pytest
+
+from edgetest_hub.scheduler import Step, run_steps
+
+VAR: contextvars.ContextVar = contextvars.ContextVar("VAR", default="unset")
+
+
+def _record(order, name, delay=0.0, value=None):
+    """Build a step function that records when it runs."""
+
+    def func(results):
+        order.append(f"start {name}")
+        time.sleep(delay)
+        order.append(f"end {name}")
+        return value
+
+    return func
+
+
+def test_run_steps_serial():
+    """Test the steps run in order without concurrency."""
+    order = []
+    results = run_steps(
+        [
+            Step("a", _record(order, "a", value=1)),
+            Step("b", _record(order, "b")),
+            Step("c", lambda results: results["a"] + 1, ("a",)),
+        ]
+    )
+
+    assert order == ["start a", "end a", "start b", "end b"]
+    assert results == {"a": 1, "b": None, "c": 2}
+
+
+def test_run_steps_concurrent():
+    """Test independent steps overlap and dependents wait."""
+    order = []
+    start = time.monotonic()
+    results = run_steps(
+        [
+            Step("network", _record(order, "network", 0.3)),
+            Step("local", _record(order, "local", 0.3, value="local")),
+            Step("push", _record(order, "push"), ("network", "local")),
+        ],
+        max_workers=2,
+    )
+
+    assert time.monotonic() - start < 0.55
+    assert order[-2:] == ["start push", "end push"]
+    assert results["local"] == "local"
+
+
+def test_run_steps_missing_requirement():
+    """Test requirements outside of the steps are considered met."""
+    results = run_steps([Step("push", lambda results: "ok", ("missing",))], 2)
+    assert results == {"push": "ok"}
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_run_steps_done(max_workers):
+    """Test the steps that already ran are skipped, and their results used."""
+    order = []
+    results = run_steps(
+        [
+            Step("a", _record(order, "a", value=1)),
+            Step("b", lambda results: results["a"] + 1, ("a",)),
+        ],
+        max_workers,
+        done={"a": 5},
+    )
+
+    assert order == []
+    assert results == {"a": 5, "b": 6}
+
+
+def test_run_steps_error():
+    """Test the first error is raised and the dependent steps are skipped."""
+    order = []
+
+    def fail(results):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        run_steps(
+            [
+                Step("fail", fail),
+                Step("slow", _record(order, "slow", 0.1)),
+                Step("after", _record(order, "after"), ("fail",)),
+            ],
+            max_workers=2,
+        )
+
+    assert order == ["start slow", "end slow"]
+
+
+def test_run_steps_context():
+    """Test the steps see the context of the caller."""
+    token = VAR.set("set")
+    try:
+        results = run_steps(
+            [
+                Step("a", lambda results: (VAR.get(), threading.get_ident())),
+                Step("b", lambda results: VAR.get()),
+            ],
+            max_workers=2,
+        )
+    finally:
+        VAR.reset(token)
+
+    assert results["a"][0] == "set"
+    assert results["a"][1] != threading.get_ident()
+    assert results["b"] == "set"
+
+
+@pytest.mark.parametrize(
+    "steps",
+    [
+        [Step("a", print), Step("a", print)],
+        [Step("a", print, ("b",)), Step("b", print)],
+    ],
+)
+def test_run_steps_invalid(steps):
+    """Test duplicate names and out of order requirements are rejected."""
+    with pytest.raises(ValueError):
+        run_steps(steps)
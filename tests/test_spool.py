@@ -0,0 +1,231 @@
+"""Test the submissions handled in the background."""
+import json
+import logging
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+from click.testing import CliRunner
+
+from edgetest_hub.cli import cli
+from edgetest_hub.fleet import load_config
+from edgetest_hub.plugin import post_run_hook, run_spooled_job
+from edgetest_hub.spool import FAILED, PENDING, RUNNING, Spool
+from tests.conftest import run_git
+from tests.github_server import FakeGitHub
+
+CFG = """
+[edgetest.hub]
+git_repo_org = test-org
+git_repo_name = test-repo
+pr_reviewers = abc123
+open_issue_on_fail = True
+github_client = rest
+api_url = {api_url}
+api_retries = 0
+issue_dedupe = off
+submit_mode = spool
+spool_dir = {spool_dir}
+[edgetest.envs.myenv]
+upgrade =
+    myupgrade
+command =
+    pytest tests
+"""
+
+GIT_STATUS_CHANGED = "1 .M N... 100644 100644 100644 abc abc requirements.txt\0"
+
+
+@pytest.fixture
+def conf(tmp_path, monkeypatch):
+    """Create a configuration spooling its submissions to a fake GitHub."""
+    monkeypatch.setenv("GITHUB_TOKEN", "abcd1234")
+    monkeypatch.chdir(tmp_path)
+    with FakeGitHub() as github:
+        (tmp_path / "setup.cfg").write_text(
+            CFG.format(api_url=github.url, spool_dir=tmp_path / "spool")
+        )
+        yield github, load_config(tmp_path / "setup.cfg")
+
+
+def test_spool_retries(tmp_path):
+    """Test a failed job is retried with a backoff, then given up."""
+    spool = Spool(tmp_path, retries=1, backoff=10)
+    job_id = spool.enqueue("update", {"hub": {}}, str(tmp_path), files={})
+
+    job = spool.claim()
+    assert job["id"] == job_id
+    assert job["worker_pid"] == os.getpid()
+    assert [j["state"] for j in spool.jobs()] == [RUNNING]
+    assert spool.claim() is None
+
+    spool.finish(job, "boom")
+    (job,) = spool.jobs()
+    assert (job["state"], job["attempts"], job["error"]) == (PENDING, 1, "boom")
+    assert job["retry_at"] > time.time() + 9
+    assert spool.claim() is None  # not due yet
+
+    with patch("edgetest_hub.spool.time.time", return_value=job["retry_at"] + 1):
+        job = spool.claim()
+    spool.finish(job, "boom again")
+    (job,) = spool.jobs()
+    assert (job["state"], job["attempts"]) == (FAILED, 2)
+
+    assert spool.retry_failed() == 1
+    spool.finish(spool.claim())
+    assert spool.jobs() == []
+
+
+def test_spool_recover(tmp_path):
+    """Test a job left running by a worker that died is put back."""
+    spool = Spool(tmp_path)
+    spool.enqueue("update", {"hub": {}}, str(tmp_path), files={})
+    job = spool.claim()
+    spool._write(RUNNING, dict(job, worker_pid=2**22 + 1))
+
+    assert spool.recover() == 1
+    assert [j["state"] for j in spool.jobs()] == [PENDING]
+    assert spool.drain(lambda job: None) == 1
+    assert spool.jobs() == []
+
+
+@patch("edgetest_hub.spool.Spool.start_worker", autospec=True)
+@patch("edgetest_hub.plugin._run_command", autospec=True)
+def test_hook_spool(mock_run_command, mock_start_worker, conf, tmp_path):
+    """Test the hook spools the submission without the token, and returns."""
+    _, conf = conf
+    mock_run_command.side_effect = [(GIT_STATUS_CHANGED, 0), ("", 0)]
+    (tmp_path / "requirements.txt").write_text("pandas==2.0.0\n")
+    tester = type("Tester", (), {"status": True})()
+
+    post_run_hook([tester], conf)
+
+    assert mock_run_command.call_count == 2  # only the status check and its prefix
+    mock_start_worker.assert_called_once()
+    (path,) = (tmp_path / "spool" / PENDING).glob("*.json")
+    assert "abcd1234" not in path.read_text()
+    job = json.loads(path.read_text())
+    assert job["kind"] == "update"
+    assert job["repo_dir"] == str(tmp_path)
+    assert job["files"]["requirements.txt"] == "pandas==2.0.0\n"
+
+
+def test_drain_issue(conf, tmp_path):
+    """Test draining an issue job, retried after the API failed."""
+    github, conf = conf
+    spool = Spool(conf["hub"]["spool_dir"], backoff=0)
+    spool.enqueue(
+        "issue", {"hub": conf["hub"]}, str(tmp_path), report="report", fingerprint="abc"
+    )
+    github.errors.append((500, {}, {"message": "Server Error"}))
+
+    cwd = os.getcwd()
+    assert spool.drain(run_spooled_job) == 2
+    assert os.getcwd() == cwd
+    assert spool.jobs() == []
+    assert len(github.issues) == 1
+    assert github.issues[0]["body"].endswith("<!-- edgetest-hub fingerprint: abc -->")
+
+
+def test_cli_status(tmp_path):
+    """Test listing the jobs."""
+    spool = Spool(tmp_path)
+    runner = CliRunner()
+    result = runner.invoke(cli, ["status", "--spool-dir", str(tmp_path)])
+    assert "No jobs" in result.output
+
+    job_id = spool.enqueue("issue", {"hub": {}}, "/my/repo", report="", fingerprint="")
+    spool.finish(spool.claim(), "RuntimeError: boom")
+    result = runner.invoke(cli, ["status", "--spool-dir", str(tmp_path)])
+    assert result.exit_code == 0
+    assert job_id in result.output
+    assert "RuntimeError: boom" in result.output
+
+
+@pytest.fixture
+def hub_origin(tmp_path, monkeypatch):
+    """Clone a bare ``test-org/test-repo`` that pushes to ``https://github.com/``
+    go to."""
+    origin = tmp_path / "origins" / "test-repo.git"
+    run_git("init", "--bare", "--initial-branch=develop", str(origin), cwd=tmp_path)
+    repo = tmp_path / "repo"
+    run_git("clone", "--quiet", str(origin), str(repo), cwd=tmp_path)
+    run_git("config", "user.name", "Tester", cwd=repo)
+    run_git("config", "user.email", "tester@example.com", cwd=repo)
+    (repo / "pkg").mkdir()
+    (repo / "requirements.txt").write_text("pandas==1.0.0\n")
+    (repo / "pkg" / "requirements.txt").write_text("numpy==1.0.0\n")
+    run_git("add", ".", cwd=repo)
+    run_git("commit", "-m", "initial", cwd=repo)
+    run_git("push", "--quiet", "origin", "develop", cwd=repo)
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    monkeypatch.setenv(
+        "GIT_CONFIG_KEY_0", f"url.{(tmp_path / 'origins').as_uri()}/.insteadOf"
+    )
+    monkeypatch.setenv("GIT_CONFIG_VALUE_0", "https://abcd1234@github.com/test-org/")
+    return origin, repo
+
+
+def test_drain_update(conf, hub_origin):
+    """Test an update is pushed from a private worktree, leaving the repository
+    alone."""
+    github, conf = conf
+    origin, repo = hub_origin
+    (repo / "requirements.txt").write_text("pandas==3.0.0\n")  # changed since
+    spool = Spool(conf["hub"]["spool_dir"])
+    spool.enqueue(
+        "update",
+        {"hub": conf["hub"]},
+        str(repo),
+        files={"requirements.txt": "pandas==2.0.0\n"},
+        groups=None,
+    )
+
+    cwd = os.getcwd()
+    assert spool.drain(run_spooled_job) == 1
+    assert os.getcwd() == cwd
+    assert spool.jobs() == []
+    assert [pull["head"] for pull in github.pulls] == ["dep-updates"]
+    assert (
+        run_git("show", "dep-updates:requirements.txt", cwd=origin) == "pandas==2.0.0"
+    )
+    assert (
+        run_git("show", "dep-updates:pkg/requirements.txt", cwd=origin)
+        == "numpy==1.0.0"
+    )
+    assert (repo / "requirements.txt").read_text() == "pandas==3.0.0\n"
+    assert run_git("status", "--porcelain", cwd=repo) == "M requirements.txt"
+    assert run_git("rev-parse", "--abbrev-ref", "HEAD", cwd=repo) == "develop"
+    assert run_git("worktree", "list", cwd=repo).count("\n") == 0
+
+
+def test_drain_update_subdirectory(conf, hub_origin, caplog):
+    """Test an update spooled from a subdirectory only changes its files, and the
+    override of the commit mode is logged."""
+    github, conf = conf
+    origin, repo = hub_origin
+    spool = Spool(conf["hub"]["spool_dir"])
+    spool.enqueue(
+        "update",
+        {"hub": {**conf["hub"], "commit_mode": "worktree"}},
+        str(repo / "pkg"),
+        files={"requirements.txt": "numpy==2.0.0\n"},
+        groups=None,
+    )
+
+    with caplog.at_level(logging.INFO):
+        assert spool.drain(run_spooled_job) == 1
+    assert "instead of commit_mode = worktree" in caplog.text
+    assert [pull["head"] for pull in github.pulls] == ["dep-updates"]
+    assert run_git("ls-tree", "-r", "--name-only", "dep-updates", cwd=origin) == (
+        "pkg/requirements.txt\nrequirements.txt"
+    )
+    assert (
+        run_git("show", "dep-updates:pkg/requirements.txt", cwd=origin)
+        == "numpy==2.0.0"
+    )
+    assert (
+        run_git("show", "dep-updates:requirements.txt", cwd=origin) == "pandas==1.0.0"
+    )
+    assert run_git("status", "--porcelain", cwd=repo) == ""
@@ -0,0 +1,64 @@
+"""Test the plugin adds next to nothing to edgetest when it has nothing to do."""
+import os
+from unittest.mock import patch
+
+import pytest
+
+from benchmarks.startup import (
+    DEFERRED_MODULES,
+    HOOK_BUDGET,
+    IMPORT_BUDGET,
+    OPTIONAL_MODULES,
+    hook_overhead,
+    import_time,
+    imported_modules,
+)
+from edgetest_hub.plugin import post_run_hook, pre_run_hook
+
+# wall-clock budgets depend on the machine, see ``python -m benchmarks startup``,
+# while the imports below are checked on every run, in a fresh interpreter
+timing = pytest.mark.skipif(
+    not os.environ.get("EDGETEST_HUB_TIMING"),
+    reason="set EDGETEST_HUB_TIMING=1 to check the startup budgets",
+)
+
+
+def test_deferred_imports():
+    """Test the modules needed to submit are not imported with the plugin."""
+    assert set(DEFERRED_MODULES) & set(imported_modules()) == set()
+
+
+def test_optional_imports():
+    """Test the optional dependencies are not imported with the plugin."""
+    assert set(OPTIONAL_MODULES) & set(imported_modules()) == set()
+
+
+@timing
+def test_import_budget():
+    """Test the import of the plugin, after edgetest, is within its budget."""
+    assert import_time(repeat=3) < IMPORT_BUDGET
+
+
+@timing
+def test_hook_budget():
+    """Test the hooks return within their budget when the plugin is skipped."""
+    overhead = hook_overhead(number=200)
+    assert len(overhead) == 4
+    assert {name: s for name, s in overhead.items() if s > HOOK_BUDGET} == {}
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": ""})
+@patch("edgetest_hub.plugin._get_github_client", autospec=True)
+@patch("edgetest_hub.plugin._run_command", autospec=True)
+def test_skip_path(mock_run_command, mock_client):
+    """Test nothing is run when the token or the hub section is missing."""
+    tester = type("Tester", (), {"status": True})()
+    pre_run_hook({"envs": []})
+    post_run_hook([tester], {"envs": []})
+    del os.environ["GITHUB_TOKEN"]
+    conf = {"hub": {"git_repo_org": "org", "git_repo_name": "repo", "prefetch": True}}
+    pre_run_hook(conf)
+    post_run_hook([tester], conf)
+
+    mock_run_command.assert_not_called()
+    mock_client.assert_not_called()
@@ -0,0 +1,125 @@
+"""Test the state store."""
+import os
+import time
+from unittest.mock import Mock, patch
+
+from edgetest_hub.backends import GitBackend
+from edgetest_hub.plugin import create_issue, submit_update
+from edgetest_hub.state import Run, StateStore
+from tests.conftest import hub_conf
+
+CONF = hub_conf(issue_dedupe="skip")
+
+
+def test_state_store(tmp_path):
+    """Test recording and looking up runs."""
+    path = tmp_path / "nested" / "state.sqlite"
+    state = StateStore(path)
+    state.record(Run("repo", "dep-updates", 1.0, 2.0, "submitted", "abc", "pr/1"))
+    state.record(
+        Run("repo", "dep-updates", time.time(), 2.0, "submitted", "def", "pr/2")
+    )
+    state.record(Run("repo", "dep-updates", time.time(), 1.0, "no changes"))
+    state.record(Run("repo", "other", time.time(), 1.0, "submitted", "ghi", "pr/3"))
+    state.record(
+        Run(
+            "repo",
+            "dep-updates",
+            time.time(),
+            1.0,
+            "issue",
+            issue_url="issue/1",
+            fingerprint="fp",
+        )
+    )
+
+    assert state.last_submission("repo", "dep-updates").pr_url == "pr/2"
+    assert state.last_submission("missing", "dep-updates") is None
+    assert state.issue_for("repo", "fp") == "issue/1"
+    assert state.issue_for("repo", "other") is None
+    state.close()
+
+    state = StateStore(path, retention_days=1)
+    assert state.last_submission("repo", "dep-updates").content == "def"
+    state.prune(0)
+    assert state.last_submission("repo", "dep-updates") is None
+    state.close()
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_submit_update_cached(tmp_path, monkeypatch):
+    """Test the same files on the same base are not submitted twice."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "requirements.txt").write_text("pandas==2.0.0\n")
+    git = Mock(spec=GitBackend)
+    git.changed_files.return_value = ["requirements.txt"]
+    git.rev_parse.return_value = "base"
+    client = Mock()
+    client.create_pull_request.return_value = "https://github.com/org/repo/pull/1\n"
+    state = StateStore(tmp_path / "state.sqlite")
+    with patch("edgetest_hub.plugin._get_git_backend", return_value=git):
+        first = submit_update(CONF, client, state)
+        git.reset_mock()
+        second = submit_update(CONF, client, state)
+        (tmp_path / "requirements.txt").write_text("pandas==2.1.0\n")
+        submit_update(CONF, client, state)
+
+    assert first == second == "https://github.com/org/repo/pull/1"
+    assert client.create_pull_request.call_count == 2
+    assert git.push.call_count == 1
+    assert state.last_submission("github.com/test-org/test-repo", "dep-updates")
+    outcomes = state._conn.execute("SELECT outcome FROM runs ORDER BY id").fetchall()
+    assert [outcome for outcome, in outcomes] == ["submitted", "cached", "submitted"]
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_create_issue_cached(tmp_path):
+    """Test the issue recorded for a failure is used without looking it up."""
+    client = Mock()
+    client.find_issue.return_value = None
+    client.create_issue.return_value = "https://github.com/org/repo/issues/1\n"
+    state = StateStore(tmp_path / "state.sqlite")
+    create_issue("report", CONF, client, "fp", state)
+    create_issue("report", CONF, client, "fp", state)
+
+    assert client.find_issue.call_count == 1
+    assert client.create_issue.call_count == 1
+    assert state.issue_for("github.com/test-org/test-repo", "fp") == (
+        "https://github.com/org/repo/issues/1"
+    )
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_state_closed(tmp_path, monkeypatch):
+    """Test a closed issue or PR in the state store is not reused."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "requirements.txt").write_text("pandas==2.0.0\n")
+    git = Mock(spec=GitBackend)
+    git.changed_files.return_value = ["requirements.txt"]
+    git.rev_parse.return_value = "base"
+    client = Mock()
+    client.find_issue.return_value = None
+    client.create_issue.side_effect = [
+        "https://github.com/org/repo/issues/1\n",
+        "https://github.com/org/repo/issues/2\n",
+    ]
+    client.create_pull_request.return_value = "https://github.com/org/repo/pull/1\n"
+    client.is_open.return_value = False
+    state = StateStore(tmp_path / "state.sqlite")
+    conf = {"hub": dict(CONF["hub"], issue_dedupe="comment")}
+    with patch("edgetest_hub.plugin._get_git_backend", return_value=git):
+        create_issue("report", conf, client, "fp", state)
+        create_issue("report", conf, client, "fp", state)
+        submit_update(conf, client, state)
+        submit_update(conf, client, state)
+
+    client.comment_issue.assert_not_called()
+    assert client.create_issue.call_count == 2
+    assert state.issue_for("github.com/test-org/test-repo", "fp") == (
+        "https://github.com/org/repo/issues/2"
+    )
+    assert git.push.call_count == 2
+    assert client.is_open.call_args_list[-1].args == (
+        "test-org/test-repo",
+        "https://github.com/org/repo/pull/1",
+    )
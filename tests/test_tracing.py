@@ -0,0 +1,113 @@
+"""Test the spans of the plugin steps."""
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+from edgetest_hub.plugin import post_run_hook
+from edgetest_hub.scheduler import Step, run_steps
+from edgetest_hub.tracing import Tracer, span, traced, tracing
+from edgetest_hub.utils import _run_command
+from tests.conftest import hub_conf
+from tests.github_server import FakeGitHub
+
+GIT_STATUS_CHANGED = "1 .M N... 100644 100644 100644 abc abc requirements.txt\0"
+
+
+def test_span_nesting():
+    """Test spans nest by context, including in the steps run in threads."""
+
+    @traced()
+    def phase():
+        run_steps(
+            [
+                Step("a", lambda results: None),
+                Step("b", lambda results: None),
+            ],
+            max_workers=2,
+        )
+
+    tracer = Tracer()
+    with tracing(tracer):
+        phase()
+        with pytest.raises(ValueError):
+            with span("broken", "command", argv=["git"]) as attributes:
+                attributes["exit_status"] = 1
+                raise ValueError()
+    with span("untraced"):
+        pass
+
+    spans = {s["name"]: s for s in tracer.spans}
+    assert sorted(spans) == ["a", "b", "broken", "phase"]
+    assert spans["phase"]["parent"] is None
+    assert spans["a"]["parent"] == spans["b"]["parent"] == spans["phase"]["id"]
+    assert spans["broken"]["attributes"] == {
+        "argv": ["git"],
+        "exit_status": 1,
+        "error": "ValueError",
+    }
+
+    events = tracer.to_chrome()["traceEvents"]
+    assert [event["name"] for event in events][0] == "phase"
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+def test_command_span():
+    """Test a command span has the redacted argv, exit status and output size."""
+    tracer = Tracer()
+    with tracing(tracer):
+        _run_command("echo", "https://abcd1234@github.com/org/repo.git")
+        with pytest.raises(RuntimeError):
+            _run_command("false")
+
+    echo, false = tracer.spans
+    assert echo["name"] == "echo https://***@github.com/org/repo.git"
+    assert echo["attributes"] == {
+        "argv": ["echo", "https://***@github.com/org/repo.git"],
+        "exit_status": 0,
+        "stdout_bytes": 41,
+        "stderr_bytes": 0,
+    }
+    assert false["attributes"]["exit_status"] == 1
+    assert false["attributes"]["error"] == "CommandError"
+
+
+@patch.dict(os.environ, {"GITHUB_TOKEN": "abcd1234"})
+@patch("edgetest_hub.plugin._run_command", autospec=True)
+def test_hook_trace(mock_run_command, tmp_path):
+    """Test the hook writes the spans of the run as a Chrome trace."""
+    mock_run_command.return_value = (GIT_STATUS_CHANGED, 0)
+    tester = type("Tester", (), {"status": True})()
+    with FakeGitHub() as github:
+        conf = hub_conf(
+            open_issue_on_fail=True,
+            github_client="rest",
+            api_url=github.url,
+            trace_path=str(tmp_path / "traces" / "trace.json"),
+        )
+        post_run_hook([tester], conf)
+
+    trace = json.loads((tmp_path / "traces" / "trace.json").read_text())
+    events = {event["name"]: event for event in trace["traceEvents"]}
+    ids = {event["args"]["span_id"]: name for name, event in events.items()}
+    parents = {
+        name: ids.get(event["args"]["parent_id"]) for name, event in events.items()
+    }
+    assert parents == {
+        "post_run_hook": None,
+        "submit_update": "post_run_hook",
+        "delete_remote_branch": "submit_update",
+        "prepare_branch": "submit_update",
+        "commit": "submit_update",
+        "push": "submit_update",
+        "pull_request": "submit_update",
+        "POST /repos/test-org/test-repo/pulls": "pull_request",
+        "request_reviewers": "submit_update",
+        "POST /repos/test-org/test-repo/pulls/1/requested_reviewers": (
+            "request_reviewers"
+        ),
+    }
+    assert events["POST /repos/test-org/test-repo/pulls"]["args"]["status"] == 201
+    assert "abcd1234" not in json.dumps(trace)
@@ -0,0 +1,77 @@
+"""Test the utility functions."""
+import time
+from pathlib import Path
+
+import pytest
+
+from edgetest_hub.backends import blob_id
+from edgetest_hub.github import GitHubClient
+from edgetest_hub.scheduler import Step, run_steps
+from edgetest_hub.utils import (
+    CommandTimeoutError,
+    _run_command,
+    command_timeouts,
+    remaining_time,
+)
+from tests.github_server import FakeGitHub
+
+
+def test_run_command_stdin():
+    """Test feeding the standard input of a command."""
+    out, code = _run_command("git", "hash-object", "--stdin", stdin="")
+    assert out.strip() == blob_id(b"")
+    assert code == 0
+
+
+def test_run_command_no_terminal():
+    """Test a command waiting for input gets end of file rather than hanging."""
+    with command_timeouts(timeout=5):
+        out, _ = _run_command("cat")
+    assert out == ""
+
+
+@pytest.mark.skipif(not Path("/proc").is_dir(), reason="needs /proc")
+def test_run_command_timeout(tmp_path):
+    """Test the command and the processes it started are killed."""
+    pidfile = tmp_path / "pid"
+    start = time.monotonic()
+    with command_timeouts(timeout=0.5):
+        with pytest.raises(CommandTimeoutError) as err:
+            _run_command("sh", "-c", f"sleep 30 & echo $! > {pidfile}; wait")
+
+    assert time.monotonic() - start < 5
+    assert not isinstance(err.value, RuntimeError)
+    assert err.value.command == "sh -c"
+    time.sleep(0.1)
+    stat = Path(f"/proc/{pidfile.read_text().strip()}/stat")
+    assert not stat.exists() or stat.read_text().split()[2] == "Z"
+
+
+def test_run_command_deadline():
+    """Test the deadline is shared by the commands and names the step."""
+
+    def step(results):
+        _run_command("sleep", "0.3")
+        _run_command("sleep", "30")
+
+    start = time.monotonic()
+    with command_timeouts(timeout=10, budget=0.6):
+        with pytest.raises(CommandTimeoutError, match="Step wait timed out"):
+            run_steps([Step("wait", step)])
+        with pytest.raises(CommandTimeoutError):
+            remaining_time("git")
+
+    assert time.monotonic() - start < 5
+    assert remaining_time("git") is None
+
+
+def test_rest_client_timeout():
+    """Test a slow API request times out."""
+    with FakeGitHub() as github:
+        github.delay = 1
+        client = GitHubClient(github.url, "abcd1234")
+        with command_timeouts(timeout=0.2):
+            with pytest.raises(CommandTimeoutError) as err:
+                client.create_issue("test-org/test-repo", "title", "body")
+
+    assert err.value.command == "POST /repos/test-org/test-repo/issues"